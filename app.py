@@ -1,43 +1,104 @@
-# VERSÃO: 13.8 - Ordem: Bruto, Tara, Liquido, Descontos, Aplicado, Devolvido, Peso LDC (35), Saldo
+# VERSÃO: 15.7 - Aviso na tabela quando uma cláusula do filtro não é reconhecida (ela zera a visão em vez de ser ignorada)
 import dash
 from dash import dcc, html, Input, Output, State, dash_table, no_update, ctx
+from flask import abort, send_file, request, g, jsonify
 import dash_bootstrap_components as dbc
 from datetime import date, datetime
+import os
+import json
+import time
 import pandas as pd
 from dash.dash_table.Format import Format, Scheme, Group
-from backend.sap_data import SAPConnector
+from backend.sap_data import SAPConnector, formatar_exibicao, colunas_relatorio, coluna_numerica, restricoes_romaneio, filtrar_restricoes, COL_DATA, CAMPOS_RESTRICAO, ResultadoIncompletoSAP
+from backend.cache_resultados import CacheResultados
+from backend.fornecedores import normalizar_busca
+from backend.tabela_servidor import VisoesTabela, clausulas_filtro, clausula_entendida
+from backend.aquecimento import HistoricoBuscas, Aquecedor
+from backend.exportacao import ArquivosExportacao, FilaExportacao
 from backend.pdf_generator import gerar_pdf_detalhado, gerar_pdf_resumido
+from backend.metricas import span, registro, iniciar_requisicao, encerrar_requisicao, server_timing, exposicao_prometheus
+from backend.excel_generator import gerar_excel, gerar_csv, gerar_parquet, PARQUET_DISPONIVEL
 
 
-sap = SAPConnector()
+# Cache, tabela paginada e exportações trabalham com o schema compacto (formatar_exibicao na hora de mostrar)
+sap = SAPConnector(compacto=True)
+# Com APP_CACHE_RESULTADOS_DIR os resultados ficam também em disco, visíveis para todos os workers (servidor_producao.py)
+cache_resultados = CacheResultados(max_itens=int(os.getenv("APP_CACHE_RESULTADOS_ITENS", "32")), max_bytes=int(os.getenv("APP_CACHE_RESULTADOS_MB", "1024")) * 1024 * 1024,
+                                   diretorio=os.getenv("APP_CACHE_RESULTADOS_DIR") or None, max_bytes_disco=int(os.getenv("APP_CACHE_RESULTADOS_DISCO_MB", "4096")) * 1024 * 1024)
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP])
 app.title = "R.P.P - Relatório Padrão"
 server = app.server
 
+LIMITE_OPCOES = 50
+# A partir dessa quantidade de linhas a exportação vira job em segundo plano (arquivo em disco)
+# em vez de ser gerada dentro do callback e ir em base64
+EXPORT_DISCO_MIN_LINHAS = int(os.getenv("APP_EXPORT_DISCO_MIN_LINHAS", "1000"))
+exportacoes = ArquivosExportacao()
+# Por quanto tempo um resultado em memória pode ser recortado no lugar de uma nova busca no SAP
+REUSO_RESULTADO_SEG = int(os.getenv("APP_REUSO_RESULTADO_MIN", "10")) * 60
+fila_exportacao = FilaExportacao(exportacoes)
+# Server-Timing expõe os tempos internos a quem vê a resposta: fica desligado por padrão
+SERVER_TIMING = os.getenv("APP_SERVER_TIMING", "0") == "1"
+METRICS = os.getenv("APP_METRICS", "1") == "1"
+historico_buscas = HistoricoBuscas(os.getenv("APP_HISTORICO_BUSCAS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "historico_buscas.sqlite")))
+# Resultado baixado pelo aquecimento vale mais tempo: ele roda antes do pico justamente para ser reaproveitado
+REUSO_AQUECIDO_SEG = int(os.getenv("APP_AQUECIMENTO_REUSO_MIN", "60")) * 60
+
+# Linhas por página da tabela; filtro e ordenação do cabeçalho rodam no servidor
+TABELA_PAGINA = int(os.getenv("APP_TABELA_PAGINA", "100"))
+visoes_tabela = VisoesTabela()
+ESTILO_CAIXA_TABELA = {"flex": "1", "display": "flex", "flexDirection": "column", "overflow": "hidden"}
+
 BADGE_STYLE = {
     "backgroundColor": "#EF6100", "color": "white", "fontSize": "0.85rem",
     "padding": "4px 8px", "marginRight": "5px", "borderRadius": "4px",
     "fontWeight": "bold", "display": "inline-block"
 }
 
-# MUDANÇA: Ordem Atualizada Conforme Solicitação
-ORDEM_COLUNAS = [
-    "ID.apl", "Razão Social", "contrato", "Instr. EDC", "Romaneio", 
-    "Data do edc", "Material", "NomeMaterial", "NomeSafra", "Unidade", "Placa", 
-    "Nota Produtor", "Nota Fazendao", 
-    "Transgenia", 
-    "Peso Bruto (Kg)", "Peso Tara (Kg)", "Peso liquido (Kg)", 
-    "Descontos (Kg)", "Qtd Aplicada (Kg)", "Qtd Devolvida (Kg)", 
-    "Peso LDC (35) (Kg)", "Saldo (Kg)", 
-    "% Umidade", "Desconto Umidade (Kg)", 
-    "% Impurezas", "Desconto Impureza (Kg)"
-]
+def filtrar_resultado(df, material_sel, safra_sel, contrato_sel):
+    return filtrar_restricoes(df, restricoes_romaneio(material_sel, safra_sel, contrato_sel))
+
+# Restrições que foram no $filter da busca que gerou o resultado guardado
+def restricoes_do_resultado(chave):
+    return (cache_resultados.consulta(chave) or {}).get("restricoes", {})
+
+# A seleção atual pede linhas que o resultado guardado não tem (filtro da busca removido ou trocado)
+def selecao_mais_ampla(guardadas, atuais):
+    return any(atuais.get(c) != v for c, v in guardadas.items())
+
+# Um resultado guardado serve se é do mesmo parceiro, cobre o período e não tem filtro que a busca nova não tenha
+def cobre_consulta(guardada, nova):
+    return (guardada["parceiro"] == nova["parceiro"] and guardada["inicio"] <= nova["inicio"] and guardada["fim"] >= nova["fim"]
+            and all(nova["restricoes"].get(c) == v for c, v in guardada["restricoes"].items())
+            and time.time() - guardada["em"] < (REUSO_AQUECIDO_SEG if guardada.get("aquecido") else REUSO_RESULTADO_SEG))
+
+def guardar_aquecido(parceiro, inicio, fim, df):
+    cache_resultados.guardar(df, {"parceiro": str(parceiro), "inicio": inicio, "fim": fim, "restricoes": {}, "em": time.time(), "aquecido": True})
+
+aquecedor = Aquecedor(sap, historico_buscas, guardar_aquecido, parceiros=int(os.getenv("APP_AQUECIMENTO_PARCEIROS", "10")),
+                      workers=int(os.getenv("APP_AQUECIMENTO_WORKERS", "2")), pausa_seg=float(os.getenv("APP_AQUECIMENTO_PAUSA_SEG", "2")))
+# APP_AQUECIMENTO_HORARIOS: "auto" (antes das horas de pico do histórico) ou "HH:MM,HH:MM"
+if os.getenv("APP_AQUECIMENTO", "1") == "1": aquecedor.iniciar(os.getenv("APP_AQUECIMENTO_HORARIOS", "auto"))
+
+def recortar_periodo(df, inicio, fim):
+    datas = df[COL_DATA] if pd.api.types.is_datetime64_any_dtype(df[COL_DATA]) else pd.to_datetime(df[COL_DATA], format='%d/%m/%Y', errors='coerce')
+    return df[(datas >= pd.Timestamp(inicio)) & (datas <= pd.Timestamp(fim))]
+
+def criar_tabela():
+    return dash_table.DataTable(
+        id="tabela-romaneios", data=[], columns=[], fixed_rows={'headers': True},
+        style_table={'height': '100%', 'maxHeight': '100%', 'overflowY': 'auto'},
+        page_action="custom", page_current=0, page_size=TABELA_PAGINA, page_count=1,
+        filter_action="custom", filter_query="", sort_action="custom", sort_mode="multi", sort_by=[],
+        style_header={'backgroundColor': '#0C5959', 'color': 'white', 'fontWeight': 'bold', 'fontSize': '10px'},
+        style_cell={'fontSize': '10px', 'textAlign': 'left', 'padding': '2px 5px', 'minWidth': '80px'},
+        style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': '#f8f9fa'}]
+    )
 
 def serve_layout():
     return dbc.Container([
         dcc.Store(id="store-dados"),
-        dcc.Store(id="store-lista-fornecedores"),
     dbc.Navbar(
         dbc.Container([
             dbc.Row([
@@ -72,7 +133,11 @@ def serve_layout():
                     dbc.ButtonGroup([
                         dbc.Button([html.I(className="bi bi-file-earmark-excel me-1"), "Excel"], id="btn-excel", color="success", outline=True, size="sm"),
                         dbc.Button([html.I(className="bi bi-file-text me-1"), "Resumido"], id="btn-pdf-resumido", color="danger", outline=True, size="sm"),
-                        dbc.Button([html.I(className="bi bi-file-earmark-pdf-fill me-1"), "Detalhado"], id="btn-pdf-detalhado", color="danger", size="sm")
+                        dbc.Button([html.I(className="bi bi-file-earmark-pdf-fill me-1"), "Detalhado"], id="btn-pdf-detalhado", color="danger", size="sm"),
+                        dbc.DropdownMenu([
+                            dbc.DropdownMenuItem("CSV", id="btn-csv"),
+                            dbc.DropdownMenuItem("Parquet", id="btn-parquet", disabled=not PARQUET_DISPONIVEL)
+                        ], label=html.I(className="bi bi-database-down"), group=True, color="secondary", size="sm", toggle_class_name="px-2")
                     ], className="w-100 shadow-sm", style={"height": "31px"})
                 ], width=4)
             ], className="g-1 align-items-end")
@@ -80,115 +145,209 @@ def serve_layout():
     ], className="mb-1 shadow-sm mx-2 flex-shrink-0 mt-2"),
 
     html.Div(id="barra-totais", className="mb-1 mx-2 d-flex flex-wrap gap-2 flex-shrink-0"),
+    html.Div(id="aviso-busca", className="mx-2 flex-shrink-0"),
+    html.Div(id="progresso-exportacao", className="mx-2 flex-shrink-0"),
 
     html.Div(
         className="flex-grow-1 mx-2 mb-1 border rounded overflow-hidden bg-white d-flex flex-column",
         style={"minHeight": "0"}, 
-        children=[dcc.Loading(id="loading-wrapper", color="#EF6100", parent_style={"flex": "1", "display": "flex", "flexDirection": "column", "overflow": "hidden"}, children=[html.Div(id="area-tabela", style={"flex": "1", "display": "flex", "flexDirection": "column", "overflow": "hidden"})])]
+        children=[dcc.Loading(id="loading-wrapper", color="#EF6100", parent_style={"flex": "1", "display": "flex", "flexDirection": "column", "overflow": "hidden"}, children=[html.Div(id="area-tabela", style=ESTILO_CAIXA_TABELA, children=[html.Div(id="aviso-tabela"), html.Div(id="caixa-tabela", style={"display": "none"}, children=[criar_tabela()])])])]
     ),
-    dcc.Download(id="download-files")
+    dcc.Download(id="download-files"),
+    dcc.Store(id="store-download-url"),
+    dcc.Store(id="store-job-exportacao"),
+    dcc.Interval(id="intervalo-exportacao", interval=1000, disabled=True),
+    html.A(id="link-download", style={"display": "none"})
 ], fluid=True, className="vh-100 d-flex flex-column bg-light p-0 overflow-hidden")
 
 app.layout = serve_layout
 
-@app.callback(Output("store-lista-fornecedores", "data"), Input("radio-taxa", "value"))
-def carregar_base_local(tipo):
-    df = sap.buscar_fornecedores(tipo)
-    return df.to_dict('records') if not df.empty else []
-
-@app.callback([Output("dd-nome", "options"), Output("dd-codigo", "options"), Output("dd-doc", "options")], Input("store-lista-fornecedores", "data"))
-def popular_opcoes(data):
-    if not data: return [], [], []
-    opts_nome = sorted([{'label': d['SupplierName'], 'value': d['SupplierName']} for d in data], key=lambda x: x['label'])
-    opts_cod = sorted([{'label': f"{d['Supplier']}", 'value': d['Supplier']} for d in data], key=lambda x: x['label'])
-    opts_doc = sorted([{'label': d['BPTaxNumber'], 'value': d['BPTaxNumber']} for d in data], key=lambda x: x['label'])
-    return opts_nome, opts_cod, opts_doc
-
-@app.callback([Output("dd-nome", "value"), Output("dd-codigo", "value"), Output("dd-doc", "value")], [Input("dd-nome", "value"), Input("dd-codigo", "value"), Input("dd-doc", "value")], State("store-lista-fornecedores", "data"), prevent_initial_call=True)
-def sincronizar_filtros(nome, codigo, doc, data):
-    if not data: return no_update, no_update, no_update
+def opcoes_fornecedor(tipo, campo, busca, valor):
+    valores = sap.fornecedores.buscar(tipo, campo, busca, LIMITE_OPCOES)
+    # O valor selecionado precisa continuar nas opções, senão o dropdown some com ele
+    if valor and valor not in valores: valores = [valor] + valores
+    # O dcc.Dropdown ainda filtra no navegador (prefixo por palavra, sem tirar acento nem pontuação):
+    # `search` leva o texto normalizado e o termo buscado, para ele não esconder o que o servidor achou
+    termo = f" {busca}" if busca else ""
+    return [{'label': v, 'value': v, 'search': normalizar_busca(v, campo) + termo} for v in valores]
+
+@app.callback(Output("dd-nome", "options"), Input("dd-nome", "search_value"), Input("dd-nome", "value"), Input("radio-taxa", "value"))
+def opcoes_nome(busca, valor, tipo):
+    return opcoes_fornecedor(tipo, 'SupplierName', busca, valor)
+
+@app.callback(Output("dd-codigo", "options"), Input("dd-codigo", "search_value"), Input("dd-codigo", "value"), Input("radio-taxa", "value"))
+def opcoes_codigo(busca, valor, tipo):
+    return opcoes_fornecedor(tipo, 'Supplier', busca, valor)
+
+@app.callback(Output("dd-doc", "options"), Input("dd-doc", "search_value"), Input("dd-doc", "value"), Input("radio-taxa", "value"))
+def opcoes_doc(busca, valor, tipo):
+    return opcoes_fornecedor(tipo, 'BPTaxNumber', busca, valor)
+
+@app.callback([Output("dd-nome", "value"), Output("dd-codigo", "value"), Output("dd-doc", "value")], [Input("dd-nome", "value"), Input("dd-codigo", "value"), Input("dd-doc", "value"), Input("radio-taxa", "value")], prevent_initial_call=True)
+def sincronizar_filtros(nome, codigo, doc, tipo):
     ctx_id = ctx.triggered_id
-    df = pd.DataFrame(data)
-    row = None
-    if ctx_id == "dd-nome" and nome: row = df[df['SupplierName'] == nome]
-    elif ctx_id == "dd-codigo" and codigo: row = df[df['Supplier'] == codigo]
-    elif ctx_id == "dd-doc" and doc: row = df[df['BPTaxNumber'] == doc]
-    if row is not None and not row.empty:
-        r = row.iloc[0]
+    if ctx_id == "radio-taxa": return None, None, None
+    r = None
+    if ctx_id == "dd-nome" and nome: r = sap.fornecedores.obter(tipo, 'SupplierName', nome)
+    elif ctx_id == "dd-codigo" and codigo: r = sap.fornecedores.obter(tipo, 'Supplier', codigo)
+    elif ctx_id == "dd-doc" and doc: r = sap.fornecedores.obter(tipo, 'BPTaxNumber', doc)
+    if r is not None:
         return r['SupplierName'], r['Supplier'], r['BPTaxNumber']
     return no_update, no_update, no_update
 
-@app.callback(Output("store-dados", "data"), Output("dd-material", "options"), Output("dd-material", "value"), Output("dd-safra", "options"), Output("dd-safra", "value"), Output("dd-contrato", "options"), Output("dd-contrato", "value"), Input("btn-carregar", "n_clicks"), State("dt-inicio", "value"), State("dt-fim", "value"), State("dd-codigo", "value"), prevent_initial_call=True)
-def buscar_dados_sap(n, start, end, parceiro_id):
-    if not parceiro_id: return [], [], None, [], None, [], None
-    df = sap.buscar_dados_por_periodo(start, end, parceiro_id=parceiro_id)
-    if df.empty: return [], [], None, [], None, [], None
+@app.callback(Output("store-dados", "data"), Output("aviso-busca", "children"), Output("dd-material", "options"), Output("dd-material", "value"), Output("dd-safra", "options"), Output("dd-safra", "value"), Output("dd-contrato", "options"), Output("dd-contrato", "value"), Input("btn-carregar", "n_clicks"), Input("dd-material", "value"), Input("dd-safra", "value"), Input("dd-contrato", "value"), State("dt-inicio", "value"), State("dt-fim", "value"), State("dd-codigo", "value"), State("dd-nome", "value"), State("store-dados", "data"), prevent_initial_call=True)
+def buscar_dados_sap(n, material_sel, safra_sel, contrato_sel, start, end, parceiro_id, nome_parceiro, chave):
+    if ctx.triggered_id in ("dd-material", "dd-safra", "dd-contrato"):
+        # Estreitar a seleção é recorte local; tirar ou trocar um filtro que foi no $filter da busca
+        # exige buscar de novo (mesmo parceiro e período do resultado), senão a tela mostra só o subconjunto
+        consulta = cache_resultados.consulta(chave)
+        if consulta is None or not selecao_mais_ampla(consulta["restricoes"], restricoes_romaneio(material_sel, safra_sel, contrato_sel)): return (no_update,) * 8
+        parceiro_id, nome_parceiro, start, end = consulta["parceiro"], consulta.get("nome"), consulta["inicio"], consulta["fim"]
+    if not parceiro_id: return None, None, [], None, [], None, [], None
+    # Filtros já escolhidos na hora do BUSCAR viram restrição da busca: se já existe em memória
+    # um resultado que contém o pedido, recorta localmente; senão vão no $filter do SAP.
+    # Sem filtros, BUSCAR de novo significa dados novos: só o que o aquecimento baixou é reaproveitado.
+    restricoes = restricoes_romaneio(material_sel, safra_sel, contrato_sel)
+    consulta = {"parceiro": str(parceiro_id), "nome": nome_parceiro, "inicio": start, "fim": end, "restricoes": restricoes, "em": time.time()}
+    t = time.perf_counter()
+    achado = cache_resultados.procurar(lambda guardada: cobre_consulta(guardada, consulta) and (restricoes or guardada.get("aquecido")))
+    if achado is not None:
+        _, df, guardada = achado
+        if (guardada["inicio"], guardada["fim"]) != (start, end): df = recortar_periodo(df, start, end)
+        df = filtrar_restricoes(df, restricoes)
+        consulta["em"] = guardada["em"]
+    else:
+        # Vários usuários clicando BUSCAR no mesmo parceiro/período ao mesmo tempo: um baixa, os outros esperam
+        voo = json.dumps([str(parceiro_id), start, end, restricoes], sort_keys=True)
+        try:
+            with span("buscar_dados_sap", parceiro=str(parceiro_id)):
+                df = cache_resultados.uma_vez(voo, lambda: sap.buscar_dados_por_periodo(start, end, parceiro_id=parceiro_id, material=material_sel, safra=safra_sel, contrato=contrato_sel))
+        except ResultadoIncompletoSAP as e:
+            aviso = dbc.Alert(f"O SAP interrompeu o download ({e.linhas:,} romaneios recebidos em {e.paginas} páginas). O resultado parcial foi descartado para não mostrar totais errados: clique em BUSCAR novamente.".replace(",", "."), color="danger", className="py-1 mb-1 small", dismissable=True)
+            return None, aviso, [], None, [], None, [], None
+    historico_buscas.registrar(parceiro_id, start, end, time.perf_counter() - t if achado is None else 0, len(df), "sap" if achado is None else "cache")
+    if df.empty: return None, None, [], None, [], None, [], None
     
     materiais = sorted(df['NomeMaterial'].astype(str).dropna().unique())
     safras = sorted(df['NomeSafra'].astype(str).dropna().unique())
     contratos = sorted(df['contrato'].astype(str).dropna().unique())
     
-    return df.to_dict('records'), [{'label': m, 'value': m} for m in materiais], None, [{'label': s, 'value': s} for s in safras], None, [{'label': c, 'value': c} for c in contratos], None
+    return cache_resultados.guardar(df, consulta), None, [{'label': m, 'value': m} for m in materiais], material_sel, [{'label': s, 'value': s} for s in safras], safra_sel, [{'label': c, 'value': c} for c in contratos], contrato_sel
 
-@app.callback(Output("area-tabela", "children"), Output("barra-totais", "children"), Input("store-dados", "data"), Input("dd-material", "value"), Input("dd-safra", "value"), Input("dd-contrato", "value"))
-def atualizar_tabela_totais(data, material_sel, safra_sel, contrato_sel):
-    if not data: return dbc.Alert("Aguardando busca...", color="light", className="text-center small m-5"), []
-    df = pd.DataFrame(data)
-    
-    if material_sel: df = df[df['NomeMaterial'] == material_sel]
-    if safra_sel: df = df[df['NomeSafra'] == safra_sel]
-    if contrato_sel: df = df[df['contrato'] == contrato_sel]
+SEM_TABELA = ({"display": "none"}, [], [], 1, 0)
 
-    if df.empty: return dbc.Alert("Sem dados.", color="warning", className="m-5"), []
-    
-    # MUDANÇA: Adicionado LDC(35) e reordenado os balões
-    totais = {
-        "Bruto": df["Peso Bruto (Kg)"].sum() if "Peso Bruto (Kg)" in df.columns else 0,
-        "Tara": df["Peso Tara (Kg)"].sum() if "Peso Tara (Kg)" in df.columns else 0,
-        "Líquido": df["Peso liquido (Kg)"].sum() if "Peso liquido (Kg)" in df.columns else 0,
-        "Descontos": df["Descontos (Kg)"].sum() if "Descontos (Kg)" in df.columns else 0,
-        "Aplicada": df["Qtd Aplicada (Kg)"].sum() if "Qtd Aplicada (Kg)" in df.columns else 0,
-        "Devolvida": df["Qtd Devolvida (Kg)"].sum() if "Qtd Devolvida (Kg)" in df.columns else 0,
-        "LDC (35)": df["Peso LDC (35) (Kg)"].sum() if "Peso LDC (35) (Kg)" in df.columns else 0,
-        "Saldo": df["Saldo (Kg)"].sum() if "Saldo (Kg)" in df.columns else 0
-    }
+# Página, filtro e ordenação do cabeçalho chegam aqui; o DataFrame fica no servidor e só a página vai
+# para o navegador. Os balões de totais acompanham o filtro do cabeçalho (calculados uma vez por visão).
+@app.callback(Output("aviso-tabela", "children"), Output("caixa-tabela", "style"), Output("tabela-romaneios", "columns"), Output("tabela-romaneios", "data"), Output("tabela-romaneios", "page_count"), Output("tabela-romaneios", "page_current"), Output("tabela-romaneios", "filter_query"), Output("tabela-romaneios", "sort_by"), Output("barra-totais", "children"),
+              Input("store-dados", "data"), Input("dd-material", "value"), Input("dd-safra", "value"), Input("dd-contrato", "value"), Input("tabela-romaneios", "page_current"), Input("tabela-romaneios", "page_size"), Input("tabela-romaneios", "sort_by"), Input("tabela-romaneios", "filter_query"))
+def atualizar_tabela_totais(chave, material_sel, safra_sel, contrato_sel, page_current, page_size, sort_by, filter_query):
+    # Resultado novo zera filtro/ordenação do cabeçalho; trocar material/safra/contrato volta para a página 1
+    if ctx.triggered_id in (None, "store-dados"): page_current, sort_by, filter_query = 0, [], ""
+    elif ctx.triggered_id in ("dd-material", "dd-safra", "dd-contrato"): page_current = 0
+    if not chave: return dbc.Alert("Aguardando busca...", color="light", className="text-center small m-5"), *SEM_TABELA, "", [], []
+    df = cache_resultados.obter(chave)
+    if df is None: return dbc.Alert("Resultado expirou, clique em BUSCAR novamente.", color="warning", className="text-center small m-5"), *SEM_TABELA, "", [], []
+    # buscar_dados_sap já está buscando de novo sem o filtro removido
+    if selecao_mais_ampla(restricoes_do_resultado(chave), restricoes_romaneio(material_sel, safra_sel, contrato_sel)):
+        return dbc.Alert("Buscando sem o filtro anterior...", color="light", className="text-center small m-5"), *SEM_TABELA, "", [], []
+    df = filtrar_resultado(df, material_sel, safra_sel, contrato_sel)
+
+    if df.empty: return dbc.Alert("Sem dados.", color="warning", className="m-5"), *SEM_TABELA, "", [], []
+
+    base = (chave, material_sel, safra_sel, contrato_sel)
+    clausulas = clausulas_filtro(filter_query)
+    pagina, page_current, paginas, linhas, totais = visoes_tabela.pagina(base, df, clausulas, sort_by, page_current, page_size or TABELA_PAGINA)
+    nao_entendidas = [c for c in clausulas if not clausula_entendida(df, c)]
+    aviso = dbc.Alert(f"Filtro não reconhecido (nenhuma linha passa): {'; '.join(nao_entendidas)}", color="warning", className="py-1 mb-1 small") if nao_entendidas else None
     badges = [html.Span([f"{k}: ", html.B(f"{v:,.0f}".replace(",", "X").replace(".", ",").replace("X", "."))], style=BADGE_STYLE) for k, v in totais.items()]
-    
-    cols_extras = [c for c in df.columns if c not in ORDEM_COLUNAS and c not in ["Cod. Parceiro", "DataLancamento", "Cancelado"]]
-    cols_final = [c for c in ORDEM_COLUNAS if c in df.columns] + cols_extras
+    badges.append(html.Span(f"{linhas:,} de {len(df):,} romaneios".replace(",", "."), className="small text-muted align-self-center"))
 
-    cols = [{"name": c, "id": c, "type": 'numeric' if "(Kg)" in c or "%" in c else 'text', "format": Format(precision=2, scheme=Scheme.fixed, group=Group.yes, group_delimiter='.', decimal_delimiter=',') if "(Kg)" in c or "%" in c else None} for c in cols_final]
+    cols = [{"name": c, "id": c, "type": 'numeric' if coluna_numerica(c) else 'text', "format": Format(precision=2, scheme=Scheme.fixed, group=Group.yes, group_delimiter='.', decimal_delimiter=',') if coluna_numerica(c) else None} for c in colunas_relatorio(df)]
 
-    tabela = dash_table.DataTable(
-        data=df.to_dict('records'), columns=cols, fixed_rows={'headers': True},
-        style_table={'height': '100%', 'maxHeight': '100%', 'overflowY': 'auto'},
-        page_action="none", virtualization=True, filter_action="native", sort_action="native",
-        style_header={'backgroundColor': '#0C5959', 'color': 'white', 'fontWeight': 'bold', 'fontSize': '10px'},
-        style_cell={'fontSize': '10px', 'textAlign': 'left', 'padding': '2px 5px', 'minWidth': '80px'},
-        style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': '#f8f9fa'}]
-    )
-    return tabela, badges
+    with span("serializacao", linhas=len(pagina)): dados = formatar_exibicao(pagina).to_dict('records')
+    return aviso, ESTILO_CAIXA_TABELA, cols, dados, paginas, page_current, filter_query, sort_by, badges
 
-@app.callback(Output("download-files", "data"), Input("btn-excel", "n_clicks"), Input("btn-pdf-resumido", "n_clicks"), Input("btn-pdf-detalhado", "n_clicks"), State("store-dados", "data"), State("dt-inicio", "value"), State("dt-fim", "value"), State("dd-nome", "value"), State("dd-codigo", "value"), State("dd-material", "value"), State("dd-safra", "value"), State("dd-contrato", "value"), prevent_initial_call=True)
-def exportar(n_ex, n_res, n_det, data, start, end, nome_p, cod_p, material_sel, safra_sel, contrato_sel):
-    if not data: return no_update
+@server.before_request
+def iniciar_spans():
+    g.token_spans = iniciar_requisicao()
+
+@server.after_request
+def anexar_server_timing(resposta):
+    token = g.pop("token_spans", None)
+    if token is None: return resposta
+    spans = encerrar_requisicao(token)
+    if SERVER_TIMING and spans: resposta.headers["Server-Timing"] = server_timing(spans)
+    return resposta
+
+# Exportações em segundo plano rodam em outros processos: os spans delas ficam lá, não aparecem aqui
+@server.route("/metrics")
+def metricas():
+    if not METRICS: abort(404)
+    if request.args.get("formato") == "json": return jsonify(registro.resumo())
+    return exposicao_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@server.route("/download/<token>")
+def baixar_exportacao(token):
+    arq = exportacoes.obter(token)
+    if arq is None: abort(404)
+    caminho, nome = arq
+    return send_file(caminho, as_attachment=True, download_name=nome, max_age=0)
+
+app.clientside_callback(
+    "function(url) { if (url) { window.location.assign(url); } return url; }",
+    Output("link-download", "href"), Input("store-download-url", "data"), prevent_initial_call=True
+)
+
+@app.callback(Output("download-files", "data"), Output("store-job-exportacao", "data"), Input("btn-excel", "n_clicks"), Input("btn-pdf-resumido", "n_clicks"), Input("btn-pdf-detalhado", "n_clicks"), Input("btn-csv", "n_clicks"), Input("btn-parquet", "n_clicks"), State("store-dados", "data"), State("dt-inicio", "value"), State("dt-fim", "value"), State("dd-nome", "value"), State("dd-codigo", "value"), State("dd-material", "value"), State("dd-safra", "value"), State("dd-contrato", "value"), prevent_initial_call=True)
+def exportar(n_ex, n_res, n_det, n_csv, n_pq, chave, start, end, nome_p, cod_p, material_sel, safra_sel, contrato_sel):
+    df = cache_resultados.obter(chave)
+    if df is None: return no_update, no_update
     ctx_id = ctx.triggered_id
-    df = pd.DataFrame(data)
-    
-    if material_sel: df = df[df['NomeMaterial'] == material_sel]
-    if safra_sel: df = df[df['NomeSafra'] == safra_sel]
-    if contrato_sel: df = df[df['contrato'] == contrato_sel]
+    # Rótulos pelo que o arquivo realmente contém: parceiro, período e $filter da busca, mais a seleção atual
+    consulta = cache_resultados.consulta(chave) or {}
+    start, end = consulta.get("inicio", start), consulta.get("fim", end)
+    if "parceiro" in consulta: cod_p, nome_p = consulta["parceiro"], consulta.get("nome")
+    aplicadas = {**restricoes_romaneio(material_sel, safra_sel, contrato_sel), **consulta.get("restricoes", {})}
+    df = filtrar_restricoes(df, aplicadas)
+    material_sel, safra_sel, contrato_sel = (aplicadas.get(CAMPOS_RESTRICAO[k]) for k in ("material", "safra", "contrato"))
     
     periodo = f"{datetime.strptime(start, '%Y-%m-%d').strftime('%d/%m/%Y')} a {datetime.strptime(end, '%Y-%m-%d').strftime('%d/%m/%Y')}"
     parceiro_label = f"{nome_p} ({cod_p})" if nome_p else cod_p
     safra_label = safra_sel if safra_sel else "TODAS AS SAFRAS"
     material_label = material_sel if material_sel else "TODOS OS MATERIAIS"
     contrato_label = contrato_sel if contrato_sel else "TODOS OS CONTRATOS"
+    infos = (parceiro_label, material_label, safra_label, contrato_label, periodo)
+
+    tipos = {"btn-excel": ("excel", f"Relatorio_{cod_p}.xlsx"), "btn-pdf-resumido": ("resumido", f"Resumido_{cod_p}.pdf"), "btn-pdf-detalhado": ("detalhado", f"Detalhado_{cod_p}.pdf"), "btn-csv": ("csv", f"Relatorio_{cod_p}.csv"), "btn-parquet": ("parquet", f"Relatorio_{cod_p}.parquet")}
+    if ctx_id not in tipos: return no_update, no_update
+    tipo, nome_arquivo = tipos[ctx_id]
+    # Excel e Parquet recebem o schema compacto (data nativa, tipos); PDF e CSV o texto de exibição
+    if tipo in ("resumido", "detalhado"): df = formatar_exibicao(df)
+
+    if len(df) >= EXPORT_DISCO_MIN_LINHAS:
+        # Mesmo pedido (busca + filtros + tipo) = mesmo job: clique repetido reaproveita o que já está rodando ou pronto
+        job_id = fila_exportacao.id_job(tipo, chave, material_sel, safra_sel, contrato_sel, infos)
+        return no_update, fila_exportacao.enviar(job_id, tipo, df, infos, nome_arquivo)
+
+    if tipo in ("excel", "csv", "parquet"):
+        gerar = {"excel": gerar_excel, "csv": gerar_csv, "parquet": gerar_parquet}[tipo]
+        return dcc.send_bytes(gerar(df).getvalue(), nome_arquivo), no_update
+    gerar = gerar_pdf_resumido if tipo == "resumido" else gerar_pdf_detalhado
+    return dcc.send_bytes(gerar(df, *infos).getvalue(), nome_arquivo), no_update
 
-    if ctx_id == "btn-excel": return dcc.send_data_frame(df.to_excel, f"Relatorio_{cod_p}.xlsx", index=False)
-    elif ctx_id == "btn-pdf-resumido": return dcc.send_bytes(gerar_pdf_resumido(df, parceiro_label, material_label, safra_label, contrato_label, periodo).getvalue(), f"Resumido_{cod_p}.pdf")
-    elif ctx_id == "btn-pdf-detalhado": return dcc.send_bytes(gerar_pdf_detalhado(df, parceiro_label, material_label, safra_label, contrato_label, periodo).getvalue(), f"Detalhado_{cod_p}.pdf")
-    return no_update
+@app.callback(Output("store-download-url", "data"), Output("progresso-exportacao", "children"), Output("intervalo-exportacao", "disabled"), Input("store-job-exportacao", "data"), Input("intervalo-exportacao", "n_intervals"), prevent_initial_call=True)
+def acompanhar_exportacao(job_id, _n):
+    if not job_id: return no_update, None, True
+    st = fila_exportacao.status(job_id)
+    if st["estado"] == "concluido": return st["url"], None, True
+    if st["estado"] == "erro": return no_update, dbc.Alert("Falha ao gerar o arquivo.", color="danger", className="py-1 mb-1 small", dismissable=True), True
+    if st["estado"] == "desconhecido": return no_update, None, True
+    feitas, total = st["feitas"], st["total"]
+    texto = f"Gerando arquivo... {st['unidade']} {feitas}/{total}" if total else "Gerando arquivo..."
+    barra = dbc.Progress(value=100 * feitas / total if total else 100, label=texto, striped=True, animated=not total, color="warning", className="mb-1", style={"height": "18px"})
+    return no_update, barra, False
 
 if __name__ == "__main__":
+    # Campo do $select que sumiu do serviço aparece no log já na subida, não na primeira busca
+    sap.esquema_romaneio()
     app.run(debug=False, port=8052, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,142 @@
+# VERSÃO: 1.3 - Agendamento não morre com APP_AQUECIMENTO_HORARIOS vazio/inválido: cai no automático e, em erro, tenta de novo
+import sqlite3
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from backend.fornecedores import lock_arquivo
+from backend.metricas import span, somar
+
+logger = logging.getLogger(__name__)
+
+# Espera antes de tentar agendar de novo quando o cálculo da próxima execução falha
+ESPERA_ERRO_SEG = 300
+
+class HistoricoBuscas:
+    # Uma linha por BUSCAR (parceiro, período, tempo gasto, linhas). É daqui que o aquecimento
+    # aprende quem buscar e em que horário os usuários chegam.
+    def __init__(self, caminho, dias_retencao=90):
+        self.caminho = caminho
+        self.dias_retencao = dias_retencao
+        with self._conectar() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS buscas (parceiro TEXT, inicio TEXT, fim TEXT, em REAL, hora INTEGER, segundos REAL, linhas INTEGER, origem TEXT)")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_buscas_em ON buscas (em)")
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=30)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con: yield con
+        finally:
+            con.close()
+
+    # `origem`: "sap" (baixou), "cache" (reaproveitou resultado em memória)
+    def registrar(self, parceiro, inicio, fim, segundos, linhas, origem="sap"):
+        agora = time.time()
+        try:
+            with self._conectar() as con:
+                con.execute("INSERT INTO buscas VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (str(parceiro), inicio, fim, agora, datetime.fromtimestamp(agora).hour, segundos, linhas, origem))
+                con.execute("DELETE FROM buscas WHERE em < ?", (agora - self.dias_retencao * 86400,))
+        except sqlite3.Error as e:
+            logger.warning(f"[AQUECIMENTO] Falha ao registrar busca: {e}")
+
+    # Parceiros mais buscados nos últimos `dias`: [(parceiro, buscas, segundos)], por número de buscas e, no
+    # empate, por segundos de SAP. Não dá para ordenar só pelos segundos: busca servida pelo aquecimento
+    # registra 0, e o parceiro aquecido cairia do ranking e voltaria frio no ciclo seguinte.
+    def mais_buscados(self, dias=30, limite=10):
+        with self._conectar() as con:
+            return con.execute("SELECT parceiro, COUNT(*), SUM(segundos) FROM buscas WHERE em >= ? GROUP BY parceiro ORDER BY COUNT(*) DESC, SUM(segundos) DESC LIMIT ?",
+                               (time.time() - dias * 86400, limite)).fetchall()
+
+    # Horas do dia com mais buscas nos últimos `dias`, da mais movimentada para a menos
+    def horas_pico(self, dias=30, limite=2):
+        with self._conectar() as con:
+            return [r[0] for r in con.execute("SELECT hora FROM buscas WHERE em >= ? GROUP BY hora ORDER BY COUNT(*) DESC LIMIT ?", (time.time() - dias * 86400, limite))]
+
+class Aquecedor:
+    # Recarrega o diretório de fornecedores e baixa o mês corrente dos `parceiros` mais buscados, com no
+    # máximo `workers` buscas simultâneas e `pausa_seg` entre uma e outra, para não disputar o SAP com os usuários.
+    # As buscas passam pelo store de romaneios (dias fechados ficam gravados) e cada resultado vai para
+    # `ao_resultado(parceiro, inicio, fim, df)`, que o app usa para guardar no cache de resultados.
+    def __init__(self, sap, historico, ao_resultado=None, parceiros=10, workers=2, pausa_seg=2.0, dias_historico=30):
+        self.sap = sap
+        self.historico = historico
+        self.ao_resultado = ao_resultado
+        self.parceiros = parceiros
+        self.workers = workers
+        self.pausa_seg = pausa_seg
+        self.dias_historico = dias_historico
+        self._parar = threading.Event()
+        self.ultima_execucao = None
+
+    def _aquecer_parceiro(self, parceiro, inicio, fim):
+        if self._parar.is_set(): return 0
+        t = time.perf_counter()
+        df = self.sap.buscar_dados_por_periodo(inicio, fim, parceiro_id=parceiro)
+        if not df.empty and self.ao_resultado: self.ao_resultado(parceiro, inicio, fim, df)
+        logger.info(f"[AQUECIMENTO] Parceiro {parceiro}: {len(df)} romaneios em {time.perf_counter() - t:.1f}s")
+        somar("aquecimento_parceiros_total")
+        self._parar.wait(self.pausa_seg)
+        return len(df)
+
+    def executar(self):
+        # Com vários processos do app só um aquece; os outros aproveitam o store e o snapshot em disco
+        with lock_arquivo(self.historico.caminho + ".aquecimento") as dono:
+            if not dono:
+                logger.info("[AQUECIMENTO] Outro processo já está aquecendo")
+                return None
+            with span("aquecimento") as attrs:
+                self.sap.fornecedores.aquecer()
+                hoje = date.today()
+                inicio, fim = hoje.replace(day=1).isoformat(), hoje.isoformat()
+                alvos = [p for p, _, _ in self.historico.mais_buscados(self.dias_historico, self.parceiros)]
+                linhas = 0
+                with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="aquecimento") as pool:
+                    for fut in [pool.submit(self._aquecer_parceiro, p, inicio, fim) for p in alvos]:
+                        try: linhas += fut.result()
+                        except Exception as e: logger.error(f"[AQUECIMENTO] Falha: {e}")
+                attrs.update(parceiros=len(alvos), linhas=linhas)
+        self.ultima_execucao = time.time()
+        logger.info(f"[AQUECIMENTO] Concluído: fornecedores + {len(alvos)} parceiros ({inicio} a {fim})")
+        return alvos
+
+    # "HH:MM" separados por vírgula, ou "auto": 20 minutos antes de cada uma das duas horas de pico do histórico
+    # (sem histórico, 07:40). Horário inválido é ignorado; sem nenhum válido vale o "auto".
+    def horarios(self, config):
+        if config.strip().lower() != "auto":
+            validos = []
+            for h in config.split(","):
+                if not h.strip(): continue
+                try: validos.append(datetime.strptime(h.strip(), "%H:%M").time())
+                except ValueError: logger.error(f"[AQUECIMENTO] Horário inválido ignorado: {h.strip()!r}")
+            if validos: return sorted(validos)
+            logger.error(f"[AQUECIMENTO] Nenhum horário válido em {config!r}: usando o automático")
+        picos = self.historico.horas_pico(self.dias_historico) or [8]
+        return sorted((datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=h, minutes=-20)).time() for h in picos)
+
+    def _proxima(self, config):
+        agora = datetime.now()
+        horarios = self.horarios(config)
+        candidatos = [datetime.combine(agora.date() + timedelta(days=d), h) for d in (0, 1) for h in horarios]
+        return min(c for c in candidatos if c > agora)
+
+    def iniciar(self, config="auto"):
+        def laco():
+            while not self._parar.is_set():
+                try: proxima = self._proxima(config)
+                except Exception as e:
+                    # Ex.: histórico indisponível; a thread não pode morrer, senão o aquecimento para até reiniciar
+                    logger.error(f"[AQUECIMENTO] Falha ao agendar ({e}), nova tentativa em {ESPERA_ERRO_SEG // 60} min")
+                    if self._parar.wait(ESPERA_ERRO_SEG): return
+                    continue
+                logger.info(f"[AQUECIMENTO] Próxima execução: {proxima:%d/%m %H:%M}")
+                if self._parar.wait((proxima - datetime.now()).total_seconds()): return
+                try: self.executar()
+                except Exception as e: logger.error(f"[AQUECIMENTO] Execução falhou: {e}")
+        threading.Thread(target=laco, name="aquecimento", daemon=True).start()
+
+    def parar(self):
+        self._parar.set()
@@ -0,0 +1,206 @@
+# VERSÃO: 1.4 - Espera pelo dono com lock_ocupado; lock de busca em andamento nunca é apagado pela limpeza
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+import pandas as pd
+from backend.fornecedores import lock_arquivo, lock_ocupado, gravar_pickle_atomico
+
+logger = logging.getLogger(__name__)
+
+# Resultado de uma busca em andamento publicado para os outros processos: só vale para quem já estava esperando
+VOO_ABANDONADO_SEG = 600
+
+class CacheResultados:
+    # Guarda os DataFrames das buscas no processo; o navegador só recebe a chave.
+    # Limite por quantidade e por memória estimada, despejando o menos usado.
+    # Com `diretorio` os resultados também vão para o disco (um pickle por chave e um índice SQLite
+    # com a consulta de cada um), e qualquer worker acha o que outro guardou; a memória vira só a
+    # camada quente. `max_bytes_disco` limita o diretório, despejando o menos acessado.
+    def __init__(self, max_itens=32, max_bytes=1024 * 1024 * 1024, diretorio=None, max_bytes_disco=4 * 1024 * 1024 * 1024):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()
+        self._tamanhos = {}
+        self._consultas = {}
+        self._lock = threading.Lock()
+        self._em_voo = {}
+        self.diretorio = diretorio
+        self.max_bytes_disco = max_bytes_disco
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+            with self._conectar() as con:
+                con.execute("CREATE TABLE IF NOT EXISTS resultados (chave TEXT PRIMARY KEY, consulta TEXT, bytes INTEGER, em REAL, acessado_em REAL)")
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(os.path.join(self.diretorio, "indice.sqlite"), timeout=30)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con: yield con
+        finally:
+            con.close()
+
+    def _arquivo(self, nome):
+        return os.path.join(self.diretorio, f"{nome}.pkl")
+
+    # `consulta` descreve de onde o resultado veio (parceiro, período, filtros), para `procurar`
+    def guardar(self, df, consulta=None):
+        chave = uuid.uuid4().hex
+        tamanho = int(df.memory_usage(deep=True).sum())
+        if self.diretorio:
+            try:
+                gravar_pickle_atomico(df, self._arquivo(chave))
+                with self._conectar() as con:
+                    con.execute("INSERT INTO resultados VALUES (?, ?, ?, ?, ?)", (chave, json.dumps(consulta, default=str) if consulta is not None else None, os.path.getsize(self._arquivo(chave)), time.time(), time.time()))
+                self._despejar_disco()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"[CACHE] Falha ao gravar resultado {chave[:8]} em disco: {e}")
+        self._guardar_memoria(chave, df, tamanho, consulta)
+        return chave
+
+    def _guardar_memoria(self, chave, df, tamanho, consulta):
+        with self._lock:
+            self._itens[chave] = df
+            self._tamanhos[chave] = tamanho
+            if consulta is not None: self._consultas[chave] = consulta
+            self._despejar()
+
+    # Resultado mais recente cuja consulta satisfaz `aceita(consulta)`: (chave, df, consulta) ou None
+    def procurar(self, aceita):
+        if self.diretorio:
+            try:
+                with self._conectar() as con: linhas = con.execute("SELECT chave, consulta FROM resultados WHERE consulta IS NOT NULL ORDER BY em DESC").fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"[CACHE] Falha ao consultar o índice: {e}")
+                linhas = []
+            for chave, texto in linhas:
+                consulta = json.loads(texto)
+                if aceita(consulta):
+                    df = self.obter(chave)
+                    if df is not None: return chave, df, consulta
+            return None
+        with self._lock:
+            for chave in reversed(self._itens):
+                consulta = self._consultas.get(chave)
+                if consulta is not None and aceita(consulta):
+                    self._itens.move_to_end(chave)
+                    return chave, self._itens[chave], consulta
+        return None
+
+    def obter(self, chave):
+        if not chave: return None
+        with self._lock:
+            df = self._itens.get(chave)
+            if df is not None: self._itens.move_to_end(chave)
+        if df is not None or not self.diretorio: return df
+        # Guardado por outro worker (ou despejado da memória deste)
+        try:
+            df = pd.read_pickle(self._arquivo(chave))
+            with self._conectar() as con: con.execute("UPDATE resultados SET acessado_em = ? WHERE chave = ?", (time.time(), chave))
+        except (OSError, ValueError, sqlite3.Error):
+            return None
+        self._guardar_memoria(chave, df, int(df.memory_usage(deep=True).sum()), None)
+        return df
+
+    # Consulta com que o resultado foi guardado, ou None (sem consulta, ou já despejado)
+    def consulta(self, chave):
+        if not chave: return None
+        with self._lock: consulta = self._consultas.get(chave)
+        if consulta is not None or not self.diretorio: return consulta
+        try:
+            with self._conectar() as con: linha = con.execute("SELECT consulta FROM resultados WHERE chave = ?", (chave,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return json.loads(linha[0]) if linha and linha[0] else None
+
+    def remover(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+            self._tamanhos.pop(chave, None)
+            self._consultas.pop(chave, None)
+        if self.diretorio:
+            try:
+                with self._conectar() as con: con.execute("DELETE FROM resultados WHERE chave = ?", (chave,))
+                os.remove(self._arquivo(chave))
+            except (OSError, sqlite3.Error):
+                pass
+
+    def _despejar(self):
+        # Nunca despeja o último guardado, mesmo que sozinho passe do limite
+        while len(self._itens) > 1 and (len(self._itens) > self.max_itens or sum(self._tamanhos.values()) > self.max_bytes):
+            chave, _ = self._itens.popitem(last=False)
+            self._tamanhos.pop(chave, None)
+            self._consultas.pop(chave, None)
+            logger.info(f"[CACHE] Resultado {chave[:8]} despejado")
+
+    def _despejar_disco(self):
+        with self._conectar() as con:
+            linhas = con.execute("SELECT chave, bytes FROM resultados ORDER BY acessado_em DESC").fetchall()
+            total, remover = 0, []
+            for i, (chave, tamanho) in enumerate(linhas):
+                total += tamanho
+                if i > 0 and total > self.max_bytes_disco: remover.append(chave)
+            con.executemany("DELETE FROM resultados WHERE chave = ?", [(c,) for c in remover])
+        for chave in remover:
+            try: os.remove(self._arquivo(chave))
+            except OSError: pass
+        if remover: logger.info(f"[CACHE] {len(remover)} resultado(s) despejado(s) do disco")
+        for arq in os.listdir(self.diretorio):
+            caminho = os.path.join(self.diretorio, arq)
+            try:
+                if not arq.startswith("voo_") or time.time() - os.path.getmtime(caminho) <= VOO_ABANDONADO_SEG: continue
+                # Lock de quem morreu: só sai pelo próprio lock_arquivo (apagar na mão tiraria o de um dono vivo)
+                if arq.endswith(".lock"):
+                    with lock_arquivo(caminho[:-len(".lock")]): pass
+                else: os.remove(caminho)
+            except OSError:
+                pass
+
+    # Uma busca por vez por `chave` (ex.: parceiro + período + filtros): quem chega enquanto a mesma
+    # consulta está em andamento espera e recebe o mesmo DataFrame, em vez de ir de novo ao SAP.
+    # Entre threads do processo via Future; entre processos (com `diretorio`) via lock em arquivo,
+    # e o dono publica o resultado num pickle que os outros leem.
+    def uma_vez(self, chave, calcular, espera_seg=VOO_ABANDONADO_SEG):
+        with self._lock:
+            futuro = self._em_voo.get(chave)
+            dono = futuro is None
+            if dono: futuro = self._em_voo[chave] = Future()
+        if not dono:
+            logger.info("[CACHE] Busca idêntica em andamento neste processo, aguardando")
+            return futuro.result(timeout=espera_seg)
+        try:
+            df = self._uma_vez_processos(chave, calcular, espera_seg) if self.diretorio else calcular()
+            futuro.set_result(df)
+            return df
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self._lock: self._em_voo.pop(chave, None)
+
+    def _uma_vez_processos(self, chave, calcular, espera_seg):
+        nome = "voo_" + hashlib.md5(chave.encode()).hexdigest()
+        arquivo = self._arquivo(nome)
+        inicio = time.time()
+        with lock_arquivo(arquivo) as dono:
+            if dono:
+                df = calcular()
+                try: gravar_pickle_atomico(df, arquivo)
+                except OSError as e: logger.warning(f"[CACHE] Falha ao publicar busca em andamento: {e}")
+                return df
+        logger.info("[CACHE] Busca idêntica em andamento em outro processo, aguardando")
+        while lock_ocupado(arquivo) and time.time() - inicio < espera_seg: time.sleep(0.25)
+        try:
+            if os.path.getmtime(arquivo) >= inicio - 1: return pd.read_pickle(arquivo)
+        except (OSError, ValueError):
+            pass
+        # O dono morreu ou a publicação falhou: busca por conta própria
+        return calcular()
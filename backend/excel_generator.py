@@ -0,0 +1,108 @@
+# VERSÃO: 1.1 - Span de tempo da geração do Excel
+from io import BytesIO
+import importlib.util
+import logging
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+from backend.metricas import span
+from backend.sap_data import colunas_relatorio, calcular_totais, coluna_numerica, formatar_exibicao, TOTAIS_RELATORIO, COL_DATA
+
+logger = logging.getLogger(__name__)
+
+# Separador de milhar/decimal vem das configurações regionais do Excel: num Excel pt-BR aparece "1.234,56"
+FORMATO_NUMERO = '#,##0.00'
+FORMATO_DATA = 'DD/MM/YYYY'
+PROGRESSO_A_CADA = 5000
+PARQUET_DISPONIVEL = importlib.util.find_spec("pyarrow") is not None or importlib.util.find_spec("fastparquet") is not None
+
+_FONTE_CABECALHO = Font(bold=True, color="FFFFFF")
+_FUNDO_CABECALHO = PatternFill("solid", fgColor="0C5959")
+_FONTE_TOTAL = Font(bold=True)
+_FUNDO_TOTAL = PatternFill("solid", fgColor="E8E8E8")
+
+def _celula(ws, valor=None, formato=None, fonte=None, fundo=None):
+    cel = WriteOnlyCell(ws, value=valor)
+    if formato: cel.number_format = formato
+    if fonte: cel.font = fonte
+    if fundo: cel.fill = fundo
+    return cel
+
+def _valor(v):
+    if v is None or v is pd.NaT or (isinstance(v, float) and v != v): return None
+    if isinstance(v, np.generic): return v.item()
+    return v
+
+# Planilha do relatório: colunas em ORDEM_COLUNAS, cabeçalho congelado, números com formato
+# nativo e linha de TOTAL com os mesmos totais dos balões da tela. Em write_only cada linha
+# vai para o arquivo no append, então a memória não cresce com o tamanho do relatório.
+def _escrever_excel(df, destino, progresso=None):
+    cols = colunas_relatorio(df)
+    data_nativa = COL_DATA in df.columns and pd.api.types.is_datetime64_any_dtype(df[COL_DATA])
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Relatório")
+    ws.freeze_panes = "A2"
+    for i, col in enumerate(cols, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = max(12, min(len(col) + 4, 40))
+
+    ws.append([_celula(ws, c, fonte=_FONTE_CABECALHO, fundo=_FUNDO_CABECALHO) for c in cols])
+
+    # Uma célula por coluna, reaproveitada: o append serializa a linha na hora
+    formatos = [FORMATO_NUMERO if coluna_numerica(c) else FORMATO_DATA if c == COL_DATA and data_nativa else None for c in cols]
+    modelo = [_celula(ws, formato=f) if f else None for f in formatos]
+    total = len(df)
+    for n, linha in enumerate(df[cols].itertuples(index=False, name=None), start=1):
+        for cel, v in zip(modelo, linha):
+            if cel is not None: cel.value = _valor(v)
+        ws.append([cel if cel is not None else _valor(v) for cel, v in zip(modelo, linha)])
+        if progresso and n % PROGRESSO_A_CADA == 0: progresso(n, total)
+
+    totais = calcular_totais(df)
+    col_total = {col: totais[rotulo] for rotulo, col in TOTAIS_RELATORIO.items()}
+    rodape = [_celula(ws, _valor(col_total[c]) if c in col_total else None, formato=FORMATO_NUMERO if c in col_total else None, fonte=_FONTE_TOTAL, fundo=_FUNDO_TOTAL) for c in cols]
+    if rodape and cols[0] not in col_total: rodape[0].value = "TOTAL"
+    ws.append(rodape)
+    wb.save(destino)
+    if progresso: progresso(total, total)
+
+# Mesma convenção do pdf_generator: com `destino` grava no arquivo e devolve o caminho
+# (None se falhou), sem ele devolve um BytesIO
+def gerar_excel(df, destino=None, progresso=None):
+    try:
+        buffer = destino or BytesIO()
+        with span("excel", linhas=len(df)): _escrever_excel(df, buffer, progresso=progresso)
+        if destino: return destino
+        buffer.seek(0)
+        return buffer
+    except Exception as e:
+        logger.error(f"ERRO EXCEL: {e}")
+        return None if destino else BytesIO()
+
+# CSV no padrão que o Excel pt-BR abre direto (";" e vírgula decimal); colunas do relatório, sem formatação de milhar
+def gerar_csv(df, destino=None):
+    try:
+        buffer = destino or BytesIO()
+        formatar_exibicao(df[colunas_relatorio(df)]).to_csv(buffer, sep=';', decimal=',', index=False, encoding='utf-8-sig')
+        if destino: return destino
+        buffer.seek(0)
+        return buffer
+    except Exception as e:
+        logger.error(f"ERRO CSV: {e}")
+        return None if destino else BytesIO()
+
+# Parquet mantém os tipos (data, categorias, inteiros); depende do pyarrow (ou fastparquet), que é opcional
+def gerar_parquet(df, destino=None):
+    try:
+        buffer = destino or BytesIO()
+        df[colunas_relatorio(df)].to_parquet(buffer, index=False)
+        if destino: return destino
+        buffer.seek(0)
+        return buffer
+    except ImportError:
+        logger.error("ERRO PARQUET: pyarrow não instalado (pip install pyarrow)")
+    except Exception as e:
+        logger.error(f"ERRO PARQUET: {e}")
+    return None if destino else BytesIO()
@@ -0,0 +1,168 @@
+# VERSÃO: 1.3 - Batimento do progresso enquanto o job está na fila ou rodando; processo do pool morto vira erro
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+DIR_EXPORTACOES = os.getenv("APP_DIR_EXPORTACOES", os.path.join(tempfile.gettempdir(), "rpp_exportacoes"))
+# Progresso parado há mais que isso é de um job que morreu junto com o processo que o enviou
+PROGRESSO_ABANDONADO_SEG = 120
+# De quanto em quanto tempo o processo que enviou o job renova o mtime do progresso
+BATIMENTO_SEG = 15
+_TOKEN_VALIDO = re.compile(r"^[0-9a-f]{32}$")
+
+class ArquivosExportacao:
+    # Cada arquivo fica em DIR_EXPORTACOES como "<token>__<nome para download>", então qualquer
+    # worker acha o arquivo só pelo token, sem registro em memória.
+    def __init__(self, diretorio=DIR_EXPORTACOES, ttl_segundos=int(os.getenv("APP_EXPORT_TTL_MIN", "30")) * 60):
+        self.diretorio = diretorio
+        self.ttl = ttl_segundos
+        os.makedirs(self.diretorio, exist_ok=True)
+
+    def novo(self, nome_download, token=None):
+        self.limpar()
+        token = token or uuid.uuid4().hex
+        nome = re.sub(r'[^\w.\-]', '_', nome_download)
+        return token, os.path.join(self.diretorio, f"{token}__{nome}")
+
+    # Escreve em "<caminho>.tmp" e chama publicar: a rota nunca entrega arquivo pela metade
+    def publicar(self, caminho):
+        os.replace(caminho + ".tmp", caminho)
+
+    def obter(self, token):
+        if not token or not _TOKEN_VALIDO.match(token): return None
+        for arq in os.listdir(self.diretorio):
+            if arq.startswith(token + "__") and not arq.endswith(".tmp"):
+                return os.path.join(self.diretorio, arq), arq.split("__", 1)[1]
+        return None
+
+    def url(self, token):
+        return f"/download/{token}"
+
+    def limpar(self):
+        limite = time.time() - self.ttl
+        for arq in os.listdir(self.diretorio):
+            caminho = os.path.join(self.diretorio, arq)
+            try:
+                if os.path.getmtime(caminho) < limite: os.remove(caminho)
+            except OSError:
+                pass
+
+def _gravar_progresso(caminho, dados):
+    tmp = f"{caminho}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f: json.dump(dados, f)
+    os.replace(tmp, caminho)
+
+# Roda no processo do pool: gera o arquivo, anotando o progresso em "<token>.progresso"
+def _executar_job(tipo, df, infos, caminho, arq_progresso):
+    from backend.pdf_generator import gerar_pdf_resumido, gerar_pdf_detalhado
+    from backend.excel_generator import gerar_excel, gerar_csv, gerar_parquet
+    unidade = "páginas" if tipo in ("resumido", "detalhado") else "linhas"
+    ultimo = [0.0]
+
+    def progresso(feitas, total):
+        agora = time.time()
+        if feitas == total or agora - ultimo[0] > 0.5:
+            _gravar_progresso(arq_progresso, {"feitas": feitas, "total": total, "unidade": unidade})
+            ultimo[0] = agora
+
+    destino = caminho + ".tmp"
+    try:
+        progresso(0, 0)
+        if tipo == "excel": ok = gerar_excel(df, destino=destino, progresso=progresso)
+        elif tipo == "csv": ok = gerar_csv(df, destino=destino)
+        elif tipo == "parquet": ok = gerar_parquet(df, destino=destino)
+        elif tipo == "resumido": ok = gerar_pdf_resumido(df, *infos, destino=destino, progresso=progresso)
+        else: ok = gerar_pdf_detalhado(df, *infos, destino=destino, progresso=progresso)
+        if not ok: raise RuntimeError("falha ao gerar o arquivo")
+        os.replace(destino, caminho)
+        os.remove(arq_progresso)
+    except Exception as e:
+        logger.error(f"[EXPORTAÇÃO] Job {os.path.basename(caminho)} falhou: {e}")
+        _gravar_progresso(arq_progresso, {"erro": str(e)})
+
+class FilaExportacao:
+    # Exportações pesadas num pool de processos local. O id do job é o hash do pedido, então
+    # pedidos iguais em andamento viram o mesmo job e um arquivo já pronto (dentro do TTL)
+    # é devolvido na hora. Todo o estado fica em disco, visível para qualquer worker.
+    def __init__(self, arquivos, max_workers=int(os.getenv("APP_EXPORT_WORKERS", "2"))):
+        self.arquivos = arquivos
+        self.max_workers = max_workers
+        self._pool = None
+        # RLock: o callback de término pode rodar dentro do submit, com o lock já tomado
+        self._lock = threading.RLock()
+        self._pendentes = {}
+        self._batimento = None
+
+    def _arq_progresso(self, job_id):
+        return os.path.join(self.arquivos.diretorio, f"{job_id}.progresso")
+
+    @staticmethod
+    def id_job(*partes):
+        return hashlib.md5(json.dumps(partes, default=str).encode()).hexdigest()
+
+    def _em_andamento(self, job_id):
+        arq = self._arq_progresso(job_id)
+        try: return time.time() - os.path.getmtime(arq) < PROGRESSO_ABANDONADO_SEG and "erro" not in self._ler_progresso(job_id)
+        except OSError: return False
+
+    def _ler_progresso(self, job_id):
+        try:
+            with open(self._arq_progresso(job_id)) as f: return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def enviar(self, job_id, tipo, df, infos, nome_download):
+        with self._lock:
+            if self.arquivos.obter(job_id) is not None or self._em_andamento(job_id): return job_id
+            _, caminho = self.arquivos.novo(nome_download, token=job_id)
+            arq_progresso = self._arq_progresso(job_id)
+            _gravar_progresso(arq_progresso, {"feitas": 0, "total": 0})
+            if self._pool is None: self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            if self._batimento is None:
+                self._batimento = threading.Thread(target=self._bater, name="exportacao-batimento", daemon=True)
+                self._batimento.start()
+            futuro = self._pool.submit(_executar_job, tipo, df, infos, caminho, arq_progresso)
+            self._pendentes[job_id] = futuro
+            futuro.add_done_callback(lambda f: self._concluido(job_id, f))
+        logger.info(f"[EXPORTAÇÃO] Job {job_id[:8]} ({tipo}, {len(df)} linhas) enviado")
+        return job_id
+
+    # O PDF pelo xhtml2pdf passa minutos dentro do pisa sem anotar progresso, e um job na fila do pool
+    # nem começou: enquanto o futuro não termina, este processo renova o mtime do progresso. Se ele
+    # morre (e o pool junto) o batimento para e o job vira abandonado depois de PROGRESSO_ABANDONADO_SEG.
+    def _bater(self):
+        while True:
+            time.sleep(BATIMENTO_SEG)
+            with self._lock: pendentes = list(self._pendentes)
+            for job_id in pendentes:
+                try: os.utime(self._arq_progresso(job_id))
+                except OSError: pass
+
+    # O job trata os próprios erros; exceção aqui é o processo do pool que morreu no meio
+    def _concluido(self, job_id, futuro):
+        erro = None if futuro.cancelled() else futuro.exception()
+        with self._lock:
+            self._pendentes.pop(job_id, None)
+            # Pool com processo morto recusa tudo dali em diante: o próximo envio cria outro
+            if isinstance(erro, BrokenProcessPool): self._pool = None
+        if erro is not None:
+            logger.error(f"[EXPORTAÇÃO] Job {job_id[:8]} perdeu o processo: {erro}")
+            _gravar_progresso(self._arq_progresso(job_id), {"erro": str(erro) or type(erro).__name__})
+
+    # {"estado": "concluido"|"executando"|"erro"|"desconhecido", "feitas", "total", "unidade", "url"}
+    def status(self, job_id):
+        if self.arquivos.obter(job_id) is not None: return {"estado": "concluido", "url": self.arquivos.url(job_id)}
+        prog = self._ler_progresso(job_id)
+        if "erro" in prog: return {"estado": "erro", "erro": prog["erro"]}
+        if prog and self._em_andamento(job_id): return {"estado": "executando", "feitas": prog.get("feitas", 0), "total": prog.get("total", 0), "unidade": prog.get("unidade", "páginas")}
+        return {"estado": "desconhecido"}
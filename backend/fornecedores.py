@@ -0,0 +1,217 @@
+# VERSÃO: 1.3 - lock_arquivo com trava do sistema (flock/msvcrt): sem checar-e-remover lock abandonado
+import os
+import re
+import time
+import unicodedata
+from bisect import bisect_left
+import threading
+import logging
+from contextlib import contextmanager
+import pandas as pd
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+TAXA_CPF = "Brazil: CPF Number"
+TAXA_CNPJ = "Brazil: CNPJ Number"
+TIPOS_TAXA = {'cpf': TAXA_CPF, 'cnpj': TAXA_CNPJ}
+CAMPOS_INDICE = ['Supplier', 'BPTaxNumber', 'SupplierName']
+
+def _travar(fd):
+    try:
+        if fcntl: fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else: msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def _remover(caminho):
+    try:
+        os.remove(caminho)
+        return True
+    except OSError:
+        return False
+
+# Lock entre processos com a trava do sistema (flock no Linux, msvcrt no Windows) em `caminho`.lock.
+# O sistema solta a trava quando o processo morre, então lock abandonado não precisa de limpeza.
+# O dono apaga o arquivo ainda travado; quem travou um arquivo que já foi apagado (outro inode no
+# caminho) desiste, senão dois processos seriam donos ao mesmo tempo.
+@contextmanager
+def lock_arquivo(caminho):
+    lock = caminho + ".lock"
+    fd = None
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_RDWR)
+        dono = _travar(fd) and os.path.samestat(os.fstat(fd), os.stat(lock))
+    except OSError:
+        dono = False
+    if not dono:
+        if fd is not None: os.close(fd)
+        yield False
+        return
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        yield True
+    finally:
+        removido = _remover(lock)
+        if not fcntl:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+        # Windows não apaga arquivo aberto: apaga depois de fechar (falha se outro já o abriu, e tudo bem)
+        if not removido and not fcntl: _remover(lock)
+
+# Alguém tem o lock agora (para quem espera o dono terminar)
+def lock_ocupado(caminho):
+    if not os.path.exists(caminho + ".lock"): return False
+    with lock_arquivo(caminho) as dono: return not dono
+
+# Grava em arquivo temporário no mesmo diretório e troca com os.replace: quem lê nunca vê arquivo pela metade
+def gravar_pickle_atomico(df, caminho):
+    tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df.to_pickle(tmp)
+        os.replace(tmp, caminho)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+def normalizar_busca(texto, campo='SupplierName'):
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode().casefold().strip()
+    # Código e documento: ignora pontuação ("123.456.789-00" == "12345678900")
+    if campo != 'SupplierName': texto = re.sub(r'[^0-9a-z]', '', texto)
+    return texto
+
+class _Snapshot:
+    def __init__(self, df, carregado_em):
+        self.carregado_em = carregado_em
+        self.particoes = {}
+        self.indices = {}
+        self.busca = {}
+        for tipo, taxa in TIPOS_TAXA.items():
+            parte = df[df['TaxTypeName'] == taxa].reset_index(drop=True) if not df.empty else pd.DataFrame()
+            self.particoes[tipo] = parte
+            registros = parte.to_dict('records') if not parte.empty else []
+            indice = {campo: {} for campo in CAMPOS_INDICE}
+            # Nomes repetidos: vale o primeiro na ordem por nome, como no filtro antigo
+            for reg in registros:
+                for campo in CAMPOS_INDICE: indice[campo].setdefault(reg[campo], reg)
+            self.indices[tipo] = indice
+            # Para o typeahead: valores distintos ordenados pela chave normalizada (bisect no prefixo)
+            self.busca[tipo] = {}
+            for campo, por_valor in indice.items():
+                pares = sorted((normalizar_busca(v, campo), v) for v in por_valor if v is not None)
+                self.busca[tipo][campo] = ([p[0] for p in pares], [p[1] for p in pares])
+
+class DiretorioFornecedores:
+    # Carrega o C_Supplier uma vez por processo. Depois do TTL continua servindo a versão antiga
+    # e atualiza em segundo plano (stale-while-revalidate); o snapshot em disco é compartilhado
+    # entre processos e trocado de forma atômica.
+    def __init__(self, baixar, caminho, ttl_segundos=59 * 60):
+        self._baixar = baixar
+        self.caminho = caminho
+        self.ttl = ttl_segundos
+        self._snap = None
+        self._mtime_disco = None
+        self._lock = threading.Lock()
+        self._atualizando = False
+        self._ultima_tentativa = 0
+
+    def _ler_disco(self):
+        try:
+            mtime = os.path.getmtime(self.caminho)
+            if self._snap is not None and mtime == self._mtime_disco: return False
+            df = pd.read_pickle(self.caminho)
+            if df.empty: return False
+            self._snap = _Snapshot(df, mtime)
+            self._mtime_disco = mtime
+            return True
+        except Exception:
+            return False
+
+    def _atualizar(self):
+        try:
+            with lock_arquivo(self.caminho) as dono:
+                # Outro processo já está baixando: ele grava o snapshot e a gente relê do disco
+                if not dono: return
+                df = self._baixar()
+                if df.empty: return
+                df = df.drop_duplicates(subset=['Supplier', 'BPTaxNumber']).sort_values(by='SupplierName')
+                try: gravar_pickle_atomico(df, self.caminho)
+                except Exception as e: logger.error(f"[FORNECEDORES] Falha ao gravar snapshot: {e}")
+                snap = _Snapshot(df, time.time())
+                self._snap = snap
+                try: self._mtime_disco = os.path.getmtime(self.caminho)
+                except OSError: pass
+                logger.info(f"[FORNECEDORES] Diretório atualizado: {len(df)} fornecedores")
+        finally:
+            self._atualizando = False
+
+    def _atualizar_em_segundo_plano(self):
+        with self._lock:
+            # Refresh que falhou não é repetido a cada clique
+            if self._atualizando or time.time() - self._ultima_tentativa < 60: return
+            self._atualizando = True
+            self._ultima_tentativa = time.time()
+        threading.Thread(target=self._atualizar, name="refresh-fornecedores", daemon=True).start()
+
+    def snapshot(self):
+        with self._lock: self._ler_disco()
+        if self._snap is None:
+            # Primeira carga sem snapshot em disco: não tem versão antiga para servir
+            with self._lock:
+                if self._snap is None:
+                    self._atualizando = True
+                    self._atualizar()
+                    # Se outro processo segurava o lock, espera o snapshot dele aparecer
+                    espera = time.time() + 180
+                    while self._snap is None and not self._ler_disco() and lock_ocupado(self.caminho) and time.time() < espera:
+                        time.sleep(1)
+        elif time.time() - self._snap.carregado_em > self.ttl:
+            self._atualizar_em_segundo_plano()
+        return self._snap
+
+    # Recarrega agora se o snapshot vence nos próximos `margem_seg` (padrão: metade do TTL), para o
+    # refresh não cair no meio do expediente. Devolve True se baixou.
+    def aquecer(self, margem_seg=None):
+        margem = self.ttl / 2 if margem_seg is None else margem_seg
+        with self._lock:
+            self._ler_disco()
+            if self._snap is not None and time.time() - self._snap.carregado_em < self.ttl - margem: return False
+            if self._atualizando: return False
+            self._atualizando = True
+            self._ultima_tentativa = time.time()
+        self._atualizar()
+        return True
+
+    def particao(self, tipo):
+        snap = self.snapshot()
+        if snap is None: return pd.DataFrame()
+        return snap.particoes.get(tipo, pd.DataFrame())
+
+    def obter(self, tipo, campo, valor):
+        snap = self.snapshot()
+        if snap is None or valor is None: return None
+        return snap.indices.get(tipo, {}).get(campo, {}).get(valor)
+
+    # Até `limite` valores de `campo`: primeiro os que começam com o termo, depois os que o contêm
+    def buscar(self, tipo, campo, termo, limite=50):
+        snap = self.snapshot()
+        if snap is None: return []
+        chaves, valores = snap.busca.get(tipo, {}).get(campo, ([], []))
+        t = normalizar_busca(termo, campo) if termo else ""
+        if not t: return valores[:limite]
+        achados = []
+        i = bisect_left(chaves, t)
+        while i < len(chaves) and len(achados) < limite and chaves[i].startswith(t):
+            achados.append(valores[i])
+            i += 1
+        if len(achados) < limite:
+            for chave, valor in zip(chaves, valores):
+                if t in chave and not chave.startswith(t):
+                    achados.append(valor)
+                    if len(achados) >= limite: break
+        return achados
@@ -0,0 +1,114 @@
+# VERSÃO: 1.1 - Só guarda em memória o $metadata que carregou; falha é tentada de novo e a cópia é revalidada a cada validade_seg
+import os
+import json
+import time
+import threading
+import logging
+import xml.etree.ElementTree as ET
+from backend.odata_stream import TIPO_NUMERO, TIPO_TEXTO
+
+logger = logging.getLogger(__name__)
+
+EDM_NUMERICOS = {"Edm.Decimal", "Edm.Double", "Edm.Single", "Edm.Int16", "Edm.Int32", "Edm.Int64", "Edm.Byte", "Edm.SByte"}
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+# Documento $metadata (EDMX v2 ou v4) -> {EntitySet: {Propriedade: "Edm.Tipo"}}.
+# Os namespaces mudam entre versões do OData, então as tags são comparadas pelo nome local.
+def ler_metadata(conteudo):
+    raiz = ET.fromstring(conteudo)
+    tipos_entidade = {}
+    for schema in raiz.iter():
+        if _local(schema.tag) != 'Schema': continue
+        namespace = schema.get('Namespace', '')
+        alias = schema.get('Alias')
+        for tipo in schema:
+            if _local(tipo.tag) != 'EntityType': continue
+            props = {p.get('Name'): p.get('Type') for p in tipo if _local(p.tag) == 'Property' and p.get('Name')}
+            tipos_entidade[f"{namespace}.{tipo.get('Name')}"] = props
+            if alias: tipos_entidade[f"{alias}.{tipo.get('Name')}"] = props
+    entidades = {}
+    for elem in raiz.iter():
+        if _local(elem.tag) == 'EntitySet' and elem.get('Name'):
+            entidades[elem.get('Name')] = tipos_entidade.get(elem.get('EntityType'), {})
+    return entidades
+
+def tipo_coluna(tipo_edm):
+    return TIPO_NUMERO if tipo_edm in EDM_NUMERICOS else TIPO_TEXTO
+
+# Um $metadata por serviço, guardado em memória por `validade_seg`; depois disso é revalidado. A cópia
+# em disco guarda o ETag: a revalidação manda If-None-Match e, com 304, o XML não é baixado nem
+# interpretado de novo. Sem ETag do servidor a cópia vale por `validade_seg`. Se o SAP não responde, usa
+# a cópia que houver e tenta de novo em `retentar_seg`; sem cópia nenhuma, nada fica guardado e a
+# próxima chamada depois de `retentar_seg` consulta outra vez.
+class MetadadosSAP:
+    def __init__(self, http, caminho, validade_seg=24 * 3600, retentar_seg=60):
+        self._http = http
+        self.caminho = caminho
+        self.validade_seg = validade_seg
+        self.retentar_seg = retentar_seg
+        self._lock = threading.Lock()
+        self._servicos = {}
+        self._falhas = {}
+
+    def _ler_disco(self):
+        try:
+            with open(self.caminho, encoding="utf-8") as f: return json.load(f)
+        except (OSError, ValueError): return {}
+
+    def _gravar_disco(self, base_url, entrada):
+        dados = self._ler_disco()
+        dados[base_url] = entrada
+        tmp = f"{self.caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f: json.dump(dados, f, ensure_ascii=False)
+            os.replace(tmp, self.caminho)
+        except OSError as e:
+            logger.warning(f"[METADATA] Não foi possível gravar {self.caminho}: {e}")
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+
+    # (entidades, instante em que devem ser revalidadas); entidades None se não há $metadata nenhum
+    def _carregar(self, base_url):
+        agora = time.time()
+        guardada = self._ler_disco().get(base_url)
+        if guardada and not guardada.get("etag") and agora - guardada.get("em", 0) < self.validade_seg:
+            return guardada["entidades"], guardada.get("em", 0) + self.validade_seg
+        headers = {"Accept": "application/xml"}
+        if guardada and guardada.get("etag"): headers["If-None-Match"] = guardada["etag"]
+        try:
+            r = self._http.get(base_url.rstrip('/') + "/$metadata", headers=headers, timeout=30)
+            if r.status_code == 304 and guardada:
+                logger.info(f"[METADATA] {base_url}: sem mudanças (ETag {guardada['etag']})")
+                return guardada["entidades"], agora + self.validade_seg
+            r.raise_for_status()
+            entidades = ler_metadata(r.content)
+        except Exception as e:
+            if guardada:
+                logger.warning(f"[METADATA] {base_url}: falha ao consultar ({e}), usando a cópia em disco")
+                return guardada["entidades"], agora + self.retentar_seg
+            logger.error(f"[METADATA] {base_url}: falha ao consultar ({e}), nova tentativa em {self.retentar_seg}s")
+            return None, agora + self.retentar_seg
+        logger.info(f"[METADATA] {base_url}: {len(entidades)} EntitySets lidos")
+        self._gravar_disco(base_url, {"etag": r.headers.get("ETag"), "em": agora, "entidades": entidades})
+        return entidades, agora + self.validade_seg
+
+    # {Propriedade: "Edm.Tipo"} do EntitySet, ou None se o $metadata não está disponível.
+    # O dict devolvido só muda quando o $metadata é recarregado.
+    def entidade(self, base_url, entity_set):
+        with self._lock:
+            entrada = self._servicos.get(base_url)
+            if entrada is None or time.time() >= entrada[1]:
+                if entrada is None and time.time() < self._falhas.get(base_url, 0): return None
+                entidades, revalidar_em = self._carregar(base_url)
+                if entidades is not None:
+                    entrada = self._servicos[base_url] = (entidades, revalidar_em)
+                    self._falhas.pop(base_url, None)
+                elif entrada is not None:
+                    # Já havia um $metadata carregado: segue com ele até a próxima tentativa
+                    entrada = self._servicos[base_url] = (entrada[0], revalidar_em)
+                else:
+                    self._falhas[base_url] = revalidar_em
+                    return None
+        return entrada[0].get(entity_set)
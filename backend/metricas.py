@@ -0,0 +1,86 @@
+# VERSÃO: 1.0 - Spans de tempo do pipeline (SAP, transformação, serialização, PDF) para /metrics e Server-Timing
+import time
+import threading
+import contextvars
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+# Spans da requisição atual (lista compartilhada com as threads que recebem uma cópia do contexto)
+_spans_requisicao = contextvars.ContextVar("spans_requisicao", default=None)
+
+class _Registro:
+    def __init__(self, recentes=500):
+        self._lock = threading.Lock()
+        self.duracoes = defaultdict(lambda: [0, 0.0, 0.0])  # span -> [qtd, soma, máximo]
+        self.contadores = defaultdict(float)
+        self.recentes = deque(maxlen=recentes)
+
+    def registrar(self, nome, segundos, atributos):
+        with self._lock:
+            d = self.duracoes[nome]
+            d[0] += 1
+            d[1] += segundos
+            d[2] = max(d[2], segundos)
+            self.recentes.append({"span": nome, "ms": round(segundos * 1000, 2), "em": round(time.time(), 3), **atributos})
+
+    def somar(self, nome, valor):
+        with self._lock: self.contadores[nome] += valor
+
+    def resumo(self):
+        with self._lock:
+            return {
+                "spans": {n: {"qtd": q, "soma_s": round(s, 4), "max_s": round(m, 4), "media_ms": round(s / q * 1000, 2) if q else 0} for n, (q, s, m) in sorted(self.duracoes.items())},
+                "contadores": dict(sorted(self.contadores.items())),
+                "recentes": list(self.recentes),
+            }
+
+registro = _Registro()
+
+@contextmanager
+def span(nome, **atributos):
+    inicio = time.perf_counter()
+    try:
+        yield atributos
+    finally:
+        dur = time.perf_counter() - inicio
+        registro.registrar(nome, dur, atributos)
+        spans = _spans_requisicao.get()
+        if spans is not None: spans.append((nome, dur))
+
+def registrar_span(nome, segundos, **atributos):
+    registro.registrar(nome, segundos, atributos)
+    spans = _spans_requisicao.get()
+    if spans is not None: spans.append((nome, segundos))
+
+def somar(nome, valor=1):
+    registro.somar(nome, valor)
+
+def iniciar_requisicao():
+    return _spans_requisicao.set([])
+
+def encerrar_requisicao(token):
+    spans = _spans_requisicao.get() or []
+    _spans_requisicao.reset(token)
+    return spans
+
+# Cabeçalho Server-Timing: spans com o mesmo nome são somados ("sap_pagina;dur=812.3;desc=\"7x\"")
+def server_timing(spans):
+    total = {}
+    for nome, dur in spans:
+        qtd, soma = total.get(nome, (0, 0.0))
+        total[nome] = (qtd + 1, soma + dur)
+    return ", ".join(f'{nome};dur={soma * 1000:.1f}' + (f';desc="{qtd}x"' if qtd > 1 else "") for nome, (qtd, soma) in total.items())
+
+# Formato texto do Prometheus
+def exposicao_prometheus():
+    r = registro.resumo()
+    linhas = ["# TYPE rpp_span_segundos summary"]
+    for nome, d in r["spans"].items():
+        linhas.append(f'rpp_span_segundos_count{{span="{nome}"}} {d["qtd"]}')
+        linhas.append(f'rpp_span_segundos_sum{{span="{nome}"}} {d["soma_s"]}')
+    linhas.append("# TYPE rpp_span_max_segundos gauge")
+    for nome, d in r["spans"].items(): linhas.append(f'rpp_span_max_segundos{{span="{nome}"}} {d["max_s"]}')
+    for nome, valor in r["contadores"].items():
+        linhas.append(f"# TYPE rpp_{nome} counter")
+        linhas.append(f"rpp_{nome} {valor:g}")
+    return "\n".join(linhas) + "\n"
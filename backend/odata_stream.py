@@ -0,0 +1,151 @@
+# VERSÃO: 1.2 - Buffers podem ser truncados (descarta página que falhou no meio)
+import codecs
+import json
+import math
+from array import array
+import numpy as np
+import pandas as pd
+
+TIPO_TEXTO = "texto"
+TIPO_NUMERO = "numero"
+
+CHUNK_BYTES = 64 * 1024
+
+_decoder = json.JSONDecoder()
+
+def _para_float(valor):
+    if valor is None or valor == "": return math.nan
+    try: return float(valor)
+    except (TypeError, ValueError): return math.nan
+
+# Acumula registros OData em buffers tipados, um por coluna do $select
+class BufferColunas:
+    def __init__(self, colunas):
+        self.tipos = dict(colunas)
+        self.dados = {c: array('d') if t == TIPO_NUMERO else [] for c, t in self.tipos.items()}
+        self.linhas = 0
+
+    def adicionar(self, registro):
+        for col, buf in self.dados.items():
+            v = registro.get(col)
+            if self.tipos[col] == TIPO_NUMERO: buf.append(_para_float(v))
+            else: buf.append(v)
+        self.linhas += 1
+
+    # Volta para as primeiras `linhas` linhas (o resto veio de uma página que falhou no meio)
+    def truncar(self, linhas):
+        if linhas >= self.linhas: return
+        for buf in self.dados.values(): del buf[linhas:]
+        self.linhas = linhas
+
+    def to_dataframe(self):
+        if not self.linhas: return pd.DataFrame()
+        cols = {}
+        for col, buf in self.dados.items():
+            cols[col] = np.array(buf, dtype='float64') if isinstance(buf, array) else buf
+        return pd.DataFrame(cols, columns=list(self.dados.keys()))
+
+# Texto decodificado sob demanda a partir dos chunks de bytes da resposta.
+# O trecho já consumido é descartado a cada leitura, então o buffer fica do tamanho de um chunk.
+class _LeitorTexto:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.texto = ""
+        self.pos = 0
+        self.fim = False
+
+    def _ler_mais(self):
+        if self.fim: return False
+        try:
+            novo = self._utf8.decode(next(self._chunks))
+        except StopIteration:
+            novo = self._utf8.decode(b"", final=True)
+            self.fim = True
+        self.texto = self.texto[self.pos:] + novo
+        self.pos = 0
+        return True
+
+    def proximo_char(self):
+        while True:
+            while self.pos < len(self.texto) and self.texto[self.pos] in " \t\r\n": self.pos += 1
+            if self.pos < len(self.texto): return self.texto[self.pos]
+            if not self._ler_mais(): return ""
+
+    def esperar(self, char):
+        if self.proximo_char() != char: raise ValueError(f"JSON OData inválido: esperado '{char}' na posição {self.pos}")
+        self.pos += 1
+
+    def valor(self):
+        self.proximo_char()
+        while True:
+            try:
+                obj, fim = _decoder.raw_decode(self.texto, self.pos)
+                # Um número no final do buffer pode estar cortado: só aceita com algo depois dele
+                if fim < len(self.texto) or self.fim:
+                    self.pos = fim
+                    return obj
+            except json.JSONDecodeError:
+                if self.fim: raise
+            self._ler_mais()
+
+def _ler_array(leitor, buffers):
+    qtd = 0
+    leitor.esperar('[')
+    if leitor.proximo_char() == ']':
+        leitor.pos += 1
+        return qtd
+    while True:
+        registro = leitor.valor()
+        if isinstance(registro, dict):
+            buffers.adicionar(registro)
+            qtd += 1
+        c = leitor.proximo_char()
+        leitor.pos += 1
+        if c == ']': return qtd
+        if c != ',': raise ValueError(f"JSON OData inválido: separador '{c}' em results")
+
+def _ler_objeto(leitor, ao_ler_chave):
+    leitor.esperar('{')
+    if leitor.proximo_char() == '}':
+        leitor.pos += 1
+        return
+    while True:
+        chave = leitor.valor()
+        leitor.esperar(':')
+        ao_ler_chave(chave)
+        c = leitor.proximo_char()
+        leitor.pos += 1
+        if c == '}': return
+        if c != ',': raise ValueError(f"JSON OData inválido: separador '{c}' no objeto")
+
+# Lê uma página {"d": {"results": [...], "__next": ...}} (ou v4: {"value": [...], "@odata.nextLink": ...})
+# sem montar a lista de registros:
+# cada registro vai para os buffers assim que é decodificado e chaves fora do $select
+# (como __metadata) são descartadas. Retorna (qtd_registros, link_next).
+def ler_pagina_odata(chunks, buffers):
+    leitor = _LeitorTexto(chunks)
+    estado = {"qtd": 0, "next": None}
+
+    def chave_d(chave):
+        if chave == 'results': estado["qtd"] += _ler_array(leitor, buffers)
+        elif chave == '__next': estado["next"] = leitor.valor()
+        else: leitor.valor()
+
+    def chave_raiz(chave):
+        if chave == 'value':
+            estado["qtd"] += _ler_array(leitor, buffers)
+            return
+        if chave == '@odata.nextLink':
+            estado["next"] = leitor.valor()
+            return
+        if chave != 'd':
+            leitor.valor()
+            return
+        c = leitor.proximo_char()
+        if c == '{': _ler_objeto(leitor, chave_d)
+        elif c == '[': estado["qtd"] += _ler_array(leitor, buffers)
+        else: leitor.valor()
+
+    _ler_objeto(leitor, chave_raiz)
+    return estado["qtd"], estado["next"]
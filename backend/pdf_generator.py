@@ -1,13 +1,29 @@
-# VERSÃO: 13.9 - Ordem Atualizada com LDC (35) nos PDFs
+# VERSÃO: 14.4 - Motor canvas: quebra de página pela altura real das linhas (células quebradas) e título em maiúsculas como no HTML
 from xhtml2pdf import pisa
 from io import BytesIO
+import numpy as np
 import pandas as pd
 import os
 import logging
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.units import cm
+from reportlab.lib.colors import HexColor, white
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from PIL import Image
+from backend.metricas import span
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# "canvas" desenha direto com reportlab; "html" é o caminho antigo via xhtml2pdf
+MOTOR_PDF = os.getenv("PDF_MOTOR", "canvas")
+ROWS_PER_PAGE = 7
+# MUDANÇA: Inclusão do LDC 35 nos totais
+COLS_TOTAIS = ["Peso Bruto (Kg)", "Peso Tara (Kg)", "Peso liquido (Kg)", "Descontos (Kg)", "Qtd Aplicada (Kg)", "Qtd Devolvida (Kg)", "Peso LDC (35) (Kg)", "Saldo (Kg)"]
+LOGO_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'logo.png')
+
 def formatar_numero(valor, casas=2):
     try:
         if pd.isnull(valor) or valor == 0 or valor == "": return "0,00" if casas==2 else "0"
@@ -15,6 +31,18 @@ def formatar_numero(valor, casas=2):
     except:
         return str(valor)
 
+# formatar_numero aplicado à coluna inteira de uma vez (mesmo resultado, sem try/isnull por célula)
+def formatar_coluna(df, col, casas=2):
+    zero = "0,00" if casas == 2 else "0"
+    if col not in df.columns: return [zero] * len(df)
+    valores = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    tabela = str.maketrans(",.", ".,")
+    return [zero if (v != v or v == 0) else f"{v:,.{casas}f}".translate(tabela) for v in valores.tolist()]
+
+def texto_coluna(df, col):
+    if col not in df.columns: return [''] * len(df)
+    return [str(v) for v in df[col].tolist()]
+
 def get_base_html(conteudo_paginas):
     return f"""
     <!DOCTYPE html>
@@ -47,86 +75,284 @@ def get_base_html(conteudo_paginas):
     </html>
     """
 
-def gerar_pdf_resumido(df, parceiro_info, material_info, safra_info, contrato_info, periodo_texto):
-    try:
-        ROWS_PER_PAGE = 7 
-        # MUDANÇA: Inclusão do LDC 35 nos totais
-        cols_totais = ["Peso Bruto (Kg)", "Peso Tara (Kg)", "Peso liquido (Kg)", "Descontos (Kg)", "Qtd Aplicada (Kg)", "Qtd Devolvida (Kg)", "Peso LDC (35) (Kg)", "Saldo (Kg)"]
-        totais = {col: df[col].sum() for col in cols_totais if col in df.columns}
-
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        logo_path = os.path.join(base_dir, 'assets', 'logo.png')
-        img_tag = f'<img src="{logo_path}" height="35px">' if os.path.exists(logo_path) else ''
-
-        pages_html = ""
-        chunks = [df[i:i + ROWS_PER_PAGE] for i in range(0, len(df), ROWS_PER_PAGE)]
-
-        for i, chunk in enumerate(chunks):
-            rows_html = ""
-            for _, row in chunk.iterrows():
-                unidade = str(row.get('Unidade', ''))
-                avarias = f"Av: {formatar_numero(row.get('% Avariados',0),1)}% | Es: {formatar_numero(row.get('% Esverdeados',0),1)}% | Qu: {formatar_numero(row.get('% Quebrados',0),1)}%"
-
-                r1 = f"""<tr class="row-main"><td>Data: {row.get('Data do edc', '')}</td><td>Roman: {row.get('Romaneio', '')}</td><td>Contr: {row.get('contrato', '')}</td><td>Placa: {row.get('Placa', '')}</td><td>Nota Produtor: {row.get('Nota Produtor', '')}</td><td>Nota Fazendao: {row.get('Nota Fazendao', '')}</td><td colspan="3" class="text-right">Local: {unidade}</td></tr>"""
-                # MUDANÇA: Exibição alinhada: Bruto, Tara, Liq, Desc, Apl, Dev, LDC(35), Saldo
-                r2 = f"""<tr class="row-sec"><td>Bruto: {formatar_numero(row.get('Peso Bruto (Kg)'))}</td><td>Tara: {formatar_numero(row.get('Peso Tara (Kg)'))}</td><td>Líq: {formatar_numero(row.get('Peso liquido (Kg)'))}</td><td>Desc: {formatar_numero(row.get('Descontos (Kg)'))}</td><td>Apl: {formatar_numero(row.get('Qtd Aplicada (Kg)'))}</td><td>Dev: {formatar_numero(row.get('Qtd Devolvida (Kg)'))}</td><td>LDC(35): {formatar_numero(row.get('Peso LDC (35) (Kg)'))}</td><td colspan="2">Saldo: {formatar_numero(row.get('Saldo (Kg)'))}</td></tr>"""
-                r3 = f"""<tr class="row-det"><td colspan="2">Umid: {formatar_numero(row.get('% Umidade'))}%</td><td colspan="2">Imp: {formatar_numero(row.get('% Impurezas'))}%</td><td colspan="5" class="text-right" style="font-style:italic;">{avarias}</td></tr>"""
-                
-                rows_html += r1 + r2 + r3
-            
-            row_total = ""
-            if i == len(chunks) - 1:
-                row_total = f"""<tr class="row-total"><td>TOTAIS:</td><td>Bruto: {formatar_numero(totais.get('Peso Bruto (Kg)',0))}</td><td>Tara: {formatar_numero(totais.get('Peso Tara (Kg)',0))}</td><td>Liq: {formatar_numero(totais.get('Peso liquido (Kg)',0))}</td><td>Desc: {formatar_numero(totais.get('Descontos (Kg)',0))}</td><td>Apl: {formatar_numero(totais.get('Qtd Aplicada (Kg)',0))}</td><td>Dev: {formatar_numero(totais.get('Qtd Devolvida (Kg)',0))}</td><td>LDC(35): {formatar_numero(totais.get('Peso LDC (35) (Kg)',0))}</td><td>Saldo: {formatar_numero(totais.get('Saldo (Kg)',0))}</td></tr>"""
-            
-            break_page = '<div class="page-break"></div>' if i < len(chunks) - 1 else ''
-            
-            pages_html += f"""<div><table class="header-table"><tr><td width="20%">{img_tag}</td><td width="60%" class="title">Relatório Padrão Produtor Resumido</td><td width="20%" class="meta">{periodo_texto}<br>Pág: {i+1}/{len(chunks)}</td></tr></table>
+# Cada linha do relatório é (classe, [(texto, colspan, alinhamento, itálico), ...]); o mesmo
+# layout alimenta o motor canvas e o HTML do xhtml2pdf.
+def _linhas_resumido(df):
+    t = {c: texto_coluna(df, c) for c in ['Data do edc', 'Romaneio', 'contrato', 'Placa', 'Nota Produtor', 'Nota Fazendao', 'Unidade']}
+    n = {c: formatar_coluna(df, c) for c in COLS_TOTAIS + ['% Umidade', '% Impurezas']}
+    av = {c: formatar_coluna(df, c, 1) for c in ['% Avariados', '% Esverdeados', '% Quebrados']}
+    for i in range(len(df)):
+        yield [
+            ("row-main", [(f"Data: {t['Data do edc'][i]}", 1, 'L', False), (f"Roman: {t['Romaneio'][i]}", 1, 'L', False), (f"Contr: {t['contrato'][i]}", 1, 'L', False), (f"Placa: {t['Placa'][i]}", 1, 'L', False), (f"Nota Produtor: {t['Nota Produtor'][i]}", 1, 'L', False), (f"Nota Fazendao: {t['Nota Fazendao'][i]}", 1, 'L', False), (f"Local: {t['Unidade'][i]}", 3, 'R', False)]),
+            # MUDANÇA: Exibição alinhada: Bruto, Tara, Liq, Desc, Apl, Dev, LDC(35), Saldo
+            ("row-sec", [(f"Bruto: {n['Peso Bruto (Kg)'][i]}", 1, 'L', False), (f"Tara: {n['Peso Tara (Kg)'][i]}", 1, 'L', False), (f"Líq: {n['Peso liquido (Kg)'][i]}", 1, 'L', False), (f"Desc: {n['Descontos (Kg)'][i]}", 1, 'L', False), (f"Apl: {n['Qtd Aplicada (Kg)'][i]}", 1, 'L', False), (f"Dev: {n['Qtd Devolvida (Kg)'][i]}", 1, 'L', False), (f"LDC(35): {n['Peso LDC (35) (Kg)'][i]}", 1, 'L', False), (f"Saldo: {n['Saldo (Kg)'][i]}", 2, 'L', False)]),
+            ("row-det", [(f"Umid: {n['% Umidade'][i]}%", 2, 'L', False), (f"Imp: {n['% Impurezas'][i]}%", 2, 'L', False), (f"Av: {av['% Avariados'][i]}% | Es: {av['% Esverdeados'][i]}% | Qu: {av['% Quebrados'][i]}%", 5, 'R', True)]),
+        ]
+
+def _total_resumido(totais):
+    f = {c: formatar_numero(totais.get(c, 0)) for c in COLS_TOTAIS}
+    return ("row-total", [("TOTAIS:", 1, 'L', False), (f"Bruto: {f['Peso Bruto (Kg)']}", 1, 'L', False), (f"Tara: {f['Peso Tara (Kg)']}", 1, 'L', False), (f"Liq: {f['Peso liquido (Kg)']}", 1, 'L', False), (f"Desc: {f['Descontos (Kg)']}", 1, 'L', False), (f"Apl: {f['Qtd Aplicada (Kg)']}", 1, 'L', False), (f"Dev: {f['Qtd Devolvida (Kg)']}", 1, 'L', False), (f"LDC(35): {f['Peso LDC (35) (Kg)']}", 1, 'L', False), (f"Saldo: {f['Saldo (Kg)']}", 1, 'L', False)])
+
+def _linhas_detalhado(df):
+    t = {c: texto_coluna(df, c) for c in ['ID.apl', 'contrato', 'Instr. EDC', 'Romaneio', 'Data do edc', 'Placa', 'Nota Produtor', 'Nota Fazendao', 'Unidade', 'Transgenia']}
+    cols_desc = ['% Umidade', 'Desconto Umidade (Kg)', '% Impurezas', 'Desconto Impureza (Kg)', '% Ardido', 'Desconto Ardidos (Kg)', '% Avariados', 'Desconto Avariados (Kg)', '% Esverdeados', 'Desconto Esverdeados (Kg)', '% Quebrados', 'Desconto Quebrados (Kg)', '% Queimados', 'Desconto Queimados (Kg)']
+    n = {c: formatar_coluna(df, c) for c in COLS_TOTAIS + cols_desc}
+    for i in range(len(df)):
+        yield [
+            ("row-main", [(f"ID: {t['ID.apl'][i]}", 1, 'L', False), (f"Contr: {t['contrato'][i]}", 1, 'L', False), (f"Instr: {t['Instr. EDC'][i]}", 1, 'L', False), (f"Roman: {t['Romaneio'][i]}", 1, 'L', False), (f"Data: {t['Data do edc'][i]}", 1, 'L', False), (f"Placa: {t['Placa'][i]}", 1, 'L', False), (f"Nota Produtor: {t['Nota Produtor'][i]}", 1, 'L', False), (f"Nota Fazendao: {t['Nota Fazendao'][i]}", 1, 'L', False), (f"Local: {t['Unidade'][i][:30]}", 2, 'L', False)]),
+            # MUDANÇA: Exibição alinhada no detalhado
+            ("row-sec", [(f"Bruto: {n['Peso Bruto (Kg)'][i]}", 1, 'L', False), (f"Tara: {n['Peso Tara (Kg)'][i]}", 1, 'L', False), (f"Líq: {n['Peso liquido (Kg)'][i]}", 1, 'L', False), (f"Desc: {n['Descontos (Kg)'][i]}", 1, 'L', False), (f"Apl: {n['Qtd Aplicada (Kg)'][i]}", 1, 'L', False), (f"Dev: {n['Qtd Devolvida (Kg)'][i]}", 1, 'L', False), (f"LDC(35): {n['Peso LDC (35) (Kg)'][i]}", 2, 'L', False), (f"Saldo: {n['Saldo (Kg)'][i]}", 2, 'L', False)]),
+            ("row-det", [(f"Transg: {t['Transgenia'][i]}", 1, 'L', False), (f"Umid: {n['% Umidade'][i]}% / {n['Desconto Umidade (Kg)'][i]}", 1, 'L', False), (f"Imp: {n['% Impurezas'][i]}% / {n['Desconto Impureza (Kg)'][i]}", 1, 'L', False), (f"Ard: {n['% Ardido'][i]}% / {n['Desconto Ardidos (Kg)'][i]}", 1, 'L', False), (f"Ava: {n['% Avariados'][i]}% / {n['Desconto Avariados (Kg)'][i]}", 1, 'L', False), (f"Esv: {n['% Esverdeados'][i]}% / {n['Desconto Esverdeados (Kg)'][i]}", 1, 'L', False), (f"Que: {n['% Quebrados'][i]}% / {n['Desconto Quebrados (Kg)'][i]}", 1, 'L', False), (f"Quei: {n['% Queimados'][i]}% / {n['Desconto Queimados (Kg)'][i]}", 3, 'L', False)]),
+        ]
+
+def _total_detalhado(totais):
+    f = {c: formatar_numero(totais.get(c, 0)) for c in COLS_TOTAIS}
+    return ("row-total", [("TOTAIS:", 1, 'L', False), (f"Bruto: {f['Peso Bruto (Kg)']}", 1, 'L', False), (f"Tara: {f['Peso Tara (Kg)']}", 1, 'L', False), (f"Líq: {f['Peso liquido (Kg)']}", 1, 'L', False), (f"Desc: {f['Descontos (Kg)']}", 1, 'L', False), (f"Apl: {f['Qtd Aplicada (Kg)']}", 1, 'L', False), (f"Dev: {f['Qtd Devolvida (Kg)']}", 1, 'L', False), (f"LDC(35): {f['Peso LDC (35) (Kg)']}", 2, 'L', False), (f"Saldo: {f['Saldo (Kg)']}", 1, 'L', False)])
+
+def _paginas(linhas):
+    pagina = []
+    for grupo in linhas:
+        pagina.append(grupo)
+        if len(pagina) == ROWS_PER_PAGE:
+            yield pagina
+            pagina = []
+    if pagina: yield pagina
+
+# ---------- Motor HTML (xhtml2pdf) ----------
+
+def _html_linha(classe, celulas):
+    tds = ""
+    for texto, colspan, alinhamento, italico in celulas:
+        attrs = f' colspan="{colspan}"' if colspan > 1 else ""
+        if alinhamento == 'R': attrs += ' class="text-right"'
+        if italico: attrs += ' style="font-style:italic;"'
+        tds += f"<td{attrs}>{texto}</td>"
+    return f'<tr class="{classe}">{tds}</tr>'
+
+def _renderizar_html(destino, titulo, df, linhas, linha_total, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, progresso=None):
+    if isinstance(destino, str):
+        with open(destino, 'wb') as f: return _renderizar_html(f, titulo, df, linhas, linha_total, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, progresso)
+    total_paginas = -(-len(df) // ROWS_PER_PAGE)
+    with span("pdf_html", paginas=total_paginas):
+        pages_html = _montar_html(titulo, total_paginas, linhas, linha_total, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, progresso)
+    with span("pdf_pisa", paginas=total_paginas):
+        pisa.CreatePDF(get_base_html(pages_html), dest=destino)
+    if progresso: progresso(total_paginas, total_paginas)
+
+def _montar_html(titulo, total_paginas, linhas, linha_total, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, progresso=None):
+    img_tag = f'<img src="{LOGO_PATH}" height="35px">' if os.path.exists(LOGO_PATH) else ''
+    pages_html = ""
+    for i, pagina in enumerate(_paginas(linhas)):
+        rows_html = "".join(_html_linha(classe, celulas) for grupo in pagina for classe, celulas in grupo)
+        row_total = _html_linha(*linha_total) if i == total_paginas - 1 else ""
+        break_page = '<div class="page-break"></div>' if i < total_paginas - 1 else ''
+        pages_html += f"""<div><table class="header-table"><tr><td width="20%">{img_tag}</td><td width="60%" class="title">{titulo}</td><td width="20%" class="meta">{periodo_texto}<br>Pág: {i+1}/{total_paginas}</td></tr></table>
             <div class="info-box">PARCEIRO: {parceiro_info} &nbsp;&nbsp;|&nbsp;&nbsp; MATERIAL: {material_info} &nbsp;&nbsp;|&nbsp;&nbsp; SAFRA: {safra_info} &nbsp;&nbsp;|&nbsp;&nbsp; CONTRATO: {contrato_info}</div>
             <table>{rows_html}{row_total}</table></div>{break_page}"""
-        
-        buffer = BytesIO()
-        pisa.CreatePDF(get_base_html(pages_html), dest=buffer)
+        # O xhtml2pdf não avisa por página: aqui o progresso é da montagem do HTML
+        if progresso: progresso(i, total_paginas)
+    return pages_html
+
+# ---------- Motor canvas (reportlab) ----------
+
+COR_TITULO = HexColor("#0C5959")
+ESTILOS_LINHA = {
+    # classe: (fonte, tamanho, cor texto, fundo, borda superior, borda inferior, espaçamento vertical)
+    "row-main": ("Helvetica-Bold", 7.5, HexColor("#333333"), HexColor("#F2F2F2"), HexColor("#999999"), None, 8),
+    "row-sec": ("Helvetica", 7.5, HexColor("#000000"), None, None, HexColor("#CCCCCC"), 8),
+    "row-det": ("Helvetica-Oblique", 6.5, HexColor("#555555"), None, None, HexColor("#DDDDDD"), 6),
+    "row-total": ("Helvetica-Bold", 8, white, HexColor("#EF6100"), None, None, 12),
+}
+# Texto que não cabe na célula quebra em até MAX_LINHAS_CELULA linhas, como no HTML
+MAX_LINHAS_CELULA = 2
+
+_logo_reduzido = None
+
+# O logo original tem ~6000px de largura: reduz uma vez por processo para ~4x a resolução impressa
+def _logo_canvas():
+    global _logo_reduzido
+    if _logo_reduzido is None and os.path.exists(LOGO_PATH):
+        img = Image.open(LOGO_PATH)
+        img.thumbnail((img.width * 120 // img.height, 120))
+        _logo_reduzido = ImageReader(img)
+    return _logo_reduzido
+
+def _cortar(texto, fonte, tamanho, largura):
+    if stringWidth(texto, fonte, tamanho) <= largura: return texto
+    while texto and stringWidth(texto + "…", fonte, tamanho) > largura: texto = texto[:-1]
+    return texto + "…"
+
+def _quebrar(texto, fonte, tamanho, largura):
+    if stringWidth(texto, fonte, tamanho) <= largura: return [texto]
+    linhas = simpleSplit(texto, fonte, tamanho, largura) or [""]
+    if len(linhas) > MAX_LINHAS_CELULA:
+        linhas = linhas[:MAX_LINHAS_CELULA - 1] + [_cortar(" ".join(linhas[MAX_LINHAS_CELULA - 1:]), fonte, tamanho, largura)]
+    return [_cortar(l, fonte, tamanho, largura) for l in linhas]
+
+class _PaginaCanvas:
+    # `paginas_estimadas` só reserva a largura do total em "Pág: n/total"; o total de verdade
+    # (linhas altas podem abrir páginas a mais) é escrito num form no fim, em `fechar`
+    def __init__(self, destino, titulo, n_colunas, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, paginas_estimadas=1):
+        self.c = canvas.Canvas(destino, pagesize=landscape(A4), pageCompression=1)
+        self.largura, self.altura = landscape(A4)
+        self.margem = 1 * cm
+        self.util = self.largura - 2 * self.margem
+        self.col = self.util / n_colunas
+        # text-transform: uppercase do .title no HTML
+        self.titulo = titulo.upper()
+        self.periodo = periodo_texto
+        self.info = f"PARCEIRO: {parceiro_info}   |   MATERIAL: {material_info}   |   SAFRA: {safra_info}   |   CONTRATO: {contrato_info}"
+        self.logo = _logo_canvas()
+        self._logo_form = False
+        # Dígitos da Helvetica têm todos a mesma largura
+        self._largura_total = stringWidth("0" * len(str(max(paginas_estimadas, 1))), "Helvetica", 7)
+
+    def cabecalho(self, pagina):
+        c, m = self.c, self.margem
+        topo = self.altura - m
+        if self.logo is not None:
+            # Imagem embutida uma vez como XObject e reaproveitada em todas as páginas
+            if not self._logo_form:
+                lw, lh = self.logo.getSize()
+                altura_logo = 26
+                c.beginForm("logo")
+                c.drawImage(self.logo, m + 4, topo - altura_logo - 4, width=altura_logo * lw / lh, height=altura_logo, mask='auto')
+                c.endForm()
+                self._logo_form = True
+            c.doForm("logo")
+        c.setFillColor(COR_TITULO)
+        c.setFont("Helvetica-Bold", 12)
+        c.drawCentredString(self.largura / 2, topo - 22, self.titulo)
+        c.setFillColor(HexColor("#333333"))
+        c.setFont("Helvetica", 7)
+        c.drawRightString(self.largura - m - 4, topo - 14, self.periodo)
+        x_total = self.largura - m - 4 - self._largura_total
+        c.drawRightString(x_total, topo - 23, f"Pág: {pagina}/")
+        c.saveState()
+        c.translate(x_total, topo - 23)
+        c.doForm("total_paginas")
+        c.restoreState()
+        # info-box
+        y = topo - 52
+        c.setStrokeColor(HexColor("#CCCCCC"))
+        c.setFillColor(white)
+        c.rect(m, y, self.util, 16, stroke=1, fill=1)
+        c.setFillColor(COR_TITULO)
+        c.setFont("Helvetica-Bold", 7.5)
+        c.drawString(m + 5, y + 5, _cortar(self.info, "Helvetica-Bold", 7.5, self.util - 10))
+        return y - 8
+
+    # Total de páginas, depois da última: preenche o form que todos os cabeçalhos usam
+    def fechar(self, total):
+        c = self.c
+        c.beginForm("total_paginas")
+        c.setFillColor(HexColor("#333333"))
+        c.setFont("Helvetica", 7)
+        c.drawString(0, 0, str(total))
+        c.endForm()
+
+    # Células já quebradas e a altura da linha, para decidir a quebra de página antes de desenhar
+    def medir(self, classe, celulas):
+        fonte, tamanho = ESTILOS_LINHA[classe][:2]
+        blocos = []
+        for texto, colspan, alinhamento, italico in celulas:
+            w = self.col * colspan
+            f = "Helvetica-Oblique" if italico and fonte == "Helvetica" else fonte
+            blocos.append((w, f, alinhamento, _quebrar(texto, f, tamanho, w - 6)))
+        n_linhas = max(len(b[3]) for b in blocos)
+        return classe, blocos, n_linhas * tamanho * 1.2 + ESTILOS_LINHA[classe][6]
+
+    def linha(self, y, medida):
+        c = self.c
+        classe, blocos, altura = medida
+        fonte, tamanho, cor, fundo, borda_sup, borda_inf, espaco = ESTILOS_LINHA[classe]
+        entrelinha = tamanho * 1.2
+        y -= altura
+        if fundo is not None:
+            c.setFillColor(fundo)
+            c.rect(self.margem, y, self.util, altura, stroke=0, fill=1)
+        if borda_sup is not None:
+            c.setStrokeColor(borda_sup)
+            c.line(self.margem, y + altura, self.margem + self.util, y + altura)
+        if borda_inf is not None:
+            c.setStrokeColor(borda_inf)
+            c.line(self.margem, y, self.margem + self.util, y)
+        c.setFillColor(cor)
+        x = self.margem
+        for w, f, alinhamento, linhas in blocos:
+            c.setFont(f, tamanho)
+            # Centraliza verticalmente o bloco da célula, como vertical-align: middle
+            base = y + (altura + len(linhas) * entrelinha) / 2 - tamanho
+            for texto in linhas:
+                if alinhamento == 'R': c.drawRightString(x + w - 3, base, texto)
+                else: c.drawString(x + 3, base, texto)
+                base -= entrelinha
+            x += w
+        return y
+
+# Um grupo (as linhas de um romaneio) nunca é dividido: vai para a próxima página se já há
+# ROWS_PER_PAGE grupos ou se a altura medida dele passa da margem inferior
+def _renderizar_canvas(destino, titulo, n_colunas, df, linhas, linha_total, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, progresso=None):
+    estimadas = -(-len(df) // ROWS_PER_PAGE)
+    pg = _PaginaCanvas(destino, titulo, n_colunas, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, paginas_estimadas=estimadas)
+    pagina, y, grupos = 0, None, 0
+
+    def nova_pagina():
+        nonlocal pagina, y, grupos
+        if y is not None:
+            pg.c.showPage()
+            if progresso: progresso(pagina, max(estimadas, pagina + 1))
+        pagina += 1
+        y, grupos = pg.cabecalho(pagina), 0
+
+    for grupo in linhas:
+        medidas = [pg.medir(classe, celulas) for classe, celulas in grupo]
+        if y is None or grupos == ROWS_PER_PAGE or y - sum(m[2] for m in medidas) < pg.margem: nova_pagina()
+        for medida in medidas: y = pg.linha(y, medida)
+        grupos += 1
+    if y is not None:
+        total = pg.medir(*linha_total)
+        if y - total[2] < pg.margem: nova_pagina()
+        pg.linha(y, total)
+    pg.c.showPage()
+    if progresso and pagina: progresso(pagina, pagina)
+    pg.fechar(pagina)
+    pg.c.save()
+
+def _gerar(destino, motor, titulo, n_colunas, df, linhas_fn, total_fn, *infos, progresso=None):
+    totais = {col: df[col].sum() for col in COLS_TOTAIS if col in df.columns}
+    motor = motor or MOTOR_PDF
+    if motor == "canvas":
+        try:
+            with span("pdf_canvas", linhas=len(df)): _renderizar_canvas(destino, titulo, n_colunas, df, linhas_fn(df), total_fn(totais), *infos, progresso=progresso)
+            return
+        except Exception as e:
+            logger.error(f"[PDF] Motor canvas falhou, usando xhtml2pdf: {e}")
+            if hasattr(destino, 'seek'):
+                destino.seek(0)
+                destino.truncate()
+    _renderizar_html(destino, titulo, df, linhas_fn(df), total_fn(totais), *infos, progresso=progresso)
+
+# Com `destino` (caminho) o PDF vai direto para o arquivo e a função devolve o caminho;
+# sem ele devolve um BytesIO como antes. `progresso(paginas_prontas, total)` é chamado a cada página.
+def gerar_pdf_resumido(df, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, motor=None, destino=None, progresso=None):
+    try:
+        buffer = destino or BytesIO()
+        _gerar(buffer, motor, "Relatório Padrão Produtor Resumido", 9, df, _linhas_resumido, _total_resumido, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, progresso=progresso)
+        if destino: return destino
         buffer.seek(0)
         return buffer
     except Exception as e:
         logger.error(f"ERRO RESUMIDO: {e}")
-        return BytesIO()
+        return None if destino else BytesIO()
 
-def gerar_pdf_detalhado(df, parceiro_info, material_info, safra_info, contrato_info, periodo_texto):
+def gerar_pdf_detalhado(df, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, motor=None, destino=None, progresso=None):
     try:
-        ROWS_PER_PAGE = 7
-        cols_totais = ["Peso Bruto (Kg)", "Peso Tara (Kg)", "Peso liquido (Kg)", "Descontos (Kg)", "Qtd Aplicada (Kg)", "Qtd Devolvida (Kg)", "Peso LDC (35) (Kg)", "Saldo (Kg)"]
-        totais_gerais = {col: df[col].sum() for col in cols_totais if col in df.columns}
-
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        logo_path = os.path.join(base_dir, 'assets', 'logo.png')
-        img_tag = f'<img src="{logo_path}" height="35px">' if os.path.exists(logo_path) else ''
-        
-        pages_html = ""
-        chunks = [df[i:i + ROWS_PER_PAGE] for i in range(0, len(df), ROWS_PER_PAGE)]
-        
-        for i, chunk in enumerate(chunks):
-            rows_html = ""
-            for _, row in chunk.iterrows():
-                r1 = f"""<tr class="row-main"><td>ID: {row.get('ID.apl', '')}</td><td>Contr: {row.get('contrato', '')}</td><td>Instr: {row.get('Instr. EDC', '')}</td><td>Roman: {row.get('Romaneio', '')}</td><td>Data: {row.get('Data do edc', '')}</td><td>Placa: {row.get('Placa', '')}</td><td>Nota Produtor: {row.get('Nota Produtor', '')}</td><td>Nota Fazendao: {row.get('Nota Fazendao', '')}</td><td colspan="2">Local: {str(row.get('Unidade', ''))[:30]}</td></tr>"""
-                # MUDANÇA: Exibição alinhada no detalhado
-                r2 = f"""<tr class="row-sec"><td>Bruto: {formatar_numero(row.get('Peso Bruto (Kg)'))}</td><td>Tara: {formatar_numero(row.get('Peso Tara (Kg)'))}</td><td>Líq: {formatar_numero(row.get('Peso liquido (Kg)'))}</td><td>Desc: {formatar_numero(row.get('Descontos (Kg)'))}</td><td>Apl: {formatar_numero(row.get('Qtd Aplicada (Kg)'))}</td><td>Dev: {formatar_numero(row.get('Qtd Devolvida (Kg)'))}</td><td colspan="2">LDC(35): {formatar_numero(row.get('Peso LDC (35) (Kg)'))}</td><td colspan="2">Saldo: {formatar_numero(row.get('Saldo (Kg)'))}</td></tr>"""
-                r3 = f"""<tr class="row-det"><td>Transg: {row.get('Transgenia', '')}</td><td>Umid: {formatar_numero(row.get('% Umidade'))}% / {formatar_numero(row.get('Desconto Umidade (Kg)'))}</td><td>Imp: {formatar_numero(row.get('% Impurezas'))}% / {formatar_numero(row.get('Desconto Impureza (Kg)'))}</td><td>Ard: {formatar_numero(row.get('% Ardido'))}% / {formatar_numero(row.get('Desconto Ardidos (Kg)'))}</td><td>Ava: {formatar_numero(row.get('% Avariados'))}% / {formatar_numero(row.get('Desconto Avariados (Kg)'))}</td><td>Esv: {formatar_numero(row.get('% Esverdeados'))}% / {formatar_numero(row.get('Desconto Esverdeados (Kg)'))}</td><td>Que: {formatar_numero(row.get('% Quebrados'))}% / {formatar_numero(row.get('Desconto Quebrados (Kg)'))}</td><td colspan="3">Quei: {formatar_numero(row.get('% Queimados'))}% / {formatar_numero(row.get('Desconto Queimados (Kg)'))}</td></tr>"""
-                rows_html += r1 + r2 + r3
-
-            row_total = ""
-            if i == len(chunks) - 1:
-                row_total = f"""<tr class="row-total"><td>TOTAIS:</td><td>Bruto: {formatar_numero(totais_gerais.get('Peso Bruto (Kg)', 0))}</td><td>Tara: {formatar_numero(totais_gerais.get('Peso Tara (Kg)', 0))}</td><td>Líq: {formatar_numero(totais_gerais.get('Peso liquido (Kg)', 0))}</td><td>Desc: {formatar_numero(totais_gerais.get('Descontos (Kg)', 0))}</td><td>Apl: {formatar_numero(totais_gerais.get('Qtd Aplicada (Kg)', 0))}</td><td>Dev: {formatar_numero(totais_gerais.get('Qtd Devolvida (Kg)', 0))}</td><td colspan="2">LDC(35): {formatar_numero(totais_gerais.get('Peso LDC (35) (Kg)', 0))}</td><td>Saldo: {formatar_numero(totais_gerais.get('Saldo (Kg)', 0))}</td></tr>"""
-
-            break_page = '<div class="page-break"></div>' if i < len(chunks) - 1 else ''
-            pages_html += f"""<div><table class="header-table"><tr><td width="20%">{img_tag}</td><td width="60%" class="title">Relatório Padrão Produtor Detalhado</td><td width="20%" class="meta">{periodo_texto}<br>Pág: {i+1}/{len(chunks)}</td></tr></table>
-            <div class="info-box">PARCEIRO: {parceiro_info} &nbsp;&nbsp;|&nbsp;&nbsp; MATERIAL: {material_info} &nbsp;&nbsp;|&nbsp;&nbsp; SAFRA: {safra_info} &nbsp;&nbsp;|&nbsp;&nbsp; CONTRATO: {contrato_info}</div>
-            <table>{rows_html}{row_total}</table></div>{break_page}"""
-
-        buffer = BytesIO()
-        pisa.CreatePDF(get_base_html(pages_html), dest=buffer)
+        buffer = destino or BytesIO()
+        _gerar(buffer, motor, "Relatório Padrão Produtor Detalhado", 10, df, _linhas_detalhado, _total_detalhado, parceiro_info, material_info, safra_info, contrato_info, periodo_texto, progresso=progresso)
+        if destino: return destino
         buffer.seek(0)
         return buffer
     except Exception as e:
         logger.error(f"ERRO DETALHADO: {e}")
-        return BytesIO()
\ No newline at end of file
+        return None if destino else BytesIO()
@@ -1,11 +1,21 @@
-# VERSÃO: 12.8 - Renomeado para Peso LDC (35) e Atualização de Saldo
+# VERSÃO: 14.6 - esquema_romaneio acompanha o $metadata recarregado e não guarda o esquema padrão quando o $metadata falha
 import os
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import urllib3
 import logging
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from backend.metricas import span, registrar_span, somar
+from backend.odata_stream import BufferColunas, ler_pagina_odata, TIPO_NUMERO, TIPO_TEXTO, CHUNK_BYTES
+from backend.metadados_sap import MetadadosSAP, tipo_coluna
+from backend.fornecedores import DiretorioFornecedores
+from backend.store_romaneios import StoreRomaneios, TODOS_PARCEIROS, dias_do_periodo, intervalos_continuos
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,92 +25,537 @@ load_dotenv()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CACHE_FILE = os.path.join(BASE_DIR, "cache_fornecedores.pkl")
+STORE_ROMANEIOS_FILE = os.path.join(BASE_DIR, "cache_romaneios.sqlite")
+METADATA_FILE = os.path.join(BASE_DIR, "cache_metadata.json")
+ENTIDADE_ROMANEIO = "ZC_ACM_LISTA_ROMANEIO_Q001"
+
+COLS_ROMANEIO = [
+    "Parceiro", "Parceiro_T", "Instr_EDC", "contrato", "Num_Pesagem", "data_edc", 
+    "Material", "NomeMaterial", "NomeSafra", "NomeLocal_Evento", "Placa", 
+    "TextoTransgenia_Descarga", "Peso_Bruto_Descarga", "Tara_Descarga", 
+    "Peso_Liquido_Descarga", "Peso_Liquido_Carga", "Qtd_Aplicada", "Qtd_Devolvida", "Peso_Total", "Umidade_Descarga", 
+    "Peso_umidade", "Impurezas_Descarga", "Peso_Impurezas", "Ardidos_Descarga", 
+    "Peso_Ardidos", "Avariados_Descarga", "Peso_Avariados", "Esverdeados_Descarga", 
+    "Peso_Esverdeados", "Quebrados_Descarga", "Peso_Quebrados", "Queimados_Descarga", 
+    "Peso_Queimados", "Doc_Aplicacao", "Tipo_Contrato", 
+    "ChaveNFeContraNota", "ChaveNFeReferenciada"
+]
+
+INSTR_EDC = ['07', '03', '35']
+
+# Campos que viram "(Kg)" ou "%" no relatório. Valem quando o $metadata não está disponível e também
+# contra ele: o relatório soma esses campos mesmo que o serviço os declare como Edm.String.
+COLS_ROMANEIO_NUMERICAS = {
+    "Peso_Bruto_Descarga", "Tara_Descarga", "Peso_Liquido_Descarga", "Peso_Liquido_Carga", "Qtd_Aplicada", "Qtd_Devolvida",
+    "Peso_Total", "Umidade_Descarga", "Peso_umidade", "Impurezas_Descarga", "Peso_Impurezas", "Ardidos_Descarga", "Peso_Ardidos",
+    "Avariados_Descarga", "Peso_Avariados", "Esverdeados_Descarga", "Peso_Esverdeados", "Quebrados_Descarga", "Peso_Quebrados",
+    "Queimados_Descarga", "Peso_Queimados"
+}
+# NUMC do SAP (texto no $metadata) que o relatório mostra como número
+COLS_ROMANEIO_DOC_NUMERO = {"Num_Pesagem"}
+TIPOS_ROMANEIO = {c: TIPO_NUMERO if c in COLS_ROMANEIO_NUMERICAS else TIPO_TEXTO for c in COLS_ROMANEIO}
+
+# MUDANÇA: Renomeado para Peso LDC (35)
+RENAME_ROMANEIO = {"Doc_Aplicacao": "ID.apl", "Parceiro": "Cod. Parceiro", "Parceiro_T": "Razão Social", "Instr_EDC": "Instr. EDC", "Num_Pesagem": "Romaneio", "NomeLocal_Evento": "Unidade", "NomeMaterial": "NomeMaterial", "TextoTransgenia_Descarga": "Transgenia", "Peso_Bruto_Descarga": "Peso Bruto (Kg)", "Tara_Descarga": "Peso Tara (Kg)", "Peso_Liquido_Descarga": "Peso liquido (Kg)", "Qtd_Aplicada": "Qtd Aplicada (Kg)", "Qtd_Devolvida": "Qtd Devolvida (Kg)", "Peso_Liquido_Carga": "Peso LDC (35) (Kg)", "Peso_Total": "Descontos (Kg)", "Umidade_Descarga": "% Umidade", "Peso_umidade": "Desconto Umidade (Kg)", "Impurezas_Descarga": "% Impurezas", "Peso_Impurezas": "Desconto Impureza (Kg)", "Ardidos_Descarga": "% Ardido", "Peso_Ardidos": "Desconto Ardidos (Kg)", "Avariados_Descarga": "% Avariados", "Peso_Avariados": "Desconto Avariados (Kg)", "Esverdeados_Descarga": "% Esverdeados", "Peso_Esverdeados": "Desconto Esverdeados (Kg)", "Quebrados_Descarga": "% Quebrados", "Peso_Quebrados": "Desconto Quebrados (Kg)", "Queimados_Descarga": "% Queimados", "Peso_Queimados": "Desconto Queimados (Kg)", "data_edc": "Data do edc"}
+
+# Filtros opcionais do relatório -> campo do ZC_ACM_LISTA_ROMANEIO_Q001 (o nome é o mesmo depois do rename)
+CAMPOS_RESTRICAO = {"material": "NomeMaterial", "safra": "NomeSafra", "contrato": "contrato"}
+
+def restricoes_romaneio(material=None, safra=None, contrato=None):
+    valores = {"material": material, "safra": safra, "contrato": contrato}
+    return {CAMPOS_RESTRICAO[k]: v for k, v in valores.items() if v}
+
+# Serve tanto para as linhas cruas quanto para o resultado já transformado
+def filtrar_restricoes(df, restricoes):
+    for campo, valor in (restricoes or {}).items():
+        if campo in df.columns: df = df[df[campo] == valor]
+    return df
+
+def _literal_odata(valor):
+    return "'" + str(valor).replace("'", "''") + "'"
+
+# Número da nota (posições 26-34 da chave NF-e de 44 dígitos, sem zeros à esquerda); vazio se a chave não tem 44
+def extrair_notas(chaves):
+    chaves = chaves.astype(str).str.strip()
+    nota = chaves.str[25:34].str.lstrip('0').replace('', '0')
+    return pd.Series(np.where(chaves.str.len() == 44, nota, ''), index=chaves.index)
+
+def _numerico(df, col):
+    if col not in df.columns: return 0
+    return pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+COLS_CATEGORIA = ["Cod. Parceiro", "Razão Social", "Material", "NomeMaterial", "NomeSafra", "Unidade", "Transgenia", "Instr. EDC", "contrato", "Placa"]
+COL_DATA = "Data do edc"
+
+# Linhas cruas do ZC_ACM_LISTA_ROMANEIO_Q001 -> colunas do relatório.
+# Com `compacto` a data fica datetime64 e o resultado passa por compactar_romaneios.
+# `tipos` ({campo SAP: tipo}) diz quais campos são numéricos; o padrão é TIPOS_ROMANEIO.
+def transformar_romaneios(df_final, compacto=False, tipos=None):
+    df_final['Nota Produtor'] = extrair_notas(df_final['ChaveNFeReferenciada'])
+    df_final['Nota Fazendao'] = extrair_notas(df_final['ChaveNFeContraNota'])
+
+    df_final['Qtd_Aplicada'] = _numerico(df_final, 'Qtd_Aplicada')
+    df_final['Qtd_Devolvida'] = _numerico(df_final, 'Qtd_Devolvida')
+    df_final['Peso_Liquido_Carga'] = _numerico(df_final, 'Peso_Liquido_Carga')
+
+    # Peso de carga só conta para LDC (Instr_EDC 35), sempre negativo
+    instr = df_final['Instr_EDC'].astype(str).str.strip() if 'Instr_EDC' in df_final.columns else pd.Series('', index=df_final.index)
+    df_final['Peso_Liquido_Carga'] = np.where(instr == '35', -df_final['Peso_Liquido_Carga'].abs(), 0.0)
+
+    if 'data_edc' in df_final.columns:
+        df_final['data_edc'] = pd.to_datetime(df_final['data_edc'], format='%Y%m%d', errors='coerce')
+        if not compacto: df_final['data_edc'] = df_final['data_edc'].dt.strftime('%d/%m/%Y')
+
+    # O stream já entrega float nos campos numéricos; texto (store antigo, caminho sem stream, NUMC) é convertido aqui
+    tipos = tipos or TIPOS_ROMANEIO
+    cols_num = [c for c in df_final.columns if tipos.get(c) == TIPO_NUMERO or c in COLS_ROMANEIO_DOC_NUMERO]
+    for col in cols_num:
+        if not pd.api.types.is_numeric_dtype(df_final[col]): df_final[col] = pd.to_numeric(df_final[col], errors='coerce')
+    if cols_num: df_final[cols_num] = df_final[cols_num].fillna(0)
+
+    df_final.rename(columns=RENAME_ROMANEIO, inplace=True)
+    df_final.drop(columns=[c for c in ["Tipo_Contrato", "ChaveNFeContraNota", "ChaveNFeReferenciada"] if c in df_final.columns], inplace=True)
+
+    # MUDANÇA: Cálculo referenciando o novo nome "Peso LDC (35) (Kg)"
+    df_final['Saldo (Kg)'] = df_final['Qtd Aplicada (Kg)'] - df_final['Qtd Devolvida (Kg)'] - df_final['Peso LDC (35) (Kg)'].abs()
+    return compactar_romaneios(df_final) if compacto else df_final
+
+# Texto repetido vira category; número só troca de tipo se a conversão for exata. Inteiros
+# (pesos em Kg inteiros, Romaneio) viram int32/int64; float32 fica de fora porque as somas
+# dos totais acumulariam em precisão simples.
+def compactar_romaneios(df):
+    for col in COLS_CATEGORIA:
+        if col in df.columns and df[col].nunique(dropna=False) <= max(1, len(df) // 2):
+            df[col] = df[col].astype('category')
+    for col in df.select_dtypes(include='float').columns:
+        valores = df[col].to_numpy()
+        if np.isfinite(valores).all() and (valores == np.round(valores)).all():
+            limite = np.iinfo(np.int32)
+            cabe_32 = valores.size == 0 or (valores.min() >= limite.min and valores.max() <= limite.max)
+            df[col] = valores.astype('int32' if cabe_32 else 'int64')
+    return df
+
+# MUDANÇA: Ordem Atualizada Conforme Solicitação
+ORDEM_COLUNAS = [
+    "ID.apl", "Razão Social", "contrato", "Instr. EDC", "Romaneio", 
+    "Data do edc", "Material", "NomeMaterial", "NomeSafra", "Unidade", "Placa", 
+    "Nota Produtor", "Nota Fazendao", 
+    "Transgenia", 
+    "Peso Bruto (Kg)", "Peso Tara (Kg)", "Peso liquido (Kg)", 
+    "Descontos (Kg)", "Qtd Aplicada (Kg)", "Qtd Devolvida (Kg)", 
+    "Peso LDC (35) (Kg)", "Saldo (Kg)", 
+    "% Umidade", "Desconto Umidade (Kg)", 
+    "% Impurezas", "Desconto Impureza (Kg)"
+]
+COLS_OCULTAS = ["Cod. Parceiro", "DataLancamento", "Cancelado"]
+
+# MUDANÇA: Adicionado LDC(35) e reordenado os balões
+TOTAIS_RELATORIO = {"Bruto": "Peso Bruto (Kg)", "Tara": "Peso Tara (Kg)", "Líquido": "Peso liquido (Kg)", "Descontos": "Descontos (Kg)", "Aplicada": "Qtd Aplicada (Kg)", "Devolvida": "Qtd Devolvida (Kg)", "LDC (35)": "Peso LDC (35) (Kg)", "Saldo": "Saldo (Kg)"}
+
+# Colunas na ordem do relatório, com as que não estão em ORDEM_COLUNAS no final
+def colunas_relatorio(df):
+    extras = [c for c in df.columns if c not in ORDEM_COLUNAS and c not in COLS_OCULTAS]
+    return [c for c in ORDEM_COLUNAS if c in df.columns] + extras
+
+def calcular_totais(df):
+    return {rotulo: df[col].sum() if col in df.columns else 0 for rotulo, col in TOTAIS_RELATORIO.items()}
+
+def coluna_numerica(col):
+    return "(Kg)" in col or "%" in col
+
+# Volta o schema compacto ao formato de exibição (data dd/mm/YYYY, categorias como texto),
+# usado só na hora de mostrar ou exportar
+def formatar_exibicao(df):
+    if COL_DATA in df.columns and pd.api.types.is_datetime64_any_dtype(df[COL_DATA]):
+        df = df.assign(**{COL_DATA: df[COL_DATA].dt.strftime('%d/%m/%Y')})
+    cats = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if cats: df = df.astype({c: df[c].cat.categories.dtype for c in cats})
+    return df
+
+# Medidas somadas na agregação (as mesmas dos totais do relatório; Saldo é derivado)
+MEDIDAS_AGREGACAO = ["Peso_Bruto_Descarga", "Tara_Descarga", "Peso_Liquido_Descarga", "Peso_Total", "Qtd_Aplicada", "Qtd_Devolvida", "Peso_Liquido_Carga"]
+COL_QTD_ROMANEIOS = "Romaneios"
+
+def _apply_agregacao(grupos):
+    somas = ",".join(f"{m} with sum as {m}" for m in MEDIDAS_AGREGACAO)
+    return f"groupby(({','.join(grupos)}),aggregate({somas},$count as {COL_QTD_ROMANEIOS}))"
+
+# Soma parcial de uma página de linhas cruas (ou de somas já parciais) por grupos + Instr_EDC
+def _reduzir(df, grupos):
+    df = df.assign(**{m: pd.to_numeric(df[m], errors='coerce').fillna(0) for m in MEDIDAS_AGREGACAO})
+    if COL_QTD_ROMANEIOS not in df.columns: df[COL_QTD_ROMANEIOS] = 1
+    chaves = list(grupos) + ['Instr_EDC']
+    return df.groupby(chaves, dropna=False, sort=False, observed=True)[MEDIDAS_AGREGACAO + [COL_QTD_ROMANEIOS]].sum().reset_index()
+
+# Somas por grupos + Instr_EDC -> totais por grupo com os nomes do relatório.
+# A regra do LDC é aplicada sobre a soma do grupo (-|soma|), que coincide com a soma linha a linha
+# enquanto o Peso_Liquido_Carga tiver sempre o mesmo sinal, como acontece no SAP.
+def finalizar_agregacao(df, grupos):
+    if df.empty: return pd.DataFrame(columns=[RENAME_ROMANEIO.get(g, g) for g in grupos] + [RENAME_ROMANEIO[m] for m in MEDIDAS_AGREGACAO] + ["Saldo (Kg)", COL_QTD_ROMANEIOS])
+    df = _reduzir(df, grupos)
+    instr = df['Instr_EDC'].astype(str).str.strip()
+    df['Peso_Liquido_Carga'] = np.where(instr == '35', -df['Peso_Liquido_Carga'].abs(), 0.0)
+    if grupos: df = df.groupby(list(grupos), dropna=False, sort=True, observed=True)[MEDIDAS_AGREGACAO + [COL_QTD_ROMANEIOS]].sum().reset_index()
+    else: df = df[MEDIDAS_AGREGACAO + [COL_QTD_ROMANEIOS]].sum().to_frame().T
+    df = df.rename(columns=RENAME_ROMANEIO)
+    df['Saldo (Kg)'] = df['Qtd Aplicada (Kg)'] - df['Qtd Devolvida (Kg)'] - df['Peso LDC (35) (Kg)'].abs()
+    df[COL_QTD_ROMANEIOS] = df.pop(COL_QTD_ROMANEIOS).astype('int64')
+    return df
+
+class ErroDownloadSAP(Exception):
+    pass
+
+STATUS_REPETIR = {408, 429, 500, 502, 503, 504}
+# Retry-After do SAP acima disso é limitado (a página ainda é tentada SAP_HTTP_TENTATIVAS vezes)
+RETRY_AFTER_MAX_SEG = 60
+
+# Resposta HTTP diferente de 200; só 408/429/5xx valem nova tentativa
+class ErroHTTPSAP(ErroDownloadSAP):
+    def __init__(self, status, pagina, retry_after=None):
+        super().__init__(f"HTTP {status} na página {pagina}")
+        self.status = status
+        try: self.retry_after = min(float(retry_after), RETRY_AFTER_MAX_SEG) if retry_after else None
+        except ValueError: self.retry_after = None
+
+    @property
+    def repetir(self):
+        return self.status in STATUS_REPETIR
+
+# A paginação parou depois de já ter recebido páginas: usar o que veio daria totais errados
+class ResultadoIncompletoSAP(ErroDownloadSAP):
+    def __init__(self, mensagem, paginas=0, linhas=0):
+        super().__init__(mensagem)
+        self.paginas = paginas
+        self.linhas = linhas
 
 class SAPConnector:
-    def __init__(self):
+    def __init__(self, compacto=None):
         self.auth = (os.getenv("SAP_USER"), os.getenv("SAP_PASS"))
         self.url_romaneio = os.getenv("API_ROMANEIO_URL")
         self.url_fatura = os.getenv("API_FATURA_URL") 
-        self.url_fornecedores = "https://faz.sap.fazendaoto.com.br/sap/opu/odata/sap/FAP_DISPLAY_SUPPLIER_LIST"
+        self.url_fornecedores = os.getenv("API_FORNECEDORES_URL", "https://faz.sap.fazendaoto.com.br/sap/opu/odata/sap/FAP_DISPLAY_SUPPLIER_LIST")
+        # Download particionado: 0 dias e SAP_PARTICAO_INSTR=0 mantêm a busca serial de sempre
+        self.particao_dias = int(os.getenv("SAP_PARTICAO_DIAS", "0"))
+        self.particao_instr = os.getenv("SAP_PARTICAO_INSTR", "0") == "1"
+        self.particao_workers = int(os.getenv("SAP_PARTICAO_WORKERS", "4"))
+        # Schema compacto (category, int32, data nativa) é opcional: sem ele buscar_dados_por_periodo devolve
+        # o frame de sempre (texto/float, data dd/mm/YYYY), que o lote e quem mais chamar esperam
+        self.compacto = os.getenv("SAP_SCHEMA_COMPACTO", "0") == "1" if compacto is None else compacto
+        # $apply: "auto" testa o serviço uma vez; "1" assume suporte; "0" sempre reduz localmente
+        modo_apply = os.getenv("SAP_AGREGACAO_APPLY", "auto")
+        self.suporta_apply = None if modo_apply == "auto" else modo_apply == "1"
+        # Preflight $count: acima de SAP_PREFLIGHT_LINHAS romaneios a busca passa a ser particionada
+        # em janelas de SAP_PREFLIGHT_DIAS dias (0 desliga)
+        self.preflight_linhas = int(os.getenv("SAP_PREFLIGHT_LINHAS", "0"))
+        self.preflight_dias = int(os.getenv("SAP_PREFLIGHT_DIAS", "7"))
+        # HTTP: uma sessão por conector, com pool de conexões (TLS reaproveitado entre buscas e threads).
+        # Retry só em _fetch_full_odata, por página: erro de conexão, 408/429/5xx e corte no meio do corpo
+        # são repetidos a partir do mesmo __next. Nem o urllib3 nem as partições repetem por conta própria,
+        # senão as camadas se multiplicam e uma queda do SAP vira dezenas de requisições por partição.
+        self.http_pool = int(os.getenv("SAP_HTTP_POOL", "16"))
+        self.http_tentativas = int(os.getenv("SAP_HTTP_TENTATIVAS", "4"))
+        self.http_backoff = float(os.getenv("SAP_HTTP_BACKOFF", "0.5"))
+        self._http = self._criar_sessao()
+        # $metadata: SAP_METADATA=0 volta para os tipos fixos de COLS_ROMANEIO_NUMERICAS; se o SAP não responde,
+        # nova tentativa a cada SAP_METADATA_RETENTAR_SEG
+        self.metadados = MetadadosSAP(self._http, os.getenv("SAP_CACHE_METADATA", METADATA_FILE), validade_seg=int(os.getenv("SAP_METADATA_VALIDADE_H", "24")) * 3600,
+                                     retentar_seg=int(os.getenv("SAP_METADATA_RETENTAR_SEG", "60"))) if os.getenv("SAP_METADATA", "1") == "1" else None
+        self._esquema_rom = None
+        self.fornecedores = DiretorioFornecedores(self._baixar_fornecedores, os.getenv("SAP_CACHE_FORNECEDORES", CACHE_FILE))
+        # Store local de romaneios: SAP_STORE_ROMANEIOS vazio desliga
+        store_path = os.getenv("SAP_STORE_ROMANEIOS", STORE_ROMANEIOS_FILE)
+        self.store = None
+        if store_path:
+            self.store = StoreRomaneios(store_path, COLS_ROMANEIO, max_bytes=int(os.getenv("SAP_STORE_MAX_MB", "500")) * 1024 * 1024, dias_quentes=int(os.getenv("SAP_STORE_DIAS_QUENTES", "2")))
 
-    def _fetch_full_odata(self, base_url, entity_set, params):
-        all_records = []
-        if base_url.endswith('/'): url = f"{base_url}{entity_set}"
-        else: url = f"{base_url}/{entity_set}"
-        
+    def _criar_sessao(self):
         session = requests.Session()
         session.auth = self.auth
         session.verify = False
-        session.headers.update({"Prefer": "odata.maxpagesize=50000", "Accept": "application/json"})
+        session.headers.update({"Prefer": "odata.maxpagesize=50000", "Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.http_pool, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    # Descarta as conexões abertas do pool (a sessão continua utilizável e abre novas).
+    # Chamado antes do fork dos workers: socket herdado e usado por dois processos corrompe as respostas.
+    def fechar_conexoes(self):
+        self._http.close()
+
+    @staticmethod
+    def _url_entidade(base_url, entity_set):
+        if base_url.endswith('/'): return f"{base_url}{entity_set}"
+        return f"{base_url}/{entity_set}"
+
+    # Com `colunas` ({campo: tipo}) cada página é lida em streaming direto para buffers por coluna;
+    # sem ela mantém o caminho antigo (lista de dicts -> DataFrame no final).
+    # Cada página é tentada até SAP_HTTP_TENTATIVAS vezes (backoff exponencial, ou o Retry-After do SAP)
+    # a partir do mesmo link, descartando o que tinha entrado da tentativa que falhou. Esgotadas as
+    # tentativas, ou com um status que não adianta repetir (4xx):
+    # - depois da primeira página: ResultadoIncompletoSAP, sempre;
+    # - na primeira página: com `falhar=True` ErroDownloadSAP, senão devolve vazio como antes.
+    # Com `ao_pagina` (exige `colunas`) cada página vira um DataFrame entregue à função e descartado;
+    # o retorno fica vazio.
+    def _fetch_full_odata(self, base_url, entity_set, params, colunas=None, falhar=False, ao_pagina=None):
+        all_records = []
+        buffers = BufferColunas(colunas) if colunas else None
+        url = self._url_entidade(base_url, entity_set)
 
         if "$top" not in params: params["$top"] = "999999"
 
         page_counter = 1
+        linhas_ok = 0
         logger.info(f"[SAP] Iniciando Download: {url}")
 
         while url:
-            try:
-                if page_counter == 1:
-                    r = session.get(url, params=params, timeout=120)
-                else:
-                    r = session.get(url, timeout=120)
-                
-                if r.status_code != 200:
-                    logger.error(f"[SAP ERRO] HTTP {r.status_code}")
+            for tentativa in range(1, self.http_tentativas + 1):
+                try:
+                    t_ini = time.perf_counter()
+                    r = self._http.get(url, params=params if page_counter == 1 else None, timeout=120, stream=buffers is not None)
+                    t_resposta = time.perf_counter()
+                    if r.status_code != 200:
+                        r.close()
+                        raise ErroHTTPSAP(r.status_code, page_counter, r.headers.get("Retry-After"))
+                    if buffers is not None:
+                        with r: qtd, proximo = ler_pagina_odata(r.iter_content(chunk_size=CHUNK_BYTES), buffers)
+                    else:
+                        d = r.json().get('d', {})
+                        results = d.get('results', [])
+                        qtd, proximo = len(results), d.get('__next')
+                        all_records.extend(results)
+                    self._medir_pagina(r, entity_set, page_counter, qtd, t_ini, t_resposta)
                     break
+                except Exception as e:
+                    if buffers is not None: buffers.truncar(linhas_ok)
+                    somar("sap_falhas_pagina_total")
+                    if tentativa < self.http_tentativas and getattr(e, "repetir", True):
+                        espera = getattr(e, "retry_after", None) or self.http_backoff * 2 ** (tentativa - 1)
+                        logger.warning(f"[SAP] Página {page_counter} falhou ({tentativa}/{self.http_tentativas}): {e}. Repetindo em {espera:.1f}s")
+                        time.sleep(espera)
+                        continue
+                    logger.error(f"[SAP ERRO] Página {page_counter} falhou após {tentativa} tentativas: {e}")
+                    if page_counter > 1:
+                        linhas = (buffers.linhas if buffers is not None else len(all_records))
+                        raise ResultadoIncompletoSAP(f"download interrompido na página {page_counter} ({linhas} linhas recebidas): {e}", paginas=page_counter - 1, linhas=linhas) from e
+                    if falhar:
+                        if isinstance(e, ErroDownloadSAP): raise
+                        raise ErroDownloadSAP(str(e)) from e
+                    qtd, proximo = 0, None
 
-                data = r.json()
-                d = data.get('d', {})
-                results = d.get('results', [])
-                
-                if not results: break
-                
-                all_records.extend(results)
-                url = d.get('__next') 
-                if url: page_counter += 1
-                else: break
-                    
-            except Exception as e:
-                logger.error(f"[ERRO CRÍTICO CONEXÃO] {e}")
-                break
-        
-        session.close()
+            if ao_pagina is not None and buffers.linhas:
+                ao_pagina(buffers.to_dataframe())
+                buffers = BufferColunas(colunas)
+            linhas_ok = buffers.linhas if buffers is not None else 0
+            if not qtd: break
+            url = proximo
+            if url: page_counter += 1
+
+        if ao_pagina is not None: return pd.DataFrame()
+        if buffers is not None: return buffers.to_dataframe()
         df = pd.DataFrame(all_records)
         if '__metadata' in df.columns: df.drop(columns=['__metadata'], inplace=True)
         return df
 
+    # espera = até o cabeçalho da resposta; leitura = corpo + decode do JSON (no streaming as duas andam juntas)
+    @staticmethod
+    def _medir_pagina(r, entity_set, pagina, linhas, t_ini, t_resposta):
+        fim = time.perf_counter()
+        try: tamanho = r.raw.tell() or len(r.content)
+        except Exception: tamanho = 0
+        registrar_span("sap_pagina_espera", t_resposta - t_ini)
+        registrar_span("sap_pagina_leitura", fim - t_resposta)
+        registrar_span("sap_pagina", fim - t_ini, entidade=entity_set, pagina=pagina, linhas=linhas, bytes=tamanho)
+        somar("sap_paginas_total")
+        somar("sap_linhas_total", linhas)
+        somar("sap_bytes_total", tamanho)
+        logger.info(f"[SAP] {entity_set} página {pagina}: {linhas} linhas, {tamanho / 1024:.0f} KB, espera {(t_resposta - t_ini) * 1000:.0f} ms, leitura {(fim - t_resposta) * 1000:.0f} ms")
+
+    def _baixar_fornecedores(self):
+        f_odata = "(TaxTypeName eq 'Brazil: CNPJ Number' or TaxTypeName eq 'Brazil: CPF Number')"
+        cols_odata = "Supplier,SupplierName,BPTaxNumber,TaxTypeName"
+        params = {"$filter": f_odata, "$select": cols_odata, "$format": "json"}
+        # Lista cortada no meio não pode virar snapshot: vazio mantém a versão anterior
+        try: return self._fetch_full_odata(self.url_fornecedores, "C_Supplier", params, colunas={c: TIPO_TEXTO for c in cols_odata.split(",")})
+        except ErroDownloadSAP as e:
+            logger.error(f"[SAP ERRO] Fornecedores: {e}")
+            return pd.DataFrame()
+
     def buscar_fornecedores(self, tipo_taxa_filtro):
-        agora = datetime.now()
-        usar_cache = False
-        df_completo = pd.DataFrame()
-
-        if os.path.exists(CACHE_FILE):
-            mod_timestamp = os.path.getmtime(CACHE_FILE)
-            mod_time = datetime.fromtimestamp(mod_timestamp)
-            if (agora - mod_time) < timedelta(minutes=59):
-                try:
-                    df_completo = pd.read_pickle(CACHE_FILE)
-                    if df_completo.empty: usar_cache = False
-                    else: usar_cache = True
-                except: usar_cache = False
-
-        if not usar_cache:
-            f_odata = "(TaxTypeName eq 'Brazil: CNPJ Number' or TaxTypeName eq 'Brazil: CPF Number')"
-            cols_odata = "Supplier,SupplierName,BPTaxNumber,TaxTypeName"
-            params = {"$filter": f_odata, "$select": cols_odata, "$format": "json"}
-            df_completo = self._fetch_full_odata(self.url_fornecedores, "C_Supplier", params)
-            
-            if not df_completo.empty:
-                df_completo = df_completo.drop_duplicates(subset=['Supplier', 'BPTaxNumber'])
-                df_completo = df_completo.sort_values(by='SupplierName')
-                try: df_completo.to_pickle(CACHE_FILE)
-                except: pass
-        
-        if df_completo.empty: return pd.DataFrame()
-        filtro_txt = "Brazil: CPF Number" if tipo_taxa_filtro == 'cpf' else "Brazil: CNPJ Number"
-        return df_completo[df_completo['TaxTypeName'] == filtro_txt].copy()
+        return self.fornecedores.particao('cpf' if tipo_taxa_filtro == 'cpf' else 'cnpj')
+
+    def _filtro_romaneio(self, d_ini, d_fim, pid_padded=None, instr=None, restricoes=None):
+        if instr: f_instr = f"(Instr_EDC eq '{instr}')"
+        else: f_instr = "(" + " or ".join(f"Instr_EDC eq '{i}'" for i in INSTR_EDC) + ")"
+        f_rom =  (
+            f"{f_instr} and "
+            "(Tipo_Contrato eq 'AC3P' or Tipo_Contrato eq 'ZFIX' or Tipo_Contrato eq '') and "
+            f"(data_edc ge '{d_ini}' and data_edc le '{d_fim}') and (stat eq 'I7U07') and (ID_Safra ne '200') and (InscricaoEstadual ne '')"
+        )
+        if pid_padded: f_rom += f" and (Parceiro eq '{pid_padded}')"
+        for campo, valor in (restricoes or {}).items(): f_rom += f" and ({campo} eq {_literal_odata(valor)})"
+        return f_rom
+
+    # ({campo: tipo} do $select, campos que o serviço não tem). Campo fora do $metadata sai do $select,
+    # senão o SAP recusa a consulta inteira; ele volta vazio depois do download.
+    # Sem $metadata vale o TIPOS_ROMANEIO, sem guardar: a próxima busca tenta de novo. O esquema
+    # calculado fica até o MetadadosSAP recarregar (outro dict de propriedades).
+    def esquema_romaneio(self):
+        props = self.metadados.entidade(self.url_romaneio, ENTIDADE_ROMANEIO) if self.metadados and self.url_romaneio else None
+        if not props: return dict(TIPOS_ROMANEIO), []
+        guardado = self._esquema_rom
+        if guardado is not None and guardado[0] is props: return guardado[1]
+        faltantes = [c for c in COLS_ROMANEIO if c not in props]
+        if faltantes: logger.error(f"[METADATA] {ENTIDADE_ROMANEIO} não tem os campos {faltantes}: fora do $select")
+        tipos = {}
+        for c in COLS_ROMANEIO:
+            if c not in props: continue
+            tipos[c] = tipo_coluna(props[c])
+            if c in COLS_ROMANEIO_NUMERICAS and tipos[c] != TIPO_NUMERO:
+                logger.warning(f"[METADATA] {c} é {props[c]} no serviço, lido como número")
+                tipos[c] = TIPO_NUMERO
+        self._esquema_rom = (props, (tipos, faltantes))
+        return tipos, faltantes
+
+    def _baixar_romaneios(self, f_rom, falhar=False):
+        tipos_rom, faltantes = self.esquema_romaneio()
+        params_rom = {"$filter": f_rom, "$select": ",".join(tipos_rom), "$format": "json"}
+        df = self._fetch_full_odata(self.url_romaneio, ENTIDADE_ROMANEIO, params_rom, colunas=tipos_rom, falhar=falhar)
+        if faltantes and not df.empty:
+            df = df.assign(**{c: np.nan if c in COLS_ROMANEIO_NUMERICAS else "" for c in faltantes})[COLS_ROMANEIO]
+        return df
+
+    # Janelas [ini, fim] (YYYYMMDD) de `dias` dias cobrindo o período, em ordem crescente
+    @staticmethod
+    def _janelas_periodo(d_ini, d_fim, dias):
+        ini = datetime.strptime(d_ini, '%Y%m%d')
+        fim = datetime.strptime(d_fim, '%Y%m%d')
+        if not dias or dias <= 0: return [(d_ini, d_fim)]
+        janelas = []
+        while ini <= fim:
+            fim_janela = min(ini + timedelta(days=dias - 1), fim)
+            janelas.append((ini.strftime('%Y%m%d'), fim_janela.strftime('%Y%m%d')))
+            ini = fim_janela + timedelta(days=1)
+        return janelas
+
+    # Baixa as partições em paralelo e junta na ordem das partições (data, depois Instr_EDC),
+    # não na ordem de término. Se alguma partição falhar (já depois das tentativas por página) o resultado
+    # inteiro é descartado.
+    def _baixar_romaneios_particionado(self, d_ini, d_fim, pid_padded, dias, por_instr, workers, restricoes=None):
+        particoes = []
+        for j_ini, j_fim in self._janelas_periodo(d_ini, d_fim, dias):
+            for instr in (INSTR_EDC if por_instr else [None]):
+                particoes.append(self._filtro_romaneio(j_ini, j_fim, pid_padded, instr, restricoes))
+
+        logger.info(f"[SAP] Download particionado: {len(particoes)} partições, {workers} em paralelo")
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            # Cada partição roda com uma cópia do contexto, para os spans caírem na requisição que pediu
+            futuros = [pool.submit(contextvars.copy_context().run, self._baixar_romaneios, f, True) for f in particoes]
+            try:
+                partes = [f.result() for f in futuros]
+            except ErroDownloadSAP:
+                for f in futuros: f.cancel()
+                raise
+
+        partes = [p for p in partes if not p.empty]
+        if not partes: return pd.DataFrame()
+        return pd.concat(partes, ignore_index=True)
+
+    # Dias fechados já gravados vêm do store; os faltantes e a janela quente vão ao SAP
+    # em intervalos contíguos. Devolve as linhas cruas (antes das transformações).
+    # Com `restricoes` o store é filtrado localmente e o que vem do SAP (já filtrado) não é gravado,
+    # porque um balde precisa ter o dia inteiro.
+    def _baixar_com_store(self, d_ini, d_fim, pid_padded, baixar, restricoes=None):
+        parceiro = pid_padded or TODOS_PARCEIROS
+        dias = dias_do_periodo(d_ini, d_fim)
+        fechados = self.store.dias_fechados(dias)
+        locais = self.store.dias_gravados(parceiro, fechados)
+        faltantes = [d for d in dias if d not in locais]
+        logger.info(f"[STORE] {len(locais)} dias locais, {len(faltantes)} dias no SAP")
+
+        partes = []
+        if locais:
+            with span("store_leitura", dias=len(locais)): partes.append(filtrar_restricoes(self.store.ler(parceiro, sorted(locais)), restricoes))
+        for ini, fim in intervalos_continuos(faltantes):
+            df = baixar(ini, fim)
+            if not restricoes: self.store.gravar(parceiro, [d for d in fechados if ini <= d <= fim], df)
+            partes.append(df)
+
+        partes = [p for p in partes if not p.empty]
+        if not partes: return pd.DataFrame()
+        df = pd.concat(partes, ignore_index=True)
+        return df.sort_values('data_edc', kind='stable', ignore_index=True)
+
+    def invalidar_store(self, parceiro_id=None, data_inicio_str=None, data_fim_str=None):
+        if self.store is None: return 0
+        parceiro = str(parceiro_id).strip().zfill(10) if parceiro_id else None
+        d_ini = datetime.strptime(data_inicio_str, '%Y-%m-%d').strftime('%Y%m%d') if data_inicio_str else None
+        d_fim = datetime.strptime(data_fim_str, '%Y-%m-%d').strftime('%Y%m%d') if data_fim_str else None
+        return self.store.invalidar(parceiro, d_ini, d_fim)
+
+    # Preflight: quantos romaneios o $filter devolve, sem baixar nada. None se o serviço não respondeu.
+    def contar_romaneios(self, f_rom):
+        url = self._url_entidade(self.url_romaneio, ENTIDADE_ROMANEIO) + "/$count"
+        try:
+            r = self._http.get(url, params={"$filter": f_rom}, headers={"Accept": "text/plain"}, timeout=60)
+            if r.status_code != 200: return None
+            return int(r.text.strip())
+        except Exception as e:
+            logger.warning(f"[SAP] $count falhou: {e}")
+            return None
+
+    # Testa uma vez se o serviço entende $apply (OData v4 / extensão de agregação)
+    def _verificar_apply(self, f_rom):
+        if self.suporta_apply is not None: return self.suporta_apply
+        url = self._url_entidade(self.url_romaneio, ENTIDADE_ROMANEIO)
+        try:
+            r = self._http.get(url, params={"$filter": f_rom, "$apply": f"aggregate($count as {COL_QTD_ROMANEIOS})", "$top": "1", "$format": "json"}, timeout=60)
+            dados = r.json() if r.status_code == 200 else {}
+            d = dados.get('d', {})
+            resultados = dados.get('value') or (d.get('results', []) if isinstance(d, dict) else d)
+            self.suporta_apply = bool(resultados) and COL_QTD_ROMANEIOS in resultados[0]
+        except Exception:
+            self.suporta_apply = False
+        logger.info(f"[SAP] $apply {'suportado' if self.suporta_apply else 'não suportado'}, agregação {'no servidor' if self.suporta_apply else 'local em streaming'}")
+        return self.suporta_apply
+
+    # Totais por grupo (ex.: agrupar_por=("NomeMaterial",)) sem baixar os romaneios inteiros.
+    # Com $apply o SAP devolve só as somas; sem ele as páginas trazem apenas grupos + medidas e são
+    # somadas uma a uma, sem montar o DataFrame completo. Devolve os totais com os nomes do relatório
+    # ("Peso Bruto (Kg)", ..., "Saldo (Kg)") e a quantidade de romaneios por grupo.
+    def agregar_romaneios(self, data_inicio_str, data_fim_str, agrupar_por=("NomeMaterial",), parceiro_id=None, material=None, safra=None, contrato=None):
+        try:
+            d_ini = datetime.strptime(data_inicio_str, '%Y-%m-%d').strftime('%Y%m%d')
+            d_fim = datetime.strptime(data_fim_str, '%Y-%m-%d').strftime('%Y%m%d')
+        except: return pd.DataFrame()
+        grupos = [g for g in agrupar_por if g != 'Instr_EDC']
+        pid_padded = str(parceiro_id).strip().zfill(10) if parceiro_id else None
+        f_rom = self._filtro_romaneio(d_ini, d_fim, pid_padded, restricoes=restricoes_romaneio(material, safra, contrato))
+        colunas = {**{c: TIPO_TEXTO for c in grupos + ['Instr_EDC']}, **{m: TIPO_NUMERO for m in MEDIDAS_AGREGACAO}}
 
-    def buscar_dados_por_periodo(self, data_inicio_str, data_fim_str, parceiro_id=None):
+        try:
+            if self._verificar_apply(f_rom):
+                params = {"$filter": f_rom, "$apply": _apply_agregacao(grupos + ['Instr_EDC']), "$format": "json"}
+                df = self._fetch_full_odata(self.url_romaneio, ENTIDADE_ROMANEIO, params, colunas={**colunas, COL_QTD_ROMANEIOS: TIPO_NUMERO}, falhar=True)
+                return finalizar_agregacao(df, grupos)
+
+            estimativa = self.contar_romaneios(f_rom)
+            logger.info(f"[SAP] Agregação local: {estimativa if estimativa is not None else '?'} romaneios em {len(grupos)} grupo(s)")
+            parciais = []
+            def ao_pagina(pagina):
+                parciais.append(_reduzir(pagina, grupos))
+                # Junta as somas parciais de tempos em tempos para a lista não crescer com o número de páginas
+                if len(parciais) >= 32: parciais[:] = [_reduzir(pd.concat(parciais, ignore_index=True), grupos)]
+            params = {"$filter": f_rom, "$select": ",".join(colunas), "$format": "json"}
+            self._fetch_full_odata(self.url_romaneio, ENTIDADE_ROMANEIO, params, colunas=colunas, falhar=True, ao_pagina=ao_pagina)
+            return finalizar_agregacao(pd.concat(parciais, ignore_index=True) if parciais else pd.DataFrame(), grupos)
+        except ErroDownloadSAP as e:
+            logger.error(f"[SAP ERRO] Agregação abortada: {e}")
+            return pd.DataFrame()
+
+    # material/safra/contrato (NomeMaterial, NomeSafra, contrato) vão no $filter em vez de serem aplicados depois.
+    # Download que parou no meio levanta ResultadoIncompletoSAP; falha antes de qualquer página devolve vazio.
+    def buscar_dados_por_periodo(self, data_inicio_str, data_fim_str, parceiro_id=None, particao_dias=None, particao_instr=None, workers=None, usar_store=True, compacto=None, material=None, safra=None, contrato=None):
         try:
             d_ini = datetime.strptime(data_inicio_str, '%Y-%m-%d').strftime('%Y%m%d')
             d_fim = datetime.strptime(data_fim_str, '%Y-%m-%d').strftime('%Y%m%d')
@@ -109,66 +564,39 @@ class SAPConnector:
         pid_padded = None
         if parceiro_id: pid_padded = str(parceiro_id).strip().zfill(10)
 
-        f_rom =  (
-            "(Instr_EDC eq '07' or Instr_EDC eq '03' or Instr_EDC eq '35') and "
-            "(Tipo_Contrato eq 'AC3P' or Tipo_Contrato eq 'ZFIX' or Tipo_Contrato eq '') and "
-            f"(data_edc ge '{d_ini}' and data_edc le '{d_fim}') and (stat eq 'I7U07') and (ID_Safra ne '200') and (InscricaoEstadual ne '')"
-        )
-        if pid_padded: f_rom += f" and (Parceiro eq '{pid_padded}')"
-        
-        cols_rom = [
-            "Parceiro", "Parceiro_T", "Instr_EDC", "contrato", "Num_Pesagem", "data_edc", 
-            "Material", "NomeMaterial", "NomeSafra", "NomeLocal_Evento", "Placa", 
-            "TextoTransgenia_Descarga", "Peso_Bruto_Descarga", "Tara_Descarga", 
-            "Peso_Liquido_Descarga", "Peso_Liquido_Carga", "Qtd_Aplicada", "Qtd_Devolvida", "Peso_Total", "Umidade_Descarga", 
-            "Peso_umidade", "Impurezas_Descarga", "Peso_Impurezas", "Ardidos_Descarga", 
-            "Peso_Ardidos", "Avariados_Descarga", "Peso_Avariados", "Esverdeados_Descarga", 
-            "Peso_Esverdeados", "Quebrados_Descarga", "Peso_Quebrados", "Queimados_Descarga", 
-            "Peso_Queimados", "Doc_Aplicacao", "Tipo_Contrato", 
-            "ChaveNFeContraNota", "ChaveNFeReferenciada"
-        ]
-        
-        params_rom = {"$filter": f_rom, "$select": ",".join(cols_rom), "$format": "json"}
-        df_final = self._fetch_full_odata(self.url_romaneio, "ZC_ACM_LISTA_ROMANEIO_Q001", params_rom)
-        
-        if df_final.empty: return pd.DataFrame()
+        particao_dias = self.particao_dias if particao_dias is None else particao_dias
+        particao_instr = self.particao_instr if particao_instr is None else particao_instr
+        workers = self.particao_workers if workers is None else workers
+        usar_store = usar_store and self.store is not None
+        restricoes = restricoes_romaneio(material, safra, contrato)
+        if restricoes: logger.info(f"[SAP] Filtros no $filter: {restricoes}")
 
-        def extrair_nota(chave):
-            if pd.isna(chave): return ''
-            chave = str(chave).strip()
-            if len(chave) == 44:
-                nota = chave[25:34].lstrip('0')
-                return nota if nota else '0'
-            return ''
-            
-        df_final['Nota Produtor'] = df_final['ChaveNFeReferenciada'].apply(extrair_nota)
-        df_final['Nota Fazendao'] = df_final['ChaveNFeContraNota'].apply(extrair_nota)
-
-        df_final['Qtd_Aplicada'] = pd.to_numeric(df_final.get('Qtd_Aplicada', 0), errors='coerce').fillna(0)
-        df_final['Qtd_Devolvida'] = pd.to_numeric(df_final.get('Qtd_Devolvida', 0), errors='coerce').fillna(0)
-        df_final['Peso_Liquido_Carga'] = pd.to_numeric(df_final.get('Peso_Liquido_Carga', 0), errors='coerce').fillna(0)
-
-        def rule_peso_carga(row):
-            if str(row.get('Instr_EDC')).strip() == '35':
-                return -abs(float(row.get('Peso_Liquido_Carga', 0))) 
-            return 0.0
-
-        df_final['Peso_Liquido_Carga'] = df_final.apply(rule_peso_carga, axis=1)
-
-        if 'data_edc' in df_final.columns:
-            df_final['data_edc'] = pd.to_datetime(df_final['data_edc'], format='%Y%m%d', errors='coerce').dt.strftime('%d/%m/%Y')
-        
-        # MUDANÇA: Renomeado para Peso LDC (35)
-        rename_map = {"Doc_Aplicacao": "ID.apl", "Parceiro": "Cod. Parceiro", "Parceiro_T": "Razão Social", "Instr_EDC": "Instr. EDC", "Num_Pesagem": "Romaneio", "NomeLocal_Evento": "Unidade", "NomeMaterial": "NomeMaterial", "TextoTransgenia_Descarga": "Transgenia", "Peso_Bruto_Descarga": "Peso Bruto (Kg)", "Tara_Descarga": "Peso Tara (Kg)", "Peso_Liquido_Descarga": "Peso liquido (Kg)", "Qtd_Aplicada": "Qtd Aplicada (Kg)", "Qtd_Devolvida": "Qtd Devolvida (Kg)", "Peso_Liquido_Carga": "Peso LDC (35) (Kg)", "Peso_Total": "Descontos (Kg)", "Umidade_Descarga": "% Umidade", "Peso_umidade": "Desconto Umidade (Kg)", "Impurezas_Descarga": "% Impurezas", "Peso_Impurezas": "Desconto Impureza (Kg)", "Ardidos_Descarga": "% Ardido", "Peso_Ardidos": "Desconto Ardidos (Kg)", "Avariados_Descarga": "% Avariados", "Peso_Avariados": "Desconto Avariados (Kg)", "Esverdeados_Descarga": "% Esverdeados", "Peso_Esverdeados": "Desconto Esverdeados (Kg)", "Quebrados_Descarga": "% Quebrados", "Peso_Quebrados": "Desconto Quebrados (Kg)", "Queimados_Descarga": "% Queimados", "Peso_Queimados": "Desconto Queimados (Kg)", "data_edc": "Data do edc"}
-        df_final.rename(columns=rename_map, inplace=True)
-        
-        for c in ["Tipo_Contrato", "ChaveNFeContraNota", "ChaveNFeReferenciada"]:
-            if c in df_final.columns: df_final.drop(columns=[c], inplace=True)
-            
-        cols_num = [c for c in df_final.columns if "(Kg)" in c or "%" in c or c == "Romaneio"]
-        for col in cols_num: df_final[col] = pd.to_numeric(df_final[col], errors='coerce').fillna(0)
+        def baixar(ini, fim):
+            dias = particao_dias
+            if not (particao_dias or particao_instr) and self.preflight_linhas > 0:
+                estimativa = self.contar_romaneios(self._filtro_romaneio(ini, fim, pid_padded, restricoes=restricoes))
+                if estimativa is not None and estimativa > self.preflight_linhas:
+                    logger.info(f"[SAP] $count = {estimativa} romaneios: download particionado em janelas de {self.preflight_dias} dias")
+                    dias = self.preflight_dias
+            if dias or particao_instr:
+                return self._baixar_romaneios_particionado(ini, fim, pid_padded, dias, particao_instr, workers, restricoes)
+            # Com store, um download truncado não pode ser gravado como dia fechado
+            return self._baixar_romaneios(self._filtro_romaneio(ini, fim, pid_padded, restricoes=restricoes), falhar=usar_store)
+
+        try:
+            with span("sap_download", parceiro=pid_padded or "", dias=len(dias_do_periodo(d_ini, d_fim))) as attrs:
+                if usar_store: df_final = self._baixar_com_store(d_ini, d_fim, pid_padded, baixar, restricoes)
+                else: df_final = baixar(d_ini, d_fim)
+                attrs["linhas"] = len(df_final)
+        except ResultadoIncompletoSAP as e:
+            # Truncado não é "sem dados": quem chamou precisa avisar o usuário
+            logger.error(f"[SAP ERRO] Download incompleto: {e}")
+            raise
+        except ErroDownloadSAP as e:
+            logger.error(f"[SAP ERRO] Download abortado: {e}")
+            return pd.DataFrame()
         
-        # MUDANÇA: Cálculo referenciando o novo nome "Peso LDC (35) (Kg)"
-        df_final['Saldo (Kg)'] = df_final['Qtd Aplicada (Kg)'] - df_final['Qtd Devolvida (Kg)'] - df_final['Peso LDC (35) (Kg)'].abs()
+        if df_final.empty: return pd.DataFrame()
 
-        return df_final
\ No newline at end of file
+        with span("transformacao", linhas=len(df_final)):
+            return transformar_romaneios(df_final, compacto=self.compacto if compacto is None else compacto, tipos=self.esquema_romaneio()[0])
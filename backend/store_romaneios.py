@@ -0,0 +1,135 @@
+# VERSÃO: 1.2 - Hoje é sempre quente: dias_quentes menor que 1 vale 1 (dia parcial nunca é gravado como fechado)
+import sqlite3
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Parceiro "vazio" = busca sem filtro de parceiro
+TODOS_PARCEIROS = ""
+
+class StoreRomaneios:
+    # Guarda as linhas cruas do SAP (colunas do $select) em baldes (parceiro, dia).
+    # Um balde só é gravado quando o dia está fechado, isto é, fora da janela "quente".
+    def __init__(self, caminho, colunas, max_bytes=500 * 1024 * 1024, dias_quentes=2):
+        self.caminho = caminho
+        self.colunas = list(colunas)
+        self.max_bytes = max_bytes
+        self.dias_quentes = dias_quentes
+        self._lock = threading.Lock()
+        self._criar_tabelas()
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=30)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con: yield con
+        finally:
+            con.close()
+
+    def _criar_tabelas(self):
+        cols_sql = ", ".join(f'"{c}"' for c in self.colunas)
+        with self._lock, self._conectar() as con:
+            existentes = [r[1] for r in con.execute("PRAGMA table_info(romaneios)")]
+            # Mudou o $select: o que está gravado não serve mais
+            if existentes and existentes[2:] != self.colunas:
+                logger.info("[STORE] Colunas mudaram, limpando store de romaneios")
+                con.execute("DROP TABLE IF EXISTS romaneios")
+                con.execute("DROP TABLE IF EXISTS baldes")
+            con.execute(f"CREATE TABLE IF NOT EXISTS romaneios (chave_parceiro TEXT, chave_dia TEXT, {cols_sql})")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_rom_balde ON romaneios (chave_parceiro, chave_dia)")
+            con.execute("CREATE TABLE IF NOT EXISTS baldes (parceiro TEXT, dia TEXT, linhas INTEGER, bytes INTEGER, gravado_em REAL, acessado_em REAL, PRIMARY KEY (parceiro, dia))")
+
+    # Hoje está sempre na janela quente, mesmo com dias_quentes=0: senão um dia parcial ficaria gravado como fechado
+    def primeiro_dia_quente(self):
+        return (datetime.now() - timedelta(days=max(self.dias_quentes, 1) - 1)).strftime('%Y%m%d')
+
+    def dias_fechados(self, dias):
+        limite = self.primeiro_dia_quente()
+        return [d for d in dias if d < limite]
+
+    def dias_gravados(self, parceiro, dias):
+        if not dias: return set()
+        with self._conectar() as con:
+            rows = con.execute("SELECT dia FROM baldes WHERE parceiro = ? AND dia BETWEEN ? AND ?", (parceiro, min(dias), max(dias))).fetchall()
+        return {r[0] for r in rows} & set(dias)
+
+    def ler(self, parceiro, dias):
+        if not dias: return pd.DataFrame(columns=self.colunas)
+        cols_sql = ", ".join(f'"{c}"' for c in self.colunas)
+        with self._conectar() as con:
+            df = pd.read_sql_query(f"SELECT {cols_sql} FROM romaneios WHERE chave_parceiro = ? AND chave_dia BETWEEN ? AND ? ORDER BY chave_dia, rowid", con, params=(parceiro, min(dias), max(dias)))
+            con.execute("UPDATE baldes SET acessado_em = ? WHERE parceiro = ? AND dia BETWEEN ? AND ?", (time.time(), parceiro, min(dias), max(dias)))
+        dias = set(dias)
+        return df[df['data_edc'].isin(dias)] if len(dias) and not df.empty else df
+
+    # Grava os `dias` (todos fechados) com as linhas de `df`; dias sem linhas também viram balde,
+    # para não serem buscados de novo no SAP. O frame é convertido uma vez só, cada intervalo contíguo
+    # de dias é apagado com um DELETE por faixa e tudo entra numa transação.
+    def gravar(self, parceiro, dias, df):
+        dias = self.dias_fechados(dias)
+        if not dias: return
+        agora = time.time()
+        df = df.reindex(columns=self.colunas) if not df.empty else pd.DataFrame(columns=self.colunas)
+        df = df[df['data_edc'].isin(set(dias))]
+        valores = df.astype(object).where(df.notna(), None)
+        # Tamanho de cada balde estimado pela fração das linhas (só serve para o despejo)
+        linhas_dia = df['data_edc'].value_counts().to_dict()
+        por_linha = int(df.memory_usage(deep=True, index=False).sum()) / len(df) if len(df) else 0
+        i_dia = self.colunas.index('data_edc')
+        cols_sql = ", ".join(f'"{c}"' for c in self.colunas)
+        marcadores = ", ".join("?" for _ in range(len(self.colunas) + 2))
+        with self._lock, self._conectar() as con:
+            for ini, fim in intervalos_continuos(dias):
+                con.execute("DELETE FROM romaneios WHERE chave_parceiro = ? AND chave_dia BETWEEN ? AND ?", (parceiro, ini, fim))
+            con.executemany(f"INSERT INTO romaneios (chave_parceiro, chave_dia, {cols_sql}) VALUES ({marcadores})", ((parceiro, r[i_dia], *r) for r in valores.itertuples(index=False, name=None)))
+            con.executemany("INSERT OR REPLACE INTO baldes VALUES (?, ?, ?, ?, ?, ?)", ((parceiro, dia, linhas_dia.get(dia, 0), int(linhas_dia.get(dia, 0) * por_linha), agora, agora) for dia in dias))
+            self._despejar(con)
+
+    # Remove os baldes menos acessados até o total estimado caber em max_bytes
+    def _despejar(self, con):
+        total = con.execute("SELECT COALESCE(SUM(bytes), 0) FROM baldes").fetchone()[0]
+        if total <= self.max_bytes: return
+        removidos = 0
+        for parceiro, dia, tamanho in con.execute("SELECT parceiro, dia, bytes FROM baldes ORDER BY acessado_em").fetchall():
+            if total <= self.max_bytes: break
+            con.execute("DELETE FROM romaneios WHERE chave_parceiro = ? AND chave_dia = ?", (parceiro, dia))
+            con.execute("DELETE FROM baldes WHERE parceiro = ? AND dia = ?", (parceiro, dia))
+            total -= tamanho
+            removidos += 1
+        logger.info(f"[STORE] {removidos} baldes despejados (limite {self.max_bytes // (1024 * 1024)} MB)")
+
+    # Invalida baldes: sem argumentos limpa tudo; d_ini/d_fim no formato YYYYMMDD
+    def invalidar(self, parceiro=None, d_ini=None, d_fim=None):
+        where, params = [], []
+        if parceiro is not None: where.append("{p} = ?"); params.append(parceiro)
+        if d_ini: where.append("{d} >= ?"); params.append(d_ini)
+        if d_fim: where.append("{d} <= ?"); params.append(d_fim)
+        cond = f" WHERE {' AND '.join(where)}" if where else ""
+        with self._lock, self._conectar() as con:
+            con.execute("DELETE FROM romaneios" + cond.format(p="chave_parceiro", d="chave_dia"), params)
+            n = con.execute("DELETE FROM baldes" + cond.format(p="parceiro", d="dia"), params).rowcount
+        logger.info(f"[STORE] {n} baldes invalidados")
+        return n
+
+def dias_do_periodo(d_ini, d_fim):
+    ini = datetime.strptime(d_ini, '%Y%m%d')
+    fim = datetime.strptime(d_fim, '%Y%m%d')
+    return [(ini + timedelta(days=i)).strftime('%Y%m%d') for i in range((fim - ini).days + 1)]
+
+# Agrupa dias (YYYYMMDD, ordenados) em intervalos contíguos [(ini, fim), ...]
+def intervalos_continuos(dias):
+    intervalos = []
+    for dia in sorted(dias):
+        if intervalos:
+            ini, fim = intervalos[-1]
+            if datetime.strptime(dia, '%Y%m%d') - datetime.strptime(fim, '%Y%m%d') == timedelta(days=1):
+                intervalos[-1] = (ini, dia)
+                continue
+        intervalos.append((dia, dia))
+    return intervalos
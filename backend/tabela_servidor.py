@@ -0,0 +1,143 @@
+# VERSÃO: 1.1 - Cláusula de filtro não entendida não passa nenhuma linha (antes era ignorada e a tabela mostrava tudo)
+import re
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from backend.sap_data import calcular_totais, TOTAIS_RELATORIO
+
+logger = logging.getLogger(__name__)
+
+# Forma gerada pela linha de filtro do DataTable: "{Coluna} s> 100 && {Placa} icontains abc".
+# Prefixo "i" = sem diferenciar maiúsculas, "s" (ou nada) = diferenciando.
+_CLAUSULA = re.compile(r'^\{(?P<col>[^}]+)\}\s+(?P<op>[is]?(?:<=|>=|!=|<|>|=|eq|ne|lt|le|gt|ge|contains|datestartswith))\s+(?P<val>.+)$', re.IGNORECASE)
+_VAZIO = re.compile(r'^\{(?P<col>[^}]+)\}\s+is\s+blank$', re.IGNORECASE)
+_SIMBOLOS = {"eq": "=", "ne": "!=", "lt": "<", "le": "<=", "gt": ">", "ge": ">="}
+_OPERADORES = set(_SIMBOLOS) | set(_SIMBOLOS.values()) | {"contains", "datestartswith"}
+
+def _sem_aspas(valor):
+    valor = valor.strip()
+    if len(valor) >= 2 and valor[0] == valor[-1] and valor[0] in "\"'`": return valor[1:-1].replace("\\" + valor[0], valor[0])
+    return valor
+
+def _numero(valor):
+    try: return float(valor.replace(",", ".")) if isinstance(valor, str) else float(valor)
+    except ValueError: return None
+
+# Cláusulas da filter_query, em ordem canônica (a ordem em que o usuário preencheu não muda o resultado)
+def clausulas_filtro(filter_query):
+    if not filter_query: return ()
+    return tuple(sorted(p.strip() for p in filter_query.split(" && ") if p.strip()))
+
+# Texto para os operadores de texto; a data no formato da tela (dd/mm/YYYY)
+def _como_texto(serie):
+    if pd.api.types.is_datetime64_any_dtype(serie): return serie.dt.strftime('%d/%m/%Y').fillna("")
+    return serie.astype(str)
+
+def _comparar_texto(textos, op, valor, caixa):
+    if not caixa:
+        textos = textos.str.lower()
+        valor = valor.lower()
+    if op == "contains": return textos.str.contains(valor, regex=False)
+    if op == "datestartswith": return textos.str.startswith(valor)
+    if op == "=": return textos == valor
+    if op == "!=": return textos != valor
+    return {"<": textos < valor, "<=": textos <= valor, ">": textos > valor, ">=": textos >= valor}[op]
+
+# Máscara booleana de uma cláusula. Categoria é avaliada uma vez por categoria e expandida com isin.
+def _mascara(serie, op, valor, caixa):
+    num = _numero(valor)
+    if op not in ("contains", "datestartswith") and num is not None and pd.api.types.is_numeric_dtype(serie):
+        return {"=": serie == num, "!=": serie != num, "<": serie < num, "<=": serie <= num, ">": serie > num, ">=": serie >= num}[op]
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        cats = pd.Series(serie.cat.categories)
+        return serie.isin(cats[_comparar_texto(_como_texto(cats), op, valor, caixa).to_numpy()])
+    return _comparar_texto(_como_texto(serie), op, valor, caixa)
+
+def clausula_entendida(df, clausula):
+    m = _VAZIO.match(clausula) or _CLAUSULA.match(clausula)
+    return m is not None and m.group("col") in df.columns
+
+# Máscara booleana (numpy) da cláusula sobre `df`. Cláusula não entendida não passa nenhuma linha:
+# ignorá-la mostraria linhas e totais sem o filtro que o usuário acha que está aplicado.
+def mascara_clausula(df, clausula):
+    m = _VAZIO.match(clausula)
+    if m and m.group("col") in df.columns:
+        serie = df[m.group("col")]
+        return (serie.isna() | (_como_texto(serie).str.strip() == "")).to_numpy()
+    m = _CLAUSULA.match(clausula)
+    if not m or m.group("col") not in df.columns:
+        logger.warning(f"[TABELA] Filtro não reconhecido, nenhuma linha passa: {clausula}")
+        return np.zeros(len(df), dtype=bool)
+    op = m.group("op").lower()
+    caixa = not op.startswith("i")
+    if op[0] in "is" and op[1:] in _OPERADORES: op = op[1:]
+    op = _SIMBOLOS.get(op, op)
+    return _mascara(df[m.group("col")], op, _sem_aspas(m.group("val")), caixa).fillna(False).to_numpy(dtype=bool)
+
+# Posições (em `df`) na ordem de `sort_by`
+def ordenar(df, posicoes, sort_by):
+    cols = [s for s in (sort_by or []) if s.get("column_id") in df.columns]
+    if not cols: return posicoes
+    parte = df[[s["column_id"] for s in cols]].take(posicoes).reset_index(drop=True)
+    ordem = parte.sort_values(list(parte.columns), ascending=[s.get("direction") != "desc" for s in cols], kind="stable", na_position="last").index.to_numpy()
+    return posicoes[ordem]
+
+def _totais(df, posicoes):
+    cols = [c for c in TOTAIS_RELATORIO.values() if c in df.columns]
+    return calcular_totais(df[cols].take(posicoes))
+
+class VisoesTabela:
+    # Guarda, por resultado, as posições das linhas de cada visão filtrada (e os totais dela) e de cada
+    # ordenação: trocar de página reaproveita tudo e só formata as linhas da página. Um filtro a mais parte
+    # da visão já calculada com o maior subconjunto das cláusulas, avaliando só as novas sobre as linhas
+    # que já tinham passado. Posições em vez de DataFrames: uma visão de 100 mil linhas ocupa 800 KB.
+    def __init__(self, max_itens=64):
+        self.max_itens = max_itens
+        self._visoes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _guardar(self, chave, valor):
+        with self._lock:
+            self._visoes[chave] = valor
+            self._visoes.move_to_end(chave)
+            while len(self._visoes) > self.max_itens: self._visoes.popitem(last=False)
+
+    def _obter(self, chave):
+        with self._lock:
+            valor = self._visoes.get(chave)
+            if valor is not None: self._visoes.move_to_end(chave)
+            return valor
+
+    # (posições, totais). `base` identifica `df`: o resultado já recortado por material/safra/contrato.
+    def filtrada(self, base, df, clausulas):
+        achada = self._obter(("f", base, clausulas))
+        if achada is not None: return achada
+        posicoes, feitas = np.arange(len(df)), ()
+        with self._lock:
+            for chave, valor in self._visoes.items():
+                if chave[0] == "f" and chave[1] == base and set(chave[2]) < set(clausulas) and len(chave[2]) > len(feitas): posicoes, feitas = valor[0], chave[2]
+        for clausula in clausulas:
+            if clausula in feitas or not len(posicoes): continue
+            posicoes = posicoes[mascara_clausula(df.take(posicoes) if len(posicoes) < len(df) else df, clausula)]
+        valor = (posicoes, _totais(df, posicoes))
+        self._guardar(("f", base, clausulas), valor)
+        return valor
+
+    def ordenada(self, base, df, clausulas, sort_by):
+        chave_ordem = tuple((s.get("column_id"), s.get("direction")) for s in (sort_by or []))
+        posicoes, totais = self.filtrada(base, df, clausulas)
+        if not chave_ordem: return posicoes, totais
+        achada = self._obter(("o", base, clausulas, chave_ordem))
+        if achada is None:
+            achada = ordenar(df, posicoes, sort_by)
+            self._guardar(("o", base, clausulas, chave_ordem), achada)
+        return achada, totais
+
+    # (linhas da página, página corrigida, total de páginas, linhas na visão, totais da visão)
+    def pagina(self, base, df, clausulas, sort_by, pagina, tamanho):
+        posicoes, totais = self.ordenada(base, df, clausulas, sort_by)
+        total_paginas = max(1, -(-len(posicoes) // tamanho))
+        pagina = min(max(pagina or 0, 0), total_paginas - 1)
+        return df.take(posicoes[pagina * tamanho:(pagina + 1) * tamanho]), pagina, total_paginas, len(posicoes), totais
@@ -0,0 +1,156 @@
+# VERSÃO: 1.1 - Cache de $metadata no diretório temporário da medição
+import os
+import sys
+import json
+import time
+import tempfile
+import platform
+import argparse
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+BASELINE_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# métrica -> (descrição, True se maior é melhor)
+METRICAS = {
+    "fetch_linhas_s": ("Download (linhas/s)", True),
+    "transform_s": ("Transformação (s)", False),
+    "pico_rss_mb": ("Pico de memória (MB)", False),
+    "pdf_paginas_s": ("PDF detalhado (páginas/s)", True),
+    "excel_linhas_s": ("Excel (linhas/s)", True),
+}
+
+def _pico_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows: sem getrusage
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux devolve KB; macOS, bytes
+    return round(pico / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+def _servir_mock(linhas, latencia_ms, fila):
+    import mock_sap
+    mock = mock_sap.criar_mock(linhas, max(50, linhas // 200), latencia_ms=latencia_ms)
+    _, base = mock.iniciar()
+    fila.put(base)
+    while True: time.sleep(3600)
+
+# Roda num processo próprio por tamanho, para o pico de memória ser só desse tamanho.
+# O mock fica em outro processo, então os dados sintéticos não entram na conta.
+def medir(linhas, pdf_max, excel_max, latencia_ms):
+    fila = multiprocessing.Queue()
+    servidor = multiprocessing.Process(target=_servir_mock, args=(linhas, latencia_ms, fila), daemon=True)
+    servidor.start()
+    try:
+        import mock_sap
+        tmp = tempfile.mkdtemp(prefix="bench_sap_")
+        os.environ.update(mock_sap.variaveis_ambiente(fila.get(timeout=600)))
+        os.environ.update({"SAP_STORE_ROMANEIOS": "", "SAP_CACHE_FORNECEDORES": os.path.join(tmp, "fornecedores.pkl"), "SAP_CACHE_METADATA": os.path.join(tmp, "metadata.json")})
+        from backend.sap_data import SAPConnector, transformar_romaneios, formatar_exibicao
+        from backend.pdf_generator import gerar_pdf_detalhado
+        from backend.excel_generator import gerar_excel
+
+        sap = SAPConnector()
+        r = {"linhas": linhas}
+        t = time.perf_counter()
+        bruto = sap._baixar_romaneios(sap._filtro_romaneio("20250101", "20261231"), falhar=True)
+        dt = time.perf_counter() - t
+        r["linhas_baixadas"] = len(bruto)
+        r["fetch_linhas_s"] = round(len(bruto) / dt, 1)
+
+        t = time.perf_counter()
+        df = transformar_romaneios(bruto, compacto=True)
+        r["transform_s"] = round(time.perf_counter() - t, 3)
+        del bruto
+
+        parte = formatar_exibicao(df.head(pdf_max))
+        paginas = [0]
+        t = time.perf_counter()
+        gerar_pdf_detalhado(parte, "PRODUTOR BENCHMARK (1)", "TODOS OS MATERIAIS", "TODAS AS SAFRAS", "TODOS OS CONTRATOS", "01/01/2025 a 31/12/2026",
+                            destino=os.path.join(tmp, "detalhado.pdf"), progresso=lambda feitas, total: paginas.__setitem__(0, feitas))
+        r["pdf_paginas"] = paginas[0]
+        r["pdf_paginas_s"] = round(paginas[0] / (time.perf_counter() - t), 1)
+
+        parte = df.head(excel_max)
+        t = time.perf_counter()
+        gerar_excel(parte, destino=os.path.join(tmp, "relatorio.xlsx"))
+        r["excel_linhas_s"] = round(len(parte) / (time.perf_counter() - t), 1)
+
+        r["pico_rss_mb"] = _pico_rss_mb()
+        return r
+    finally:
+        servidor.terminate()
+
+# Piora maior que `tolerancia` (fração) em qualquer métrica conta como regressão
+def comparar(atual, baseline, tolerancia):
+    regressoes = []
+    for tamanho, medidas in atual.items():
+        base = baseline.get(tamanho)
+        if not base: continue
+        for metrica, (descricao, maior_melhor) in METRICAS.items():
+            novo, antigo = medidas.get(metrica), base.get(metrica)
+            if not novo or not antigo: continue
+            variacao = (novo - antigo) / antigo
+            if (maior_melhor and variacao < -tolerancia) or (not maior_melhor and variacao > tolerancia):
+                regressoes.append(f"{tamanho} linhas - {descricao}: {antigo} -> {novo} ({variacao:+.0%})")
+    return regressoes
+
+def _tabela(resultados, baseline):
+    print(f"\n{'Métrica':<28}" + "".join(f"{t + ' linhas':>18}" for t in resultados))
+    for metrica, (descricao, _) in METRICAS.items():
+        linha = f"{descricao:<28}"
+        for tamanho, medidas in resultados.items():
+            valor = medidas.get(metrica)
+            antigo = baseline.get(tamanho, {}).get(metrica)
+            texto = "-" if valor is None else str(valor)
+            if valor and antigo: texto += f" ({(valor - antigo) / antigo:+.0%})"
+            linha += f"{texto:>18}"
+        print(linha)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do R.P.P contra o mock OData local.")
+    parser.add_argument("--tamanhos", default="1000,10000,100000", help="Quantidades de romaneios no mock, separadas por vírgula")
+    parser.add_argument("--pdf-max-linhas", type=int, default=20000, help="Linhas usadas no PDF (a taxa é por página)")
+    parser.add_argument("--excel-max-linhas", type=int, default=50000, help="Linhas usadas no Excel (a taxa é por linha)")
+    parser.add_argument("--latencia-ms", type=float, default=0, help="Latência por página no mock")
+    parser.add_argument("--baseline", default=BASELINE_PADRAO)
+    parser.add_argument("--salvar-baseline", action="store_true", help="Grava o resultado como nova baseline")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Piora aceita antes de acusar regressão (0.25 = 25%%)")
+    parser.add_argument("--medir", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir(args.medir, args.pdf_max_linhas, args.excel_max_linhas, args.latencia_ms)))
+        sys.exit(0)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f: baseline = json.load(f).get("resultados", {})
+
+    resultados = {}
+    for tamanho in [t.strip() for t in args.tamanhos.split(",") if t.strip()]:
+        print(f"--- Medindo {tamanho} romaneios ---", flush=True)
+        cmd = [sys.executable, os.path.abspath(__file__), "--medir", tamanho, "--pdf-max-linhas", str(args.pdf_max_linhas), "--excel-max-linhas", str(args.excel_max_linhas), "--latencia-ms", str(args.latencia_ms)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode != 0:
+            print(f"   [ERRO] {proc.stderr.strip()[-2000:]}")
+            continue
+        resultados[tamanho] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    _tabela(resultados, baseline)
+    regressoes = comparar(resultados, baseline, args.tolerancia)
+
+    if args.salvar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"gerado_em": datetime.now().isoformat(timespec="seconds"), "maquina": platform.node(), "python": platform.python_version(), "resultados": resultados}, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline gravada em {args.baseline}")
+    elif not baseline:
+        print("\nSem baseline para comparar (use --salvar-baseline na máquina de referência).")
+
+    if regressoes:
+        print("\nREGRESSÕES:")
+        for r in regressoes: print(f"   {r}")
+        sys.exit(1)
+    if baseline: print(f"\nSem regressões acima de {args.tolerancia:.0%}.")
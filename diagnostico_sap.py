@@ -1,7 +1,8 @@
 import os
 import requests
-import xml.etree.ElementTree as ET
 from dotenv import load_dotenv
+from backend.metadados_sap import ler_metadata, tipo_coluna
+from backend.sap_data import COLS_ROMANEIO, ENTIDADE_ROMANEIO
 
 load_dotenv()
 
@@ -23,35 +24,26 @@ def diagnosticar():
         r.raise_for_status()
         print("   [OK] Metadados recebidos.")
         
-        # Parse XML para achar nomes reais
-        root = ET.fromstring(r.content)
-        
-        # Namespaces comuns do OData
-        ns = {
-            'edm': 'http://schemas.microsoft.com/ado/2008/09/edm',
-            'atom': 'http://www.w3.org/2005/Atom',
-            'app': 'http://www.w3.org/2007/app'
-        }
-        
-        # Tenta achar EntitySets (Nome da Tabela na URL)
+        # Mesmo parser que o SAPConnector usa para tipar as colunas
+        entidades = ler_metadata(r.content)
+
+        # EntitySets (Nome da Tabela na URL)
         print("\n2. EntitySets Disponíveis (Use um destes na URL):")
-        # Busca genérica por tags que contenham EntitySet
-        found_sets = []
-        for elem in root.iter():
-            if 'EntitySet' in elem.tag:
-                name = elem.get('Name')
-                if name:
-                    print(f"   -> Nome: {name}")
-                    found_sets.append(name)
-        
-        # Tenta achar Propriedades (Nomes das Colunas e Tipos)
+        for name in entidades:
+            print(f"   -> Nome: {name}")
+
+        # Propriedades e tipos EDM: número (Edm.Decimal, Edm.Int*...) chega como float no relatório
         print("\n3. Propriedades e Tipos (Verifique o campo de data):")
-        for elem in root.iter():
-            if 'Property' in elem.tag:
-                name = elem.get('Name')
-                type_ = elem.get('Type')
-                if name and ('data' in name.lower() or 'date' in name.lower() or 'edc' in name.lower()):
-                    print(f"   -> Campo: {name} | Tipo: {type_}")
+        for entidade, props in entidades.items():
+            for name, type_ in props.items():
+                if 'data' in name.lower() or 'date' in name.lower() or 'edc' in name.lower():
+                    print(f"   -> {entidade}.{name} | Tipo: {type_} ({tipo_coluna(type_)})")
+
+        # Campos do $select do relatório que o serviço não tem
+        props = entidades.get(ENTIDADE_ROMANEIO)
+        if props is not None:
+            faltantes = [c for c in COLS_ROMANEIO if c not in props]
+            print(f"\n4. $select do relatório: {'[OK] todos os campos existem' if not faltantes else '[ERRO] faltam ' + ', '.join(faltantes)}")
 
     except Exception as e:
         print(f"   [ERRO] Falha ao ler metadata: {e}")
@@ -0,0 +1,346 @@
+# VERSÃO: 1.3 - Chave NF-e com 44 dígitos (dígito verificador) e __next com a query codificada
+import re
+import gzip
+import hashlib
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, quote
+from flask import Flask, Response, request, abort
+
+SERVICO_ROMANEIO = "ZC_ACM_LISTA_ROMANEIO_Q001_CDS"
+SERVICO_FORNECEDORES = "FAP_DISPLAY_SUPPLIER_LIST"
+ENTIDADE_ROMANEIO = "ZC_ACM_LISTA_ROMANEIO_Q001"
+ENTIDADE_FORNECEDORES = "C_Supplier"
+
+MATERIAIS = [("100001", "SOJA EM GRAOS"), ("100002", "MILHO EM GRAOS"), ("100003", "SORGO EM GRAOS"), ("100004", "FEIJAO CARIOCA")]
+SAFRAS = [("25", "SAFRA 24/25"), ("26", "SAFRA 25/26"), ("27", "SAFRINHA 25/26")]
+LOCAIS = ["ARMAZEM SORRISO", "ARMAZEM LUCAS", "ARMAZEM SINOP", "PORTO MIRITITUBA", "ARMAZEM NOVA MUTUM"]
+TRANSGENIA = ["CONVENCIONAL", "TRANSGENICO", "RR2 PRO", "INTACTA"]
+SOBRENOMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "PEREIRA", "COSTA", "RODRIGUES", "ALMEIDA", "NASCIMENTO", "LIMA", "ARAUJO", "FERREIRA"]
+NOMES = ["JOAO", "MARIA", "JOSE", "ANA", "ANTONIO", "FRANCISCA", "CARLOS", "PAULO", "LUCAS", "MARCOS", "JULIANA", "FERNANDA"]
+
+# ---------------------------------------------------------------------------
+# Dados sintéticos
+# ---------------------------------------------------------------------------
+
+# cUF(2) AAMM(4) CNPJ(14) modelo(2) série(3) nNF(9) tpEmis(1) cNF(8) + DV módulo 11 = 44 dígitos
+def _digito_nfe(chave):
+    soma = sum(int(d) * (2 + i % 8) for i, d in enumerate(reversed(chave)))
+    dv = 11 - soma % 11
+    return "0" if dv >= 10 else str(dv)
+
+def _chave_nfe(rnd, numero):
+    chave = f"51{rnd.randint(2401, 2612):04d}{rnd.randint(10**13, 10**14 - 1)}55001{numero:09d}1{rnd.randint(10**7, 10**8 - 1)}"
+    return chave + _digito_nfe(chave)
+
+def gerar_fornecedores(qtd, seed=7):
+    rnd = random.Random(seed)
+    fornecedores = []
+    for i in range(qtd):
+        pj = i % 4 == 0
+        nome = f"{rnd.choice(NOMES)} {rnd.choice(SOBRENOMES)} {rnd.choice(SOBRENOMES)}" + (" AGROPECUARIA LTDA" if pj else "")
+        fornecedores.append({
+            "Supplier": str(100000 + i),
+            "SupplierName": nome,
+            "BPTaxNumber": f"{rnd.randint(10**13, 10**14 - 1)}" if pj else f"{rnd.randint(10**10, 10**11 - 1)}",
+            "TaxTypeName": "Brazil: CNPJ Number" if pj else "Brazil: CPF Number",
+        })
+    return fornecedores
+
+# Declarados como Edm.Decimal no $metadata (no JSON v2 chegam como texto)
+CAMPOS_DECIMAIS = {
+    "Peso_Bruto_Descarga", "Tara_Descarga", "Peso_Liquido_Descarga", "Peso_Liquido_Carga", "Qtd_Aplicada", "Qtd_Devolvida",
+    "Peso_Total", "Umidade_Descarga", "Peso_umidade", "Impurezas_Descarga", "Peso_Impurezas", "Ardidos_Descarga", "Peso_Ardidos",
+    "Avariados_Descarga", "Peso_Avariados", "Esverdeados_Descarga", "Peso_Esverdeados", "Quebrados_Descarga", "Peso_Quebrados",
+    "Queimados_Descarga", "Peso_Queimados"
+}
+
+# Romaneios com a mesma forma do ZC_ACM_LISTA_ROMANEIO_Q001: números como texto (Edm.Decimal em JSON v2),
+# datas YYYYMMDD, parceiro com 10 dígitos. Poucos parceiros concentram a maior parte dos romaneios.
+def gerar_romaneios(qtd, fornecedores, d_ini="20250101", d_fim="20261231", seed=42):
+    rnd = random.Random(seed)
+    ini = datetime.strptime(d_ini, "%Y%m%d")
+    dias = (datetime.strptime(d_fim, "%Y%m%d") - ini).days + 1
+    pesos = [1 / (i + 1) for i in range(len(fornecedores))]
+    parceiros = rnd.choices(fornecedores, weights=pesos, k=qtd)
+    contratos = {}
+    romaneios = []
+    for i, forn in enumerate(parceiros):
+        instr = rnd.choices(["07", "03", "35", "01"], weights=[70, 15, 10, 5])[0]
+        material, nome_material = rnd.choice(MATERIAIS)
+        id_safra, safra = rnd.choice(SAFRAS)
+        contrato = contratos.setdefault((forn["Supplier"], material), f"{rnd.randint(4000000, 4999999)}")
+        bruto = round(rnd.uniform(15000, 55000), 0)
+        tara = round(rnd.uniform(8000, 18000), 0)
+        liquido = max(bruto - tara, 0)
+        umidade = round(rnd.uniform(11, 18), 1)
+        impureza = round(rnd.uniform(0, 3), 1)
+        p_umid = round(liquido * max(umidade - 14, 0) * 0.015, 0)
+        p_imp = round(liquido * max(impureza - 1, 0) / 100, 0)
+        aplicada = liquido - p_umid - p_imp if instr != "35" else 0
+        romaneios.append({
+            "Parceiro": forn["Supplier"].zfill(10),
+            "Parceiro_T": forn["SupplierName"],
+            "Instr_EDC": instr,
+            "contrato": contrato,
+            "Num_Pesagem": str(700000 + i),
+            "data_edc": (ini + timedelta(days=rnd.randrange(dias))).strftime("%Y%m%d"),
+            "Material": material,
+            "NomeMaterial": nome_material,
+            "NomeSafra": safra,
+            "ID_Safra": id_safra if rnd.random() > 0.01 else "200",
+            "NomeLocal_Evento": rnd.choice(LOCAIS),
+            "Placa": f"{''.join(rnd.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ', k=3))}{rnd.randint(0, 9)}{rnd.choice('ABCDEFGHIJ')}{rnd.randint(10, 99)}",
+            "TextoTransgenia_Descarga": rnd.choice(TRANSGENIA),
+            "Peso_Bruto_Descarga": f"{bruto:.3f}",
+            "Tara_Descarga": f"{tara:.3f}",
+            "Peso_Liquido_Descarga": f"{liquido:.3f}",
+            "Peso_Liquido_Carga": f"{liquido:.3f}" if instr == "35" else "0.000",
+            "Qtd_Aplicada": f"{aplicada:.3f}",
+            "Qtd_Devolvida": f"{round(aplicada * rnd.choice([0, 0, 0, 0.1]), 0):.3f}",
+            "Peso_Total": f"{p_umid + p_imp:.3f}",
+            "Umidade_Descarga": f"{umidade:.2f}",
+            "Peso_umidade": f"{p_umid:.3f}",
+            "Impurezas_Descarga": f"{impureza:.2f}",
+            "Peso_Impurezas": f"{p_imp:.3f}",
+            "Ardidos_Descarga": f"{rnd.uniform(0, 4):.2f}", "Peso_Ardidos": "0.000",
+            "Avariados_Descarga": f"{rnd.uniform(0, 6):.2f}", "Peso_Avariados": "0.000",
+            "Esverdeados_Descarga": f"{rnd.uniform(0, 2):.2f}", "Peso_Esverdeados": "0.000",
+            "Quebrados_Descarga": f"{rnd.uniform(0, 5):.2f}", "Peso_Quebrados": "0.000",
+            "Queimados_Descarga": f"{rnd.uniform(0, 1):.2f}", "Peso_Queimados": "0.000",
+            "Doc_Aplicacao": f"{rnd.randint(5000000000, 5999999999)}",
+            "Tipo_Contrato": rnd.choices(["AC3P", "ZFIX", "", "ZSPT"], weights=[60, 25, 10, 5])[0],
+            "ChaveNFeContraNota": _chave_nfe(rnd, rnd.randint(1, 999999)) if rnd.random() > 0.05 else "",
+            "ChaveNFeReferenciada": _chave_nfe(rnd, rnd.randint(1, 99999)) if rnd.random() > 0.1 else "",
+            "stat": "I7U07" if rnd.random() > 0.03 else "I7U99",
+            "InscricaoEstadual": f"{rnd.randint(10**8, 10**9 - 1)}" if rnd.random() > 0.02 else "",
+        })
+    # transformar_romaneios só extrai a nota de chaves com 44 caracteres
+    assert all(len(r[c]) in (0, 44) for r in romaneios for c in ("ChaveNFeContraNota", "ChaveNFeReferenciada"))
+    romaneios.sort(key=lambda r: (r["data_edc"], r["Num_Pesagem"]))
+    return romaneios
+
+# ---------------------------------------------------------------------------
+# $filter: o subconjunto usado pelo SAPConnector (eq/ne/ge/le/gt/lt, and/or, parênteses, 'texto')
+# ---------------------------------------------------------------------------
+
+_TOKENS = re.compile(r"\s*(?:(\()|(\))|'((?:[^']|'')*)'|([A-Za-z_][\w.]*)|(-?\d+(?:\.\d+)?))")
+_COMPARADORES = {"eq": lambda a, b: a == b, "ne": lambda a, b: a != b, "ge": lambda a, b: a >= b, "le": lambda a, b: a <= b, "gt": lambda a, b: a > b, "lt": lambda a, b: a < b}
+
+def _tokenizar(texto):
+    tokens, pos = [], 0
+    while pos < len(texto):
+        if texto[pos:].strip() == "": break
+        m = _TOKENS.match(texto, pos)
+        if not m: raise ValueError(f"$filter inválido perto de: {texto[pos:pos + 20]}")
+        abre, fecha, literal, nome, numero = m.groups()
+        if abre: tokens.append(("(", None))
+        elif fecha: tokens.append((")", None))
+        elif literal is not None: tokens.append(("valor", literal.replace("''", "'")))
+        elif numero is not None: tokens.append(("valor", numero))
+        else: tokens.append(("nome", nome))
+        pos = m.end()
+    return tokens
+
+def compilar_filtro(texto):
+    if not texto: return lambda reg: True
+    tokens = _tokenizar(texto)
+    pos = [0]
+
+    def olhar():
+        return tokens[pos[0]] if pos[0] < len(tokens) else (None, None)
+
+    def consumir():
+        tok = olhar()
+        pos[0] += 1
+        return tok
+
+    def expr_ou():
+        esq = expr_e()
+        while olhar() == ("nome", "or"):
+            consumir()
+            dir_ = expr_e()
+            esq = (lambda a, b: lambda r: a(r) or b(r))(esq, dir_)
+        return esq
+
+    def expr_e():
+        esq = termo()
+        while olhar() == ("nome", "and"):
+            consumir()
+            dir_ = termo()
+            esq = (lambda a, b: lambda r: a(r) and b(r))(esq, dir_)
+        return esq
+
+    def termo():
+        tipo, valor = consumir()
+        if tipo == "(":
+            interno = expr_ou()
+            if consumir()[0] != ")": raise ValueError("$filter inválido: parêntese sem fechar")
+            return interno
+        if tipo != "nome": raise ValueError(f"$filter inválido: esperado campo, veio {valor!r}")
+        op = consumir()[1]
+        if op not in _COMPARADORES: raise ValueError(f"$filter: operador não suportado {op!r}")
+        tipo_v, literal = consumir()
+        if tipo_v != "valor": raise ValueError("$filter inválido: esperado valor")
+        comparar = _COMPARADORES[op]
+        return lambda r: comparar(r.get(valor, ""), literal)
+
+    filtro = expr_ou()
+    if pos[0] != len(tokens): raise ValueError("$filter inválido: sobrou texto")
+    return filtro
+
+# ---------------------------------------------------------------------------
+# Servidor
+# ---------------------------------------------------------------------------
+
+class MockSAP:
+    # `latencia_ms`/`jitter_ms`: atraso por página; `falha_503`: probabilidade de 503 por requisição;
+    # `corte`: probabilidade de a página ser cortada no meio do corpo (conexão fechada)
+    def __init__(self, romaneios, fornecedores, pagina=5000, latencia_ms=0, jitter_ms=0, falha_503=0.0, corte=0.0, seed=1):
+        self.dados = {ENTIDADE_ROMANEIO: romaneios, ENTIDADE_FORNECEDORES: fornecedores}
+        self.pagina = pagina
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.falha_503 = falha_503
+        self.corte = corte
+        self._rnd = random.Random(seed)
+        self._cache_filtros = {}
+        self._lock = threading.Lock()
+        self.requisicoes = 0
+        self.app = self._criar_app()
+
+    def _filtrar(self, entidade, texto):
+        chave = (entidade, texto)
+        with self._lock:
+            if chave in self._cache_filtros: return self._cache_filtros[chave]
+        filtro = compilar_filtro(texto)
+        linhas = [r for r in self.dados[entidade] if filtro(r)]
+        with self._lock:
+            if len(self._cache_filtros) > 64: self._cache_filtros.clear()
+            self._cache_filtros[chave] = linhas
+        return linhas
+
+    def _sortear(self, prob):
+        with self._lock: return prob > 0 and self._rnd.random() < prob
+
+    def _resposta(self, corpo, tipo="application/json"):
+        cortar = self._sortear(self.corte)
+        gz = "gzip" in request.headers.get("Accept-Encoding", "")
+        if gz: corpo = gzip.compress(corpo, 1)
+        tamanho = len(corpo)
+
+        def enviar():
+            if cortar:
+                yield corpo[:tamanho // 2]
+                raise ConnectionAbortedError("corte simulado")
+            yield corpo
+
+        resp = Response(enviar(), mimetype=tipo, direct_passthrough=True)
+        resp.headers["Content-Length"] = str(tamanho)
+        if gz: resp.headers["Content-Encoding"] = "gzip"
+        return resp
+
+    def _metadata(self, entidade):
+        campos = list(self.dados[entidade][0].keys()) if self.dados[entidade] else []
+        props = "".join(f'<Property Name="{c}" Type="Edm.Decimal" Precision="15" Scale="3"/>' if c in CAMPOS_DECIMAIS else f'<Property Name="{c}" Type="Edm.String" Nullable="false" MaxLength="60"/>' for c in campos)
+        edmx = ('<?xml version="1.0" encoding="utf-8"?>'
+                '<edmx:Edmx Version="1.0" xmlns:edmx="http://schemas.microsoft.com/ado/2007/06/edmx"><edmx:DataServices>'
+                f'<Schema Namespace="MOCK" xmlns="http://schemas.microsoft.com/ado/2008/09/edm"><EntityType Name="{entidade}Type"><Key><PropertyRef Name="{campos[0] if campos else "id"}"/></Key>{props}</EntityType>'
+                f'<EntityContainer Name="MOCK_Entities" m:IsDefaultEntityContainer="true" xmlns:m="http://schemas.microsoft.com/ado/2007/08/dataservices/metadata"><EntitySet Name="{entidade}" EntityType="MOCK.{entidade}Type"/></EntityContainer>'
+                '</Schema></edmx:DataServices></edmx:Edmx>')
+        etag = f'W/"{hashlib.md5(edmx.encode()).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag: return Response(status=304, headers={"ETag": etag})
+        return Response(edmx, mimetype="application/xml", headers={"ETag": etag})
+
+    def _criar_app(self):
+        app = Flask("mock_sap")
+        servicos = {SERVICO_ROMANEIO: ENTIDADE_ROMANEIO, SERVICO_FORNECEDORES: ENTIDADE_FORNECEDORES}
+
+        @app.before_request
+        def atrasar_e_falhar():
+            with self._lock: self.requisicoes += 1
+            if self.latencia_ms or self.jitter_ms:
+                with self._lock: extra = self._rnd.uniform(0, self.jitter_ms)
+                time.sleep((self.latencia_ms + extra) / 1000)
+            if self._sortear(self.falha_503): return Response("Service Unavailable", status=503)
+
+        @app.route("/sap/opu/odata/sap/<servico>/$metadata")
+        def metadata(servico):
+            if servico not in servicos: abort(404)
+            return self._metadata(servicos[servico])
+
+        @app.route("/sap/opu/odata/sap/<servico>/<entidade>/$count")
+        def contar(servico, entidade):
+            if servicos.get(servico) != entidade: abort(404)
+            try: linhas = self._filtrar(entidade, request.args.get("$filter", ""))
+            except ValueError as e: return Response(str(e), status=400)
+            return self._resposta(str(len(linhas)).encode(), "text/plain")
+
+        @app.route("/sap/opu/odata/sap/<servico>/<entidade>")
+        def listar(servico, entidade):
+            if servicos.get(servico) != entidade: abort(404)
+            # Como o SAP Gateway (OData v2): sem $apply
+            if "$apply" in request.args: return Response('{"error":{"message":{"value":"System query option $apply not supported"}}}', status=400, mimetype="application/json")
+            try: linhas = self._filtrar(entidade, request.args.get("$filter", ""))
+            except ValueError as e: return Response(str(e), status=400)
+            inicio = int(request.args.get("$skiptoken", request.args.get("$skip", "0")))
+            top = int(request.args.get("$top", str(len(linhas))))
+            fim_total = min(len(linhas), top if "$skiptoken" not in request.args else int(request.args.get("$fim", top)))
+            fim = min(inicio + self.pagina, fim_total)
+            select = [c for c in request.args.get("$select", "").split(",") if c]
+            base = request.base_url
+            resultados = []
+            for i, r in enumerate(linhas[inicio:fim], start=inicio):
+                reg = {c: r.get(c) for c in select} if select else dict(r)
+                reg["__metadata"] = {"id": f"{base}('{i}')", "uri": f"{base}('{i}')", "type": f"MOCK.{entidade}Type"}
+                resultados.append(reg)
+            d = {"results": resultados}
+            if fim < fim_total:
+                proximos = {k: v for k, v in request.args.items() if k not in ("$skip", "$skiptoken", "$top", "$fim")}
+                proximos.update({"$skiptoken": str(fim), "$fim": str(fim_total)})
+                d["__next"] = base + "?" + urlencode(proximos, quote_via=quote, safe="$,")
+            return self._resposta(json.dumps({"d": d}, ensure_ascii=False).encode("utf-8"))
+
+        return app
+
+    # Sobe em uma thread (porta 0 = livre) e devolve (servidor, url_base)
+    def iniciar(self, host="127.0.0.1", porta=0):
+        from werkzeug.serving import make_server
+        servidor = make_server(host, porta, self.app, threaded=True)
+        threading.Thread(target=servidor.serve_forever, name="mock-sap", daemon=True).start()
+        return servidor, f"http://{host}:{servidor.server_port}/sap/opu/odata/sap"
+
+# Variáveis de ambiente que apontam o SAPConnector para o mock
+def variaveis_ambiente(url_base):
+    return {
+        "API_ROMANEIO_URL": f"{url_base}/{SERVICO_ROMANEIO}",
+        "API_FORNECEDORES_URL": f"{url_base}/{SERVICO_FORNECEDORES}",
+        "SAP_USER": "mock", "SAP_PASS": "mock",
+    }
+
+def criar_mock(linhas=10000, fornecedores=300, seed=42, **opcoes):
+    forn = gerar_fornecedores(fornecedores, seed=seed)
+    return MockSAP(gerar_romaneios(linhas, forn, seed=seed), forn, **opcoes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor OData local com dados sintéticos do SAP (romaneios e fornecedores).")
+    parser.add_argument("--linhas", type=int, default=10000, help="Romaneios gerados")
+    parser.add_argument("--fornecedores", type=int, default=300)
+    parser.add_argument("--pagina", type=int, default=5000, help="Registros por página (__next)")
+    parser.add_argument("--latencia-ms", type=float, default=0, help="Atraso fixo por requisição")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Atraso extra aleatório por requisição")
+    parser.add_argument("--falha-503", type=float, default=0, help="Probabilidade de responder 503")
+    parser.add_argument("--corte", type=float, default=0, help="Probabilidade de cortar a página no meio")
+    parser.add_argument("--porta", type=int, default=8099)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    mock = criar_mock(args.linhas, args.fornecedores, seed=args.seed, pagina=args.pagina, latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms, falha_503=args.falha_503, corte=args.corte)
+    print(f"--- MOCK SAP: {args.linhas} romaneios, {args.fornecedores} fornecedores ---")
+    print("Para apontar o app para o mock:")
+    for k, v in variaveis_ambiente(f"http://127.0.0.1:{args.porta}/sap/opu/odata/sap").items(): print(f"   {k}={v}")
+    mock.app.run(host="127.0.0.1", port=args.porta, threaded=True)
@@ -0,0 +1,120 @@
+# VERSÃO: 1.2 - Download particionado explícito (--particao-dias/--particao-workers), independente do SAP_PARTICAO_*
+import os
+import re
+import json
+import time
+import sys
+import argparse
+import logging
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger("relatorios_lote")
+
+TIPOS = ["resumido", "detalhado", "excel"]
+
+def _nome_arquivo(texto):
+    return re.sub(r'[^\w.\-]', '_', str(texto))
+
+# Roda num processo do pool: gera os arquivos de um parceiro e devolve a entrada do manifesto
+def gerar_parceiro(cod, nome, df, tipos, periodo_texto, saida):
+    from backend.sap_data import formatar_exibicao, calcular_totais
+    from backend.pdf_generator import gerar_pdf_resumido, gerar_pdf_detalhado
+    from backend.excel_generator import gerar_excel
+
+    inicio = time.time()
+    cod_txt = str(cod).lstrip('0') or str(cod)
+    parceiro_label = f"{nome} ({cod_txt})" if nome else cod_txt
+    infos = (parceiro_label, "TODOS OS MATERIAIS", "TODAS AS SAFRAS", "TODOS OS CONTRATOS", periodo_texto)
+    entrada = {"codigo": cod_txt, "nome": nome, "linhas": len(df), "totais": {k: round(float(v), 2) for k, v in calcular_totais(df).items()}, "arquivos": {}, "erros": []}
+    exibicao = formatar_exibicao(df) if {"resumido", "detalhado"} & set(tipos) else None
+
+    for tipo in tipos:
+        if tipo == "excel":
+            nome_arq = f"Relatorio_{_nome_arquivo(cod_txt)}.xlsx"
+            gerar = lambda destino: gerar_excel(df, destino=destino)
+        else:
+            nome_arq = f"{tipo.capitalize()}_{_nome_arquivo(cod_txt)}.pdf"
+            gerar_pdf = gerar_pdf_resumido if tipo == "resumido" else gerar_pdf_detalhado
+            gerar = lambda destino: gerar_pdf(exibicao, *infos, destino=destino)
+        caminho = os.path.join(saida, nome_arq)
+        # Mesma ideia da exportação da tela: escreve no .tmp e só troca quando ficou completo
+        if gerar(caminho + ".tmp"):
+            os.replace(caminho + ".tmp", caminho)
+            entrada["arquivos"][tipo] = nome_arq
+        else:
+            if os.path.exists(caminho + ".tmp"): os.remove(caminho + ".tmp")
+            entrada["erros"].append(f"falha ao gerar {tipo}")
+    entrada["segundos"] = round(time.time() - inicio, 2)
+    return entrada
+
+def executar(data_inicio, data_fim, saida, tipos=TIPOS, parceiros=None, workers=None, particao_dias=7, particao_workers=4):
+    from backend.sap_data import SAPConnector
+
+    os.makedirs(saida, exist_ok=True)
+    inicio = time.time()
+    # Uma única busca no período, sem filtro de Parceiro, em janelas de `particao_dias` baixadas em paralelo
+    # (0 = uma requisição serial); o corte por parceiro é feito em memória
+    df = SAPConnector().buscar_dados_por_periodo(data_inicio, data_fim, particao_dias=particao_dias, workers=particao_workers)
+    segundos_busca = round(time.time() - inicio, 2)
+    periodo_texto = f"{datetime.strptime(data_inicio, '%Y-%m-%d').strftime('%d/%m/%Y')} a {datetime.strptime(data_fim, '%Y-%m-%d').strftime('%d/%m/%Y')}"
+    manifesto = {"periodo": {"inicio": data_inicio, "fim": data_fim}, "gerado_em": datetime.now().isoformat(timespec='seconds'), "tipos": list(tipos), "linhas_sap": len(df), "segundos_busca": segundos_busca, "parceiros": []}
+
+    if df.empty:
+        print(f"Nenhum romaneio no período {periodo_texto}.")
+    else:
+        grupos = df.groupby("Cod. Parceiro", observed=True, sort=True)
+        if parceiros:
+            alvo = {str(p).strip().lstrip('0') for p in parceiros}
+            grupos = [(cod, parte) for cod, parte in grupos if str(cod).lstrip('0') in alvo]
+        else:
+            grupos = list(grupos)
+        print(f"{len(df)} romaneios, {len(grupos)} parceiros. Gerando {', '.join(tipos)} em {saida}...")
+
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futuros = {}
+            for cod, parte in grupos:
+                nome = str(parte["Razão Social"].iloc[0]) if "Razão Social" in parte.columns else ""
+                futuros[pool.submit(gerar_parceiro, cod, nome, parte.reset_index(drop=True), list(tipos), periodo_texto, saida)] = cod
+            for i, fut in enumerate(as_completed(futuros), start=1):
+                cod = futuros[fut]
+                try:
+                    entrada = fut.result()
+                except Exception as e:
+                    logger.error(f"[LOTE] Parceiro {cod} falhou: {e}")
+                    entrada = {"codigo": str(cod).lstrip('0'), "arquivos": {}, "erros": [str(e)]}
+                manifesto["parceiros"].append(entrada)
+                print(f"   [{i}/{len(futuros)}] {entrada['codigo']} {'OK' if not entrada['erros'] else 'ERRO: ' + '; '.join(entrada['erros'])}")
+
+    manifesto["parceiros"].sort(key=lambda e: e["codigo"])
+    manifesto["segundos_total"] = round(time.time() - inicio, 2)
+    with open(os.path.join(saida, "manifesto.json"), "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    falhas = sum(1 for e in manifesto["parceiros"] if e["erros"])
+    print(f"Concluído em {manifesto['segundos_total']}s: {len(manifesto['parceiros']) - falhas} parceiros OK, {falhas} com erro. Manifesto: {os.path.join(saida, 'manifesto.json')}")
+    return manifesto
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Gera os relatórios de todos os parceiros de um período com uma única busca no SAP.")
+    parser.add_argument("inicio", help="Data inicial (YYYY-MM-DD)")
+    parser.add_argument("fim", help="Data final (YYYY-MM-DD)")
+    parser.add_argument("--saida", default=os.path.join("relatorios", datetime.now().strftime("%Y%m%d_%H%M%S")), help="Diretório de saída")
+    parser.add_argument("--tipos", default="resumido,detalhado", help=f"Lista separada por vírgula entre {', '.join(TIPOS)}")
+    parser.add_argument("--parceiros", default="", help="Códigos separados por vírgula (padrão: todos do período)")
+    parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (padrão: núcleos da CPU)")
+    parser.add_argument("--particao-dias", type=int, default=7, help="Dias por janela do download do SAP (0 = sem partição)")
+    parser.add_argument("--particao-workers", type=int, default=4, help="Janelas baixadas ao mesmo tempo")
+    args = parser.parse_args()
+
+    tipos = [t.strip() for t in args.tipos.split(",") if t.strip()]
+    invalidos = [t for t in tipos if t not in TIPOS]
+    if invalidos: parser.error(f"tipo(s) inválido(s): {', '.join(invalidos)}")
+    parceiros = [p.strip() for p in args.parceiros.split(",") if p.strip()]
+    from backend.sap_data import ResultadoIncompletoSAP
+    try:
+        executar(args.inicio, args.fim, args.saida, tipos=tipos, parceiros=parceiros or None, workers=args.workers, particao_dias=args.particao_dias, particao_workers=args.particao_workers)
+    except ResultadoIncompletoSAP as e:
+        sys.exit(f"Download do SAP incompleto, nenhum relatório gerado: {e}")
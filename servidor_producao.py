@@ -0,0 +1,81 @@
+# VERSÃO: 1.0 - Entrada de produção: o `server` do Dash em gunicorn (vários processos, preload) ou waitress no Windows
+import os
+import sys
+import argparse
+import tempfile
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger("servidor_producao")
+
+# Com mais de um processo a busca pode cair num worker e a paginação/exportação em outro:
+# o cache de resultados precisa estar em disco. Fornecedores, store de romaneios, $metadata e
+# exportações já são arquivos compartilhados.
+def preparar_ambiente():
+    os.environ.setdefault("APP_CACHE_RESULTADOS_DIR", os.path.join(tempfile.gettempdir(), "rpp_resultados"))
+    # Thread criada antes do fork não existe nos workers: o aquecimento sobe depois, em cada worker
+    # (o lock em arquivo do Aquecedor deixa só um executar por vez)
+    aquecimento = os.environ.get("APP_AQUECIMENTO", "1") == "1"
+    os.environ["APP_AQUECIMENTO"] = "0"
+    return aquecimento
+
+def carregar_app():
+    import app
+    # Valida o $select uma vez no processo mestre; o pool HTTP usado nisso não pode ir para os workers
+    app.sap.esquema_romaneio()
+    app.sap.fechar_conexoes()
+    return app
+
+def iniciar_aquecimento(app):
+    app.aquecedor.iniciar(os.getenv("APP_AQUECIMENTO_HORARIOS", "auto"))
+
+def rodar_gunicorn(args, aquecimento):
+    from gunicorn.app.base import BaseApplication
+    app = carregar_app()
+
+    def post_fork(servidor, worker):
+        if aquecimento: iniciar_aquecimento(app)
+
+    # gthread: o batimento do worker não depende da requisição, então um download longo do SAP não é
+    # confundido com worker travado; `timeout` fica só como limite de segurança
+    opcoes = {"bind": f"{args.host}:{args.porta}", "workers": args.workers, "threads": args.threads, "worker_class": "gthread",
+              "preload_app": True, "timeout": args.timeout, "graceful_timeout": 30, "post_fork": post_fork,
+              "accesslog": "-", "max_requests": args.max_requests, "max_requests_jitter": max(1, args.max_requests // 10) if args.max_requests else 0}
+
+    class Aplicacao(BaseApplication):
+        def load_config(self):
+            for chave, valor in opcoes.items(): self.cfg.set(chave, valor)
+
+        def load(self):
+            return app.server
+
+    logger.info(f"[PRODUÇÃO] gunicorn em {args.host}:{args.porta}: {args.workers} workers x {args.threads} threads, cache em {os.environ['APP_CACHE_RESULTADOS_DIR']}")
+    Aplicacao().run()
+
+# Windows: sem fork, então um processo com várias threads; o cache em disco continua valendo entre reinícios
+def rodar_waitress(args, aquecimento):
+    from waitress import serve
+    app = carregar_app()
+    if aquecimento: iniciar_aquecimento(app)
+    logger.info(f"[PRODUÇÃO] waitress em {args.host}:{args.porta}: {args.threads} threads, cache em {os.environ['APP_CACHE_RESULTADOS_DIR']}")
+    serve(app.server, host=args.host, port=args.porta, threads=args.threads, channel_timeout=args.timeout)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Sobe o R.P.P para produção com vários workers e cache compartilhado.")
+    parser.add_argument("--servidor", choices=["gunicorn", "waitress"], default="waitress" if sys.platform == "win32" else "gunicorn")
+    parser.add_argument("--host", default=os.getenv("APP_HOST", "0.0.0.0"))
+    parser.add_argument("--porta", type=int, default=int(os.getenv("APP_PORTA", "8052")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("APP_WORKERS", str(min(4, os.cpu_count() or 1)))), help="Processos (só gunicorn)")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("APP_THREADS", "8")), help="Threads por processo")
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("APP_TIMEOUT_SEG", "600")), help="Limite por worker/conexão em segundos")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("APP_MAX_REQUESTS", "0")), help="Recicla o worker após N requisições (0 = nunca; só gunicorn)")
+    args = parser.parse_args()
+
+    aquecimento = preparar_ambiente()
+    try:
+        (rodar_gunicorn if args.servidor == "gunicorn" else rodar_waitress)(args, aquecimento)
+    except ModuleNotFoundError as e:
+        if e.name != args.servidor: raise
+        sys.exit(f"{args.servidor} não está instalado. Instale com: pip install {args.servidor}")